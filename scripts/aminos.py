@@ -1,59 +1,42 @@
-import json
 import logging
-import excel
+import multiprocessing
 import os
+import sys
+
+if __name__ == "__main__":
+    # the command line is in cli.py, it checks the arguments and the config before the imports below
+    # load pandas and numpy, the commands import this file again as the module aminos
+    import cli
+    multiprocessing.freeze_support()
+    sys.exit(cli.main())
+
+import excel
+import exporters
+import ingest
+import pipeline
+import profiling
+import result_cache
+import transfer
+import trends
+import re
 import datetime
+import glob
+import itertools
+import threading
+import numpy as np
 import pandas as pd
 from shutil import copyfile
-
-#setup logger for console and file
-logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s (%(lineno)s) - %(levelname)s: %(message)s", datefmt='%Y.%m.%d %H:%M:%S', filename="logger.log")
+from config import STAGES, default_config, read_config
 
 _logger = logging.getLogger("main")
-logFormatter = logging.Formatter("%(asctime)s - %(name)s (%(lineno)s) - %(levelname)s: %(message)s")
-consoleHandler = logging.StreamHandler()
-consoleHandler.setFormatter(logFormatter)
-consoleHandler.setLevel("INFO")
-_logger.addHandler(consoleHandler)
+
+# names of reanalyses taken by this process, see free_name
+_claimed_names = set()
+_names_lock = threading.Lock() # the service runs jobs in several threads
 
 #logging.basicConfig(format='%(asctime)s: %(levelname)s: %(message)s', level=logging.INFO)
 #_logger = logging.getLogger("main")
 
-def read_config(config_file = 'config.json', create_new_file=False):
-    _logger.info("read config file")
-    if create_new_file == False and os.path.isfile(config_file):
-        with open(config_file) as json_data_file:
-            data = json.load(json_data_file)
-    else:
-        _logger.warning("config file does not exist. A default config file has been created.")
-        data = {}
-        data['file_to_analyze'] = '../rohdaten_example.xlsx'
-        data['export_directory'] = '../analysed/'
-        data['file_extension_raw_data'] = '_Rohdaten.xlsx'
-        data['file_extension_analysis'] = '_Analyse.xlsx'
-        data['ignore_samples'] = ['SIGMA200', 'SIGMA500', 'Phe200', 'Phe1000']
-        data['control_name_prefix'] = 'Ko'
-        data['control_ring_samples'] = [61, 62, 31, 32]
-        data['max_normal_aminos'] = 21
-        data['control_reference_file_path'] = './reference/kontrollwerte.csv'
-        data['patients_reference_file_path'] = './reference/patienten_kontrollwerte.csv'
-        data['format_heading'] = {'bold': True} #, 'bg_color': '#f1f2f6'
-        data['format_number_invalid'] = {'bg_color': '#d1d8e0', 'font_color': '#636e72'}
-        data['format_number_valid'] = {'bg_color': '#2bcbba'} ##26de81
-        data['format_number_high'] = {'bg_color': '#fc5c65'}
-        data['format_number_low'] = {'bg_color': '#45aaf2'} 
-        data['prefer_control'] = 0
-        data['prefer_aminos'] = []
-        #warning-color: #fd9644, background: #4b6584
-        columns = {}
-        columns['sample_name'] = 'Sample Name'
-        data['columns'] = columns
-        
-        with open(config_file, 'w') as fp:
-            json.dump(data, fp, indent=4, sort_keys=True)
-            
-    return data
-
 def read_reference_data(filepath):
     filepath = os.path.abspath(filepath)
     _logger.info(F"read {filepath} reference data")
@@ -64,248 +47,833 @@ def read_reference_data(filepath):
         _logger.error(F"could not read reference data. File is missing: {filepath}")    
     return data
 
+def read_references(cfg):
+    references = {}
+    references['control_reference'] = read_reference_data(cfg['control_reference_file_path'])
+    references['patients_reference'] = read_reference_data(cfg['patients_reference_file_path'])
+    return references
     
-def read_raw_data(filepath):
+def read_raw_data(filepath, cache_directory=None, content=None):
     _logger.info("read raw data")
     data = {}
     if os.path.isfile(filepath):
-        data = pd.read_excel(filepath) 
+        data = ingest.load_raw_data(filepath, cache_directory, content)
     else:
         _logger.error(F"could not read raw data. File is missing: {filepath}")
     return data
 
+def read_raw_content(cfg):
+    """the raw file in memory for the archive copy and the parser of one analysis (background_io)
+
+    None with streaming_ingest, which reads the rows from the file to keep the memory low.
+    """
+    if cfg['background_io'] and not cfg['streaming_ingest'] and os.path.isfile(cfg['file_to_analyze']):
+        return ingest.read_file(cfg['file_to_analyze'])
+    return None
+
 def get_timestamp():
     return datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+
+def unique_name(claim):
+    """the timestamp, <timestamp>_1, _2 ... while claim(name) is False, e.g. for analyses within one second"""
+    timestamp = get_timestamp()
+    for count in itertools.count():
+        name = timestamp if count == 0 else F"{timestamp}_{count}"
+        if claim(name):
+            return name
+
+def make_directory(path):
+    """creates path, False if it exists already (another analysis took it)"""
+    try:
+        os.mkdir(path)
+        return True
+    except FileExistsError:
+        return False
+
+def free_name(directory, name):
+    """no file of an analysis name is in directory (<name>_Analyse.xlsx, its report and tables) and no
+    other thread of the process took it, its files are written later"""
+    path = os.path.join(directory, name)
+    with _names_lock:
+        if path in _claimed_names or len(glob.glob(glob.escape(path) + '_*')):
+            return False
+        _claimed_names.add(path)
+        return True
     
-def preparation(cfg, raw_data_file):
+def preparation(cfg, raw_data_file, transfers=None, raw_content=None):
+    """creates the export directory and copies the raw data into it, with transfers in the background
+
+    raw_content is the raw file already read by read_raw_content, the copy is written from it.
+    """
     _logger.info("prepare output directory and copy raw data")
-    timestamp = get_timestamp()
-    export_dir = cfg['export_directory']
-    export_dir = os.path.join(export_dir, timestamp)
-    if not os.path.isdir(export_dir):
-        os.makedirs(export_dir)
+    os.makedirs(cfg['export_directory'], exist_ok=True)
+    # a new directory for every analysis, the service or the result cache finish several per second
+    timestamp = unique_name(lambda name: make_directory(os.path.join(cfg['export_directory'], name)))
+    export_dir = os.path.join(cfg['export_directory'], timestamp)
     excel_sheet = timestamp + cfg['file_extension_analysis']
     
     raw_copy_filename = timestamp + cfg['file_extension_raw_data']
     
-    copyfile(raw_data_file, os.path.join(export_dir, raw_copy_filename))
+    if transfers is None:
+        copyfile(raw_data_file, os.path.join(export_dir, raw_copy_filename))
+    elif raw_content is not None:
+        # the parser takes the raw data from the same buffer, the file is read once
+        transfers.write(os.path.join(export_dir, raw_copy_filename), raw_content)
+    else:
+        transfers.copy(raw_data_file, os.path.join(export_dir, raw_copy_filename))
     
     return export_dir, excel_sheet
     
-def filter_raw_data(cfg, data):
+def match_amino(column, aminos):
+    """the reference amino of a raw column: its name or its name followed by a suffix (Thy, Thy_ph, Thy mit IS)"""
+    matches = [amino for amino in aminos if column == amino or (column.startswith(amino) and not column[len(amino)].isalnum())]
+    if not len(matches):
+        return None
+    return max(matches, key=len)
+
+def build_column_index(cfg, columns, control_reference, patients_reference):
+    """maps the raw columns to the reference aminos, built once per raw file and shared by all stages
+
+    aminos:           reference aminos in the order of the control reference
+    variants:         amino -> raw columns of the amino (Thy, Thy_ph, Thy_hp4)
+    amino_of:         raw column -> amino
+    positions:        raw column -> position
+    amino_columns:    raw columns belonging to an amino
+    meta:             leading columns without amino (index, sample name)
+    control_min/max:  (rings + 1, columns) limits, the last row stays NaN for unknown controls
+    patients_min/max: (columns,) limits
+    """
+    columns = list(columns)
+    aminos = [col for col in control_reference.columns.values if col not in ('controls', 'limits')]
+    index = {}
+    index['columns'] = columns
+    index['aminos'] = aminos
+    index['positions'] = {col: pos for pos, col in enumerate(columns)}
+    index['variants'] = {amino: [] for amino in aminos}
+    index['amino_of'] = {}
+    for col in columns:
+        amino = match_amino(str(col), aminos)
+        if amino is not None:
+            index['variants'][amino].append(col)
+            index['amino_of'][col] = amino
+        elif len(index['amino_of']):
+            _logger.debug("column %s belongs to no reference amino", col)
+    index['amino_columns'] = [col for col in columns if col in index['amino_of']]
+    first_amino = index['positions'][index['amino_columns'][0]] if len(index['amino_columns']) else len(columns)
+    index['meta'] = columns[:first_amino]
+
+    # align the reference limits to the raw columns
+    amino_pos = [index['positions'][col] for col in index['amino_columns']]
+    amino_names = [index['amino_of'][col] for col in index['amino_columns']]
+    rings = cfg['control_ring_samples']
+    index['control_min'] = np.full((len(rings) + 1, len(columns)), np.nan)
+    index['control_max'] = np.full((len(rings) + 1, len(columns)), np.nan)
+    for ring_pos, ring in enumerate(rings):
+        matched_control = control_reference[control_reference['controls'] == ring]
+        control_min = matched_control[matched_control['limits'] == 'min']
+        control_max = matched_control[matched_control['limits'] == 'max']
+        if control_min.empty or control_max.empty:
+            _logger.error(F"control {ring} has no min/max limits in the control reference")
+            continue
+        index['control_min'][ring_pos, amino_pos] = control_min[amino_names].iloc[0].to_numpy(dtype=float)
+        index['control_max'][ring_pos, amino_pos] = control_max[amino_names].iloc[0].to_numpy(dtype=float)
+
+    patients_limits = patients_reference.reindex(columns=amino_names)
+    index['patients_min'] = np.full(len(columns), np.nan)
+    index['patients_max'] = np.full(len(columns), np.nan)
+    index['patients_min'][amino_pos] = patients_limits.iloc[0].to_numpy(dtype=float)
+    index['patients_max'][amino_pos] = patients_limits.iloc[1].to_numpy(dtype=float)
+    return index
+
+def filter_raw_data(cfg, data, column_index):
     _logger.info("ignore samples: " + ', '.join(cfg['ignore_samples']))
     column_name = cfg['columns']['sample_name']
     ignore = cfg['ignore_samples']
     control_name = cfg['control_name_prefix']
-    data = data[data[column_name].isin(ignore) == False] # remove all unused samples from matrix
+    data = data[data[column_name].isin(ignore) == False].copy() # remove all unused samples from matrix
+    # set invalid values ("No Peak") to NaN
+    amino_columns = column_index['amino_columns']
+    data[amino_columns] = data[amino_columns].apply(pd.to_numeric, errors='coerce')
     controls_idx = data[column_name].str.contains(control_name, na=False) # get idx with controls
-    
+
     _logger.info("split into controls and patient data")
-    controls = data[controls_idx]                # get controls from matrix
-    data = data[controls_idx == False]           # remove controls from data matrix
-    # set invalid values to None
-    controls = controls.replace("No Peak", None)
-    data = data.replace("No Peak", None)
-    # end set
+    controls = data[controls_idx].copy()         # get controls from matrix
+    data = data[controls_idx == False].copy()    # remove controls from data matrix
     _logger.info("sort data")
     controls[column_name] = controls[column_name].astype(str)
     controls.sort_values(column_name, axis=0, ascending=True, inplace=True) # sort ascending
+    controls[column_name] = controls[column_name].astype('category') # few names, repeated every block
     data[column_name] = data[column_name].astype(str)
     data.sort_values(column_name, axis=0, ascending=True, inplace=True) # sort ascending
     return data, controls
-    
-def check_controls(cfg, data):
+
+def read_raw_header(filepath):
+    """the column names of a raw data file without reading its rows"""
+    return ingest.header_names(next(ingest.iter_rows(filepath), ()))
+
+def stream_raw_data(cfg, filepath, column_index):
+    """reads and splits a raw data file row by row, the result equals filter_raw_data(read_raw_data(...))
+
+    Ignored samples are dropped while reading, the amino values of controls and patients go
+    straight into float buffers ("No Peak" as NaN). No frame of the whole file is built, the
+    memory grows with the kept rows only. Reads xlsx and csv files.
+    """
+    _logger.info("stream raw data, ignore samples: " + ', '.join(cfg['ignore_samples']))
+    columns = column_index['columns']
+    sample_pos = column_index['positions'][cfg['columns']['sample_name']]
+    ignore = set(cfg['ignore_samples'])
+    control_name = re.compile(cfg['control_name_prefix'])
+    amino_pos = [column_index['positions'][col] for col in column_index['amino_columns']]
+    other_pos = [pos for pos, col in enumerate(columns) if col not in column_index['amino_of']]
+
+    groups = {}
+    for group in ('controls', 'data'):
+        groups[group] = {'index': [], 'names': [], 'other': [[] for _ in other_pos], 'values': ingest.RowBuffer(len(amino_pos))}
+    rows = ingest.iter_rows(filepath)
+    next(rows) # header
+    for row_idx, row in enumerate(rows):
+        row = tuple(row) + (None,) * (len(columns) - len(row))
+        name = ingest.cell_value(row[sample_pos])
+        if name in ignore:
+            continue
+        # like str.contains(control_name, na=False), numeric sample names are never controls
+        group = groups['controls' if isinstance(name, str) and control_name.search(name) else 'data']
+        group['index'].append(row_idx)
+        group['names'].append(str(name))
+        for values, pos in zip(group['other'], other_pos):
+            values.append(ingest.cell_value(row[pos]))
+        group['values'].append([ingest.cell_number(row[pos]) for pos in amino_pos])
+
+    _logger.info("sort data")
+    frames = []
+    for group in (groups['data'], groups['controls']):
+        # stable sort by name, only the kept rows are copied once into their final order
+        order = sorted(range(len(group['names'])), key=group['names'].__getitem__)
+        frame = {}
+        for values, pos in zip(group['other'], other_pos):
+            frame[columns[pos]] = pd.Series([values[idx] for idx in order], dtype=object).infer_objects()
+        names = pd.Series([group['names'][idx] for idx in order], dtype=object)
+        frame[columns[sample_pos]] = names.astype('category') if group is groups['controls'] else names
+        amino_values = group['values'].take(order)
+        for amino_idx, col in enumerate(column_index['amino_columns']):
+            frame[col] = amino_values[:, amino_idx]
+        index = pd.Index([group['index'][idx] for idx in order], dtype='int64')
+        frames.append(pd.DataFrame({col: frame[col] for col in columns}).set_axis(index, axis=0))
+    return frames[0], frames[1]
+
+# status codes of a checked control value, STATUS_NAMES maps them to the labels used in the export
+STATUS_NONE = 0
+STATUS_TOO_LOW = 1
+STATUS_NORMAL = 2
+STATUS_TOO_HIGH = 3
+STATUS_NAMES = np.array(['NONE', 'TOO_LOW', 'NORMAL', 'TOO_HIGH'], dtype=object)
+
+# flags of the patient values, see patient_flags
+FLAG_INVALID = -1
+FLAG_NORMAL = 0
+FLAG_TOO_LOW = 1
+FLAG_TOO_HIGH = 2
+FLAG_NAMES = {FLAG_INVALID: 'INVALID', FLAG_NORMAL: 'NORMAL', FLAG_TOO_LOW: 'TOO_LOW', FLAG_TOO_HIGH: 'TOO_HIGH'}
+
+def match_control_rings(cfg, control_names):
+    """returns for each control name the position of its ring in cfg['control_ring_samples'] or -1"""
+    rings = cfg['control_ring_samples']
+    control_names = pd.Series(control_names).astype(str).to_numpy()
+    ring_idx = np.full(len(control_names), -1, dtype=np.intp)
+    for control_name in pd.unique(control_names):
+        # the first ring of the settings which is part of the name wins
+        matches = [pos for pos, num in enumerate(rings) if str(num) in control_name]
+        if not len(matches):
+            _logger.error('control "%s" can not be found in settings "control_ring_samples"', control_name)
+        else:
+            _logger.info("processing control %s for %s", rings[matches[0]], control_name)
+            ring_idx[control_names == control_name] = matches[0]
+    return ring_idx
+
+def control_rings(cfg, controls):
+    """the ring of every control as categorical of cfg['control_ring_samples'], its codes are the ring positions"""
+    ring_idx = match_control_rings(cfg, controls[cfg['columns']['sample_name']])
+    return pd.Categorical.from_codes(ring_idx, categories=cfg['control_ring_samples'])
+
+def classify_controls(values, ring_idx, limit_min, limit_max):
+    """classifies a (controls, columns) value matrix into an int8 status matrix, NaN values or limits stay NONE"""
+    val_min = limit_min[ring_idx] # ring_idx -1 selects the NaN row
+    val_max = limit_max[ring_idx]
+    status = np.full(values.shape, STATUS_NONE, dtype=np.int8)
+    with np.errstate(invalid='ignore'):
+        status[values < val_min] = STATUS_TOO_LOW
+        status[values > val_max] = STATUS_TOO_HIGH
+        status[(values <= val_max) & (values >= val_min)] = STATUS_NORMAL
+    return status
+
+def check_controls_status(cfg, data):
     controls = data['controls']
-    control_reference = data['control_reference']
-    ret = pd.DataFrame().reindex_like(controls)
-    ret[ret.isnull()] = 'NONE'
-    
+    column_index = data['column_index']
     str_ring_samples = ', '.join(str(s) for s in cfg['control_ring_samples'])
     _logger.info(F"check for following controls: {str_ring_samples}")
-    
-    for idx_row, row_data in controls.iterrows():
-        # search in the controls for control ring samples
-        control_name = row_data[cfg['columns']['sample_name']]
-        matches = [num for num in cfg['control_ring_samples'] if str(num) in control_name]
-        # check if a match exist
-        if not len(matches):
-            _logger.error('control can not be found in settings "control_ring_samples"')
-        else:
-            match = matches[0]
-            _logger.info(F"processing control {match} for {control_name}")
-            
-            # get the limits from the reference frame
-            matched_control = control_reference[control_reference['controls'] == match]
-            control_min = matched_control[matched_control['limits'] == 'min']
-            control_max = matched_control[matched_control['limits'] == 'max']
-            
-            for col in control_reference.columns.values:
-                val_min = control_min[col].item() 
-                val_max = control_max[col].item()
-                
-                col_names = controls.columns[controls.columns.str.contains(pat = col)]
-                if (len(col_names)):
-                
-                    control_idx_bo = (controls[cfg['columns']['sample_name']] == control_name)
-                    
-                    for col_name in col_names:
-                        _logger.debug(F"{col} = {col_name}: {val_min} < {controls[col_name][control_idx_bo].to_string(index=False)} > {val_max}")
-                        #print(F"{controls[col_name]}  :  {val_min}")
-                        #print(controls[col_name])
-                        ret[col_name][control_idx_bo & (controls[col_name] < val_min)] = 'TOO_LOW'
-                        ret[col_name][control_idx_bo & (controls[col_name] > val_max)] = 'TOO_HIGH'
-                        ret[col_name][control_idx_bo & (controls[col_name] <= val_max) & (controls[col_name] >= val_min)] = 'NORMAL'
-                        
-    return ret
 
-def select_control(cfg, data):
-    dat = {}
+    rings = data['control_rings'] if 'control_rings' in data else control_rings(cfg, controls)
+    ring_idx = rings.codes # -1 without ring
+    values = np.full(controls.shape, np.nan)
+    amino_pos = [column_index['positions'][col] for col in column_index['amino_columns']]
+    values[:, amino_pos] = controls[column_index['amino_columns']].to_numpy(dtype=float)
+
+    return classify_controls(values, ring_idx, column_index['control_min'], column_index['control_max'])
+
+def status_labels(controls, status):
+    """the status matrix as data frame of categorical labels for the export, one byte per value"""
+    labels = {pos: pd.Categorical.from_codes(status[:, pos], categories=STATUS_NAMES) for pos in range(status.shape[1])}
+    checked = pd.DataFrame(labels, index=controls.index)
+    checked.columns = controls.columns
+    return checked
+
+def check_controls(cfg, data):
+    return status_labels(data['controls'], check_controls_status(cfg, data))
+
+def score_controls(cfg, data):
+    """splits the checked controls by ring and counts the NORMAL values of all rings and columns at once"""
     controls = data['controls']
     checked_controls = data['checked_controls']
-    best_control = [0, 0]
-    second_best_control = [0, 0]
-    #max_prios_score = 0
-    #best_control = 0
-    dat['data'] = {}
-    for ring in cfg['control_ring_samples']:
-        column_name = cfg['columns']['sample_name']
-        # split up the controls
-        mask = controls[column_name].str.contains(str(ring))
-        if any(mask):
-            ring_data = {} 
+    column_name = cfg['columns']['sample_name']
+    # (rings, controls) membership, a control belongs to every ring contained in its name
+    membership = np.array([controls[column_name].str.contains(str(ring)).to_numpy(dtype=bool) for ring in cfg['control_ring_samples']])
+    membership = membership.reshape(len(cfg['control_ring_samples']), len(controls))
+    normal = (data['control_status'] == STATUS_NORMAL).astype(np.int32)
+    counts = membership.astype(np.int32) @ normal # (rings, columns)
+
+    rings = {}
+    for ring_pos, ring in enumerate(cfg['control_ring_samples']):
+        mask = membership[ring_pos]
+        if mask.any():
+            ring_data = {}
             ring_data['data'] = controls[mask]
             ring_data['checked'] = checked_controls[mask]
-            
-            counts = ring_data['checked'].apply(pd.value_counts).fillna(0)
-            ring_data['score'] = counts[(counts.index == 'NORMAL')]
-            dat['data'][str(ring)] = ring_data
-            
-            ring_data['prios'], ring_data['conflicts'] = switch_amino_columns(cfg, ring, ring_data['score'])
-            ring_data['prios_score'] = ring_data['prios'].sum(axis = 1, skipna = True).item()
-            _logger.debug(ring_data['prios_score'])
-            
-            if best_control[1] < ring_data['prios_score']:
-                second_best_control = best_control.copy()
-                best_control[1] = ring_data['prios_score'] 
-                best_control[0] = ring
-    
+            ring_data['score'] = pd.DataFrame(counts[ring_pos:ring_pos+1].astype(float), index=['NORMAL'], columns=controls.columns)
+            rings[str(ring)] = ring_data
+    return rings
+
+def select_variants(cfg, counts, column_index):
+    """picks the variant with the most NORMAL values of every amino for all rings at once
+
+    counts are the (rings, columns) NORMAL counts. Returns the (rings, aminos) positions of the
+    selected columns (-1 for aminos without column) and the (rings, aminos, variants) mask of
+    variants tied with the best one. Ties are settled by prefer_aminos, the last preferred
+    variant wins, otherwise the first one.
+    """
+    positions = column_index['positions']
+    groups = [[positions[col] for col in column_index['variants'][amino]] for amino in column_index['aminos']]
+    width = max([len(group) for group in groups] + [1])
+    group_pos = np.full((len(groups), width), -1)
+    for amino_pos, group in enumerate(groups):
+        group_pos[amino_pos, :len(group)] = group
+    valid = group_pos >= 0
+
+    group_scores = np.where(valid, counts[:, group_pos], -1) # (rings, aminos, variants)
+    best = group_scores.argmax(axis=2) # first maximum like idxmax
+    best_score = np.take_along_axis(group_scores, best[..., None], axis=2)
+    tied = valid & (group_scores == best_score) & (best_score != 0)
+
+    if len(cfg['prefer_aminos']) > 0:
+        prefer = set(cfg['prefer_aminos'])
+        preferred = np.array([[pos >= 0 and column_index['columns'][pos] in prefer for pos in row] for row in group_pos], dtype=bool)
+        preferred = preferred.reshape(group_pos.shape)
+        candidates = tied & preferred & (np.arange(width) != best[..., None])
+        last_candidate = width - 1 - candidates[..., ::-1].argmax(axis=2)
+        best = np.where(candidates.any(axis=2), last_candidate, best)
+
+    selected = np.take_along_axis(np.broadcast_to(group_pos, group_scores.shape), best[..., None], axis=2)[..., 0]
+    tied &= tied.sum(axis=2, keepdims=True) > 1
+    return selected, tied, group_pos
+
+def rank_controls(cfg, rings, column_index):
+    """picks the amino variants of every ring (depends on prefer_aminos) and ranks the rings"""
+    dat = {}
+    best_control = [0, 0]
+    second_best_control = [0, 0]
+    dat['data'] = rings
+    dat['ties'] = []
+    ring_names = [ring for ring in cfg['control_ring_samples'] if str(ring) in rings]
+    if not len(ring_names):
+        _logger.error("none of the control_ring_samples has been found in the controls")
+    columns = column_index['columns']
+    meta_pos = [column_index['positions'][col] for col in column_index['meta']]
+    counts = np.array([rings[str(ring)]['score'].to_numpy()[0] for ring in ring_names]).reshape(len(ring_names), len(columns))
+    selected, tied, group_pos = select_variants(cfg, counts, column_index)
+
+    for ring_pos, ring in enumerate(ring_names):
+        ring_data = rings[str(ring)]
+        score = ring_data['score']
+        selected_pos = selected[ring_pos][selected[ring_pos] >= 0]
+        prios = np.full(len(columns), np.nan)
+        prios[meta_pos] = counts[ring_pos, meta_pos]
+        prios[selected_pos] = counts[ring_pos, selected_pos]
+        ring_data['prios'] = pd.DataFrame(prios[None], index=score.index, columns=score.columns)
+
+        # report the ties, without preferences as conflicts (first variant, other variant)
+        ring_data['conflicts'] = []
+        for amino_pos in np.flatnonzero(tied[ring_pos].any(axis=1)):
+            variants = [columns[pos] for pos in group_pos[amino_pos][tied[ring_pos, amino_pos]]]
+            winner = columns[selected[ring_pos, amino_pos]]
+            tie_score = counts[ring_pos, selected[ring_pos, amino_pos]]
+            dat['ties'].append({'control': ring, 'amino': column_index['aminos'][amino_pos], 'variants': variants, 'score': tie_score, 'selected': winner})
+            if len(cfg['prefer_aminos']) > 0:
+                if winner in cfg['prefer_aminos']:
+                    _logger.info("Take prefered AS from setting: %s", winner)
+                else:
+                    _logger.warning("Prefered AS for control %s could not be found in settings file. %s", ring, ' vs '.join(variants))
+            else:
+                for col in variants[1:]:
+                    ring_data['conflicts'].append((variants[0], col))
+                    _logger.warning("Conflict in control %s with %s and %s (score %s), took %s", ring, variants[0], col, tie_score, variants[0])
+
+        ring_data['prios_score'] = np.nansum(prios)
+        _logger.debug(ring_data['prios_score'])
+
+        if best_control[1] < ring_data['prios_score']:
+            second_best_control = best_control.copy()
+            best_control[1] = ring_data['prios_score']
+            best_control[0] = ring
+
     dat['best_control_score'] = best_control[1]
     dat['best_control_name'] = best_control[0]
     dat['second_best_control_score'] = second_best_control[1]
     dat['second_best_control_name'] = second_best_control[0]
-    
-    if dat['best_control_score'] == dat['best_control_name']:
-        _logger.warnung("both controls does have the same score, took first")
+
+    if dat['best_control_score'] == dat['second_best_control_score']:
+        _logger.warning("both controls does have the same score, took first")
     _logger.info(F"1. control: {str(dat['best_control_name'])}, score: {str(dat['best_control_score'])}")
     _logger.info(F"2. control: {str(dat['second_best_control_name'])}, score: {str(dat['second_best_control_score'])}")
-        
+
     return dat
 
-def switch_amino_columns(cfg, control, score):
-    ret = pd.DataFrame().reindex_like(score)
-    conflicts = []
-    for col in score.columns:
-        if (score.columns.get_loc(col) <= cfg['max_normal_aminos']):
-            aminos = score.columns.str.startswith(col)
-            idx_name = score[score.columns[aminos]].idxmax(axis=1)
-            # check for equal amino pairs 
-            for col in score[score.columns[aminos]].columns:
-                if col == idx_name.item():
-                    continue
-                if score[col].item() == score[idx_name.item()].item() and score[col].item() != 0:
-                    # take preferation from settings
-                    if len(cfg['prefer_aminos']) > 0:
-                        if (col in cfg['prefer_aminos']): # switch to preferation
-                            _logger.info(F"Take prefered AS from setting {col}")
-                            idx_name = col
-                        elif (idx_name.item() in cfg['prefer_aminos']):
-                            _logger.info(F"Take prefered AS from setting: {idx_name.item()}")
-                            idx_name = idx_name.item()
-                        else:
-                            _logger.warning(F"Prefered AS for control {str(control)} could not be found in settings file. {col} vs {idx_name.item()}")
-                    else:
-                        conflicts.append((idx_name.item(), col))
-                        _logger.warning(F"Conflict in control {str(control)} with {idx_name.item()} and {col} (score {score[col].item()}), took {idx_name.item()}")
-            ret[idx_name] = score[idx_name]
-    
-    return ret, conflicts       
+class InvalidPreference(ValueError):
+    """prefer_control or prefer_aminos names a ring or a column the analysed plate does not have"""
 
-def filter_patients_data(cfg, data):
-    # overwrite 
+def select_control(cfg, data):
+    unknown = [col for col in cfg['prefer_aminos'] if col not in data['column_index']['amino_columns']]
+    if len(unknown):
+        raise InvalidPreference(F"prefer_aminos: {', '.join(map(str, unknown))} are no amino columns of this plate")
+    return rank_controls(cfg, score_controls(cfg, data), data['column_index'])
+
+def used_control(cfg, data):
+    """the ring the patients are evaluated with: prefer_control overwrites the best one"""
     if cfg['prefer_control'] != 0:
-        best_control = str(cfg['prefer_control'])
-    else:
-        best_control = str(data['selected_control']['best_control_name'])
+        return str(cfg['prefer_control'])
+    return str(data['selected_control']['best_control_name'])
+
+def filter_patients_data(cfg, data):
+    best_control = used_control(cfg, data)
+    if best_control not in data['selected_control']['data']:
+        raise InvalidPreference(F"prefer_control: {best_control} is no control ring of this plate, "
+                                F"it has {', '.join(data['selected_control']['data'])}")
     dat = data['selected_control']['data'][best_control]['prios']
+    column_index = data['column_index']
+
+    _logger.info("sort out invalid AS from patients data")
+    # the chosen variant of every amino in the order of the reference
+    selected = [col for col in column_index['amino_columns'] if dat[col].notnull().item()]
+    selected.sort(key=lambda col: column_index['aminos'].index(column_index['amino_of'][col]))
+    sorted_cols = column_index['meta'] + selected
+    # aminos without any NORMAL control value are marked invalid
+    idx_invalids = [sorted_cols.index(col) for col in selected if dat[col].item() == 0]
+
+    _logger.info("sorting patients data")
+    new_patients = data['data'][sorted_cols]
+
+    ## prepare columns for best control
+    new_control = data['selected_control']['data'][best_control]['data'][sorted_cols]
+
+    return (new_patients, idx_invalids, new_control)
+
+def patient_flags(data):
+    """int8 flag matrix of data_filtered: a row per patient, a column per amino column after the meta columns
     
-    idx_not_null = dat.isnull() == False
-    idx_zero = dat == 0
-    
-    _logger.info("sort out invalid AS from patients data") 
-    idx_valids = []
-    for idx, val in idx_not_null.T.iterrows(): 
-        if val.item() == True:
-            idx_valids.append(idx_not_null.columns.get_loc(idx))
-    
-    idx_invalids = []
-    for idx, val in idx_zero.T.iloc[2:].iterrows(): 
-        if val.item() == True:
-            idx_invalids.append(idx_zero.columns.get_loc(idx))
-    
-    patients = data['data'].copy()
-    #patients.loc[:, [idx_valids]]
-    filtered_patients = patients[patients.columns[idx_valids]]
+    FLAG_TOO_LOW/FLAG_TOO_HIGH outside of the patient reference, FLAG_INVALID for every value of an 
+    amino without a NORMAL control value (idx_invalids), FLAG_NORMAL otherwise. Aminos without patient 
+    reference and missing values ("No Peak") are FLAG_NORMAL.
+    """
+    patients = data['data_filtered']
+    column_index = data['column_index']
+    n_meta = len(column_index['meta'])
+    amino_names = patients.columns[n_meta:]
+    amino_pos = [column_index['positions'][col] for col in amino_names]
+    values = patients[amino_names].to_numpy(dtype=float)
+    flags = np.full(values.shape, FLAG_NORMAL, dtype=np.int8)
+    with np.errstate(invalid='ignore'):
+        flags[values < column_index['patients_min'][amino_pos]] = FLAG_TOO_LOW
+        flags[values > column_index['patients_max'][amino_pos]] = FLAG_TOO_HIGH
+    flags[:, np.asarray(data['idx_invalids'], dtype=int) - n_meta] = FLAG_INVALID
+    return flags
+
+def patient_flags_frame(cfg, data):
+    """patient_flags as frame, the sample names as index and the amino columns as columns"""
+    patients = data['data_filtered']
+    amino_names = patients.columns[len(data['column_index']['meta']):]
+    return pd.DataFrame(data['patient_flags'], index=patients[cfg['columns']['sample_name']].to_numpy(), columns=amino_names)
+
+def result_tables(cfg, data):
+    """the results as flat tables for other systems (see exporters), one row per value
     
-    _logger.info("sorting patients data") 
-    lis = list(filtered_patients.columns.values)
-    sorted_cols = lis[0:2] # ignore first two columns
-    aminos_sorted = sorted(filtered_patients.columns[2:])
-    sorted_cols.extend(aminos_sorted)
-    #change place of Ile and Leu
-    tmp = sorted_cols[10]
-    sorted_cols[10] = sorted_cols[11]
-    sorted_cols[11] = tmp
+    patients:  sample, column, amino, value, flag (FLAG_*) and its name, patient reference min/max
+    control:   the values and statuses (STATUS_NAMES) of the ring the patients are evaluated with
+    rings:     score of every ring, whether it is the best or the used one, its number of conflicts
+    conflicts: tied amino variants of every ring and the selected one
+    """
+    column_index = data['column_index']
+    sample_name = cfg['columns']['sample_name']
+    patients = data['data_filtered']
+    amino_names = list(patients.columns[len(column_index['meta']):])
+    amino_pos = [column_index['positions'][col] for col in amino_names]
+    # the column and amino names as categoricals, a code per value instead of a string
+    column_codes = np.arange(len(amino_names))
+    amino_codes = np.array([column_index['aminos'].index(column_index['amino_of'][col]) for col in amino_names], dtype=int)
+    flags = data['patient_flags'].ravel()
+    n_patients = len(patients)
+    tables = {}
+    tables['patients'] = pd.DataFrame({
+        'sample': np.repeat(patients[sample_name].astype(str).to_numpy(), len(amino_names)),
+        'column': pd.Categorical.from_codes(np.tile(column_codes, n_patients), categories=amino_names),
+        'amino': pd.Categorical.from_codes(np.tile(amino_codes, n_patients), categories=column_index['aminos']),
+        'value': patients[amino_names].to_numpy(dtype=float).ravel(),
+        'flag': flags,
+        'flag_name': pd.Categorical.from_codes(flags - FLAG_INVALID, categories=[FLAG_NAMES[flag] for flag in sorted(FLAG_NAMES)]),
+        'reference_min': np.tile(column_index['patients_min'][amino_pos], n_patients),
+        'reference_max': np.tile(column_index['patients_max'][amino_pos], n_patients)})
     
-    new_patients = filtered_patients.reindex(sorted_cols, axis=1)
+    used = used_control(cfg, data)
+    control = data['control_filtered']
+    control_rows = data['controls'].index.get_indexer(control.index)
+    status = data['control_status'][control_rows][:, amino_pos].ravel()
+    tables['control'] = pd.DataFrame({
+        'ring': used,
+        'sample': np.repeat(control[sample_name].astype(str).to_numpy(), len(amino_names)),
+        'column': pd.Categorical.from_codes(np.tile(column_codes, len(control)), categories=amino_names),
+        'amino': pd.Categorical.from_codes(np.tile(amino_codes, len(control)), categories=column_index['aminos']),
+        'value': control[amino_names].to_numpy(dtype=float).ravel(),
+        'status': status,
+        'status_name': pd.Categorical.from_codes(status, categories=STATUS_NAMES)})
     
-    ## prepare columns for best control
-    control = data['selected_control']['data'][best_control]['data'].copy()
-    control = control[patients.columns[idx_valids]]
-    new_control = control.reindex(sorted_cols, axis=1)
+    selected = data['selected_control']
+    rings = selected['data']
+    tables['rings'] = pd.DataFrame({
+        'ring': list(rings),
+        'score': [float(ring_data['prios_score']) for ring_data in rings.values()],
+        'best': [ring == str(selected['best_control_name']) for ring in rings],
+        'used': [ring == used for ring in rings],
+        'conflicts': [len(ring_data['conflicts']) for ring_data in rings.values()]})
+    tables['conflicts'] = pd.DataFrame(
+        [(str(tie['control']), tie['amino'], ', '.join(tie['variants']), float(tie['score']), tie['selected']) for tie in selected['ties']],
+        columns=['ring', 'amino', 'variants', 'score', 'selected'])
+    return tables
+
+class AnalysisData:
+    """the results of one analysis, filled stage by stage by analyse
+
+    Reads like the dict it replaces (data['controls']), unknown keys raise a KeyError.
+    export_dir, export_excel_path: output of the run
+    raw_data_file, raw_data:       input file and its frame (None with streaming_ingest)
+    control_reference, patients_reference: reference tables
+    column_index:                  see build_column_index
+    data, controls:                patients and controls, float amino columns with NaN for "No Peak",
+                                   the control names categorical
+    control_rings:                 categorical ring of every control, NaN without ring
+    control_status:                int8 status matrix of the controls (STATUS_*)
+    checked_controls:              control_status as categorical labels for the export
+    selected_control:              see rank_controls
+    data_filtered, idx_invalids, control_filtered: see filter_patients_data
+    patient_flags:                 int8 flag matrix of data_filtered (FLAG_*), see patient_flags
+    export_paths:                  files of the output_formats besides xlsx, see export_tables
+    stage_keys:                    value -> key of the stage which computed it, see run_stages
+    """
+    __slots__ = ('export_dir', 'export_excel_path', 'raw_data_file', 'raw_data', 'control_reference',
+                 'patients_reference', 'column_index', 'data', 'controls', 'control_rings', 'control_status',
+                 'checked_controls', 'selected_control', 'data_filtered', 'idx_invalids', 'control_filtered',
+                 'patient_flags', 'export_paths', 'stage_keys')
+
+    def __init__(self, **fields):
+        for key in self.__slots__:
+            setattr(self, key, None)
+        self.update(fields)
+
+    def __getitem__(self, key):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __setitem__(self, key, value):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        setattr(self, key, value)
+
+    def __contains__(self, key):
+        return key in self.__slots__ and getattr(self, key) is not None
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+    def keys(self):
+        return [key for key in self.__slots__ if key in self]
+
+    def update(self, fields):
+        for key, value in fields.items():
+            self[key] = value
+
+    def copy(self):
+        """a shallow copy, the frames are shared"""
+        return AnalysisData(**{key: self[key] for key in self.keys()})
+
+def no_progress(stage):
+    pass
+
+def run_read_raw_data(cfg, inputs):
+    if cfg['streaming_ingest']:
+        # the rows are read in the filter stage, the raw sheet of the export reads them again
+        return {'raw_data': None}
+    raw_data = read_raw_data(inputs['raw_data_file'], cfg['cache_directory'], inputs['raw_content'])
+    profiling.annotate(**profiling.shape(raw_data))
+    return {'raw_data': raw_data}
+
+def run_read_control_reference(cfg, inputs):
+    return {'control_reference': read_reference_data(inputs['control_reference_file'])}
+
+def run_read_patients_reference(cfg, inputs):
+    return {'patients_reference': read_reference_data(inputs['patients_reference_file'])}
+
+def run_build_column_index(cfg, inputs):
+    columns = read_raw_header(inputs['raw_data_file']) if cfg['streaming_ingest'] else inputs['raw_data'].columns
+    column_index = build_column_index(cfg, columns, inputs['control_reference'], inputs['patients_reference'])
+    profiling.annotate(columns=len(column_index['columns']), aminos=len(column_index['aminos']))
+    return {'column_index': column_index}
+
+def run_filter_raw_data(cfg, inputs):
+    if cfg['streaming_ingest']:
+        patients, controls = stream_raw_data(cfg, inputs['raw_data_file'], inputs['column_index'])
+    else:
+        patients, controls = filter_raw_data(cfg, inputs['raw_data'], inputs['column_index'])
+    profiling.annotate(controls=len(controls), **profiling.shape(patients))
+    return {'data': patients, 'controls': controls}
+
+def run_check_controls(cfg, inputs):
+    profiling.annotate(**profiling.shape(inputs['controls']))
+    outputs = {'control_rings': control_rings(cfg, inputs['controls'])}
+    outputs['control_status'] = check_controls_status(cfg, dict(inputs, **outputs))
+    outputs['checked_controls'] = status_labels(inputs['controls'], outputs['control_status'])
+    return outputs
+
+def run_select_control(cfg, inputs):
+    return {'selected_control': select_control(cfg, inputs)}
+
+def run_filter_patients_data(cfg, inputs):
+    outputs = dict(zip(('data_filtered', 'idx_invalids', 'control_filtered'), filter_patients_data(cfg, inputs)))
+    profiling.annotate(**profiling.shape(outputs['data_filtered']))
+    return outputs
+
+def run_patient_flags(cfg, inputs):
+    return {'patient_flags': patient_flags(inputs)}
+
+def run_export(cfg, inputs):
+    data = AnalysisData(**{name: value for name, value in inputs.items() if name in AnalysisData.__slots__})
+    data['export_excel_path'] = inputs['excel_path']
+    export_results(cfg, inputs['excel_path'], data, inputs['transfers'])
+    return {'export_excel_path': data['export_excel_path'], 'export_paths': data['export_paths']}
+
+# the analysis as graph of stages, see pipeline.run. The roots are the files (keyed by their
+# content), the raw file read into memory by run_analysis, the planned excel_path and the transfers
+# writing it, preparation and the trend store stay outside of the graph.
+ANALYSIS_STAGES = [
+    pipeline.stage('read_raw_data', run_read_raw_data, ['raw_data_file', 'raw_content'], ['raw_data'], ['streaming_ingest'], 'read',
+                   disk=False), # ingest caches the parsed raw data itself
+    pipeline.stage('read_control_reference', run_read_control_reference, ['control_reference_file'], ['control_reference'],
+                   progress='read', disk=False),
+    pipeline.stage('read_patients_reference', run_read_patients_reference, ['patients_reference_file'], ['patients_reference'],
+                   progress='read', disk=False),
+    pipeline.stage('build_column_index', run_build_column_index, ['raw_data_file', 'raw_data', 'control_reference', 'patients_reference'],
+                   ['column_index'], ['streaming_ingest', 'control_ring_samples'], 'filter'),
+    pipeline.stage('filter_raw_data', run_filter_raw_data, ['raw_data_file', 'raw_data', 'column_index'], ['data', 'controls'],
+                   ['streaming_ingest', 'ignore_samples', 'control_name_prefix', 'columns'], 'filter'),
+    pipeline.stage('check_controls', run_check_controls, ['controls', 'column_index'], ['control_rings', 'control_status', 'checked_controls'],
+                   ['control_ring_samples', 'columns'], 'check'),
+    pipeline.stage('select_control', run_select_control, ['controls', 'checked_controls', 'control_status', 'column_index'], ['selected_control'],
+                   ['control_ring_samples', 'columns', 'prefer_aminos'], 'select'),
+    pipeline.stage('filter_patients_data', run_filter_patients_data, ['data', 'selected_control', 'column_index'],
+                   ['data_filtered', 'idx_invalids', 'control_filtered'], ['prefer_control'], 'filter patients'),
+    pipeline.stage('patient_flags', run_patient_flags, ['data_filtered', 'column_index', 'idx_invalids'], ['patient_flags'], progress='filter patients'),
+    pipeline.stage('export', run_export, ['excel_path', 'transfers', 'raw_data_file', 'raw_data', 'column_index', 'controls', 'control_status', 'checked_controls',
+                                         'selected_control', 'data_filtered', 'idx_invalids', 'control_filtered', 'patient_flags'],
+                   ['export_excel_path', 'export_paths'], progress='export', memo=False),
+]
+
+def file_key(filepath):
+    """the root key of a file: its content, a missing file is reported by its stage"""
+    return ingest.file_hash(filepath) if os.path.isfile(filepath) else os.path.abspath(filepath)
+
+def run_stages(cfg, export_dir, excel_path, raw_data_file, references=None, previous=None, transfers=None, raw_content=None,
+               progress=no_progress):
+    """runs ANALYSIS_STAGES for raw_data_file and returns their outputs as AnalysisData
+
+    references (see read_references) and previous (an earlier AnalysisData) save the stages
+    they already hold, the stages of a changed setting or file are run again. With stage_memo
+    the outputs are kept in memory, with stage_memo_disk also in cache_directory/stages.
+    The excel sheet is written through transfers (see transfer.Transfers), the caller waits for it.
+    raw_content (see read_raw_content) is parsed instead of opening raw_data_file again.
+    """
+    values = {'excel_path': excel_path, 'raw_data_file': raw_data_file,
+              'control_reference_file': cfg['control_reference_file_path'],
+              'patients_reference_file': cfg['patients_reference_file_path']}
+    keys = {name: file_key(path) for name, path in values.items() if name != 'excel_path'}
+    keys['excel_path'] = excel_path
+    values['transfers'] = transfers if transfers is not None else transfer.Transfers(background=False)
+    keys['transfers'] = 'transfers' # only the export uses them, it runs every time
+    values['raw_content'] = raw_content
+    keys['raw_content'] = 'raw_content' # the content of raw_data_file, keyed by it
+    if references is not None:
+        values.update(references)
+    directory = cfg['cache_directory'] if cfg['stage_memo_disk'] and cfg['cache_directory'] else None
+    keys = pipeline.run(cfg, ANALYSIS_STAGES, values, keys, previous=previous, memory=cfg['stage_memo'], directory=directory,
+                        max_size_mb=cfg['result_cache_size_mb'], version=result_cache.source_hash(), progress=progress)
+    data = AnalysisData(**{name: value for name, value in values.items() if name in AnalysisData.__slots__})
+    data['export_dir'] = export_dir
+    data['stage_keys'] = {name: key for name, key in keys.items() if name in AnalysisData.__slots__}
+    return data
+
+def analyse(cfg, references=None, progress=no_progress):
+    """runs the whole analysis for cfg['file_to_analyze']
     
-    return (new_patients, idx_invalids, new_control)
+    references can hold already loaded reference tables (see read_references), 
+    otherwise they are read from the paths in cfg. progress is called with the name 
+    of each stage (see STAGES) before it starts, an exception raised by it cancels 
+    the analysis. With cfg['run_report'] the timings of all stages are written to 
+    <analysis>_Report.json next to the excel sheet. With cfg['result_cache'] a file 
+    analysed before with identical settings and reference files returns the stored 
+    result, its excel sheet is copied into the new export directory.
+    """
+    # read once for the hash of the result key, the archive copy and the parser, dropped on return
+    raw_content = read_raw_content(cfg)
+    if not result_cache.enabled(cfg):
+        return run_analysis(cfg, references, progress, raw_content)
+    key = result_cache.result_key(cfg)
+    data = result_cache.load(cfg['cache_directory'], key)
+    if data is not None:
+        return reuse_result(cfg, data, key, progress, raw_content)
+    data = run_analysis(cfg, references, progress, raw_content)
+    result_cache.store(cfg['cache_directory'], key, data, cfg['result_cache_size_mb'])
+    return data
+
+def reuse_result(cfg, data, key, progress=no_progress, raw_content=None):
+    """puts a stored analysis into a new export directory like a new analysis"""
+    _logger.info("start AMINOS tool, result from cache")
+    progress('read')
+    with transfer.Transfers(cfg['background_io']) as transfers:
+        export_dir, excel_sheet_name = preparation(cfg, cfg['file_to_analyze'], transfers, raw_content)
+        export_dir = os.path.abspath(export_dir)
+        excel_path = os.path.abspath(os.path.join(export_dir, excel_sheet_name))
+        _logger.info(excel_path)
+        progress('export')
+        data['export_dir'] = export_dir
+        data['export_excel_path'] = excel_path
+        if not result_cache.export_excel(cfg['cache_directory'], key, excel_path, cfg['result_cache_export']):
+            data['export_excel_path'] = None
+        data['raw_data_file'] = os.path.abspath(cfg['file_to_analyze'])
+        # the tables are quickly written again, the cache only keeps the excel sheet
+        export_tables(cfg, excel_path, data)
+    _logger.info("finished analyses")
+    return data
 
-def analyse(cfg):
+def run_analysis(cfg, references=None, progress=no_progress, raw_content=None):
+    """the stages of analyse without the result cache, raw_content see read_raw_content"""
     _logger.info("start AMINOS tool")
-    data = {}
     
-    export_dir, excel_sheet_name = preparation(cfg, cfg['file_to_analyze'])
-    export_dir = os.path.abspath(export_dir)
-    excel_path = os.path.abspath(os.path.join(export_dir, excel_sheet_name))
-    _logger.info(export_dir)
-    _logger.info(excel_path)
+    with profiling.report(cfg['run_report'], cfg['profile_memory'], command='analyse', file=cfg['file_to_analyze']) as run_report, \
+         transfer.Transfers(cfg['background_io']) as transfers:
+        progress('read')
+        with profiling.stage('preparation'):
+            if raw_content is None:
+                raw_content = read_raw_content(cfg)
+            export_dir, excel_sheet_name = preparation(cfg, cfg['file_to_analyze'], transfers, raw_content)
+        export_dir = os.path.abspath(export_dir)
+        excel_path = os.path.abspath(os.path.join(export_dir, excel_sheet_name))
+        _logger.info(export_dir)
+        _logger.info(excel_path)
+        
+        # the archive copy is written while the raw data is parsed, the workbook while the trends are stored
+        data = run_stages(cfg, export_dir, excel_path, os.path.abspath(cfg['file_to_analyze']), references,
+                          transfers=transfers, raw_content=raw_content, progress=progress)
+        
+        if cfg['trend_store']:
+            with profiling.stage('trend_store'):
+                try:
+                    trends.record(cfg['trend_store'], cfg, data)
+                except Exception as e:
+                    # the analysis itself is done, a locked or broken store must not fail it
+                    _logger.warning(F"could not record the controls in the trend store {cfg['trend_store']}: {e}")
+        with profiling.stage('transfers'):
+            transfers.wait()
     
-    data['export_dir'] = export_dir
-    data['export_excel_path'] = excel_path
-    data['raw_data'] = read_raw_data(cfg['file_to_analyze'])
-    data['data'], data['controls'] = filter_raw_data(cfg, data['raw_data'])
-    data['control_reference'] = read_reference_data(cfg['control_reference_file_path'])
-    data['patients_reference'] = read_reference_data(cfg['patients_reference_file_path'])
-    data['checked_controls'] = check_controls(cfg, data)
-    data['selected_control'] = select_control(cfg, data)
-    data['data_filtered'], data['idx_invalids'], data['control_filtered'] = filter_patients_data(cfg, data)
+    if run_report is not None:
+        profiling.write_report(run_report, report_path(excel_path))
+    _logger.info("finished analyses")
+    
+    return data
     
-    # temporaly write into file
-    # with open('data.pickle', 'wb') as handle:
-    #    pickle.dump(data, handle)
-    #_logger.debug(data)
+def reanalyse(cfg, data, progress=no_progress):
+    """repeats an analysis with a changed config, e.g. prefer_control/prefer_aminos
     
-    excel.export(cfg, excel_path, data)
+    Takes the outputs of all stages whose inputs and settings did not change from the previous 
+    analysis (see run_stages), for the preferences everything up to the control selection. 
+    The new excel sheet is written with a new timestamp into the export directory of the 
+    previous analysis.
+    """
+    _logger.info("re-run with prefered control and AS")
+    name = unique_name(lambda name: free_name(data['export_dir'], name))
+    excel_path = os.path.join(data['export_dir'], name + cfg['file_extension_analysis'])
+    _logger.info(excel_path)
+    with profiling.report(cfg['run_report'], cfg['profile_memory'], command='reanalyse', export_dir=data['export_dir']) as run_report, \
+         transfer.Transfers(cfg['background_io']) as transfers:
+        data = run_stages(cfg, data['export_dir'], excel_path, data['raw_data_file'], previous=data, transfers=transfers, progress=progress)
+        with profiling.stage('transfers'):
+            transfers.wait()
     
+    if run_report is not None:
+        profiling.write_report(run_report, report_path(excel_path))
     _logger.info("finished analyses")
-    
     return data
-    
-if __name__== "__main__":
-    cfg = read_config()
-    analyse(cfg)
\ No newline at end of file
+
+def export_results(cfg, excel_path, data, transfers=None):
+    """writes the output_formats: the excel sheet and the result tables next to it
+
+    With transfers the excel sheet is written to a local file and moved to excel_path in the background.
+    """
+    if 'xlsx' in cfg['output_formats'] and len(cfg['excel_sheets']):
+        local_path = transfers.local_path(excel_path) if transfers is not None else excel_path
+        with profiling.stage('export_xlsx'):
+            try:
+                excel.export(cfg, local_path, data)
+            except Exception:
+                if transfers is not None:
+                    transfers.discard(local_path, excel_path)
+                raise
+        if transfers is not None:
+            transfers.move(local_path, excel_path)
+    else:
+        # no workbook, the results are used through the tables, the api or the service (e.g. patient_flags)
+        data['export_excel_path'] = None
+    export_tables(cfg, excel_path, data)
+
+def export_tables(cfg, excel_path, data):
+    """writes result_tables in every output format besides xlsx, <analysis>_patients.csv etc."""
+    data['export_paths'] = []
+    formats = [fmt for fmt in cfg['output_formats'] if fmt != 'xlsx']
+    if not len(formats):
+        return
+    with profiling.stage('result_tables') as record:
+        tables = result_tables(cfg, data)
+        record.update(rows=len(tables['patients']))
+    base_path = os.path.splitext(excel_path)[0]
+    for fmt in formats:
+        with profiling.stage(F"export_{fmt}"):
+            data['export_paths'] += exporters.EXPORTERS[fmt](tables, base_path)
+    _logger.info(F"result tables written: {', '.join(data['export_paths'])}")
+
+def report_path(excel_path):
+    """the run report belongs to one excel sheet, re-runs get their own"""
+    return os.path.splitext(excel_path)[0] + '_Report.json'
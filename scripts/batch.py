@@ -0,0 +1,152 @@
+import glob
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import pandas as pd
+import aminos
+import config
+
+_logger = logging.getLogger("batch")
+
+# reference tables of the worker process, loaded once by init_worker
+_references = None
+# ProcessPoolExecutor has initializer since Python 3.7
+POOL_INITIALIZER = sys.version_info >= (3, 7)
+
+def collect_files(cfg, inputs):
+    """expands directories, glob patterns and manifest files into a list of raw data workbooks"""
+    files = []
+    for item in inputs:
+        if os.path.isdir(item):
+            found = sorted(glob.glob(os.path.join(item, '*.xlsx')))
+        elif os.path.isfile(item) and os.path.splitext(item)[-1].lower() != '.xlsx':
+            # manifest: one workbook per line, relative paths start at the manifest directory
+            with open(item) as manifest:
+                lines = [line.strip() for line in manifest]
+            base_dir = os.path.dirname(os.path.abspath(item))
+            found = [os.path.join(base_dir, line) for line in lines if line and not line.startswith('#')]
+        elif os.path.isfile(item):
+            found = [item]
+        else:
+            found = sorted(glob.glob(item, recursive=True))
+            if not len(found):
+                _logger.warning(F"no files found for {item}")
+        for filepath in found:
+            name = os.path.basename(filepath)
+            # skip excel lock files and our own exports
+            if name.startswith('~$') or name.endswith(cfg['file_extension_analysis']):
+                continue
+            filepath = os.path.abspath(filepath)
+            if filepath not in files:
+                files.append(filepath)
+    return files
+
+def init_worker(cfg, log_queue=None):
+    global _references
+    # spawned workers (Windows) do not run cli.main, with log_queue the parent writes their records
+    config.setup_logging(log_queue=log_queue)
+    _references = aminos.read_references(cfg)
+
+def worker_pool(cfg, workers, log_queue=None):
+    """a process pool for analyse_file whose processes run init_worker first
+
+    Without POOL_INITIALIZER (Python 3.6) a process loads the references with its first file
+    in analyse_file and writes its own log, log_queue is not used then.
+    """
+    if not POOL_INITIALIZER:
+        return ProcessPoolExecutor(max_workers=workers)
+    return ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(cfg, log_queue))
+
+def analyse_file(cfg, filepath, export_directory):
+    """analyses one workbook and returns a summary record, errors are reported instead of raised"""
+    result = {'file': filepath, 'status': 'ok', 'error': '', 'seconds': 0.0, 'export_excel_path': '',
+              'control': '', 'score': None, 'conflicts': '',
+              'second_control': '', 'second_score': None}
+    start = time.perf_counter()
+    if _references is None:
+        init_worker(cfg) # the first file of a process of a pool without initializer
+    config.log_context['file'] = filepath # in the json records of every log line of the file
+    try:
+        file_cfg = dict(cfg, file_to_analyze=filepath, export_directory=export_directory)
+        data = aminos.analyse(file_cfg, _references)
+        selected = data['selected_control']
+        control = aminos.used_control(cfg, data)
+        result['export_excel_path'] = data['export_excel_path']
+        result['control'] = control
+        result['score'] = selected['data'][control]['prios_score']
+        result['conflicts'] = '; '.join('/'.join(conflict) for conflict in selected['data'][control]['conflicts'])
+        result['second_control'] = str(selected['second_best_control_name'])
+        result['second_score'] = selected['second_best_control_score']
+    except Exception as e:
+        _logger.exception(F"analysis of {filepath} failed")
+        result['status'] = 'failed'
+        result['error'] = F"{type(e).__name__}: {e}"
+    result['seconds'] = time.perf_counter() - start
+    config.log_context.pop('file', None)
+    return result
+
+def export_directories(files, batch_dir):
+    """one export directory per workbook, named after the workbook"""
+    dirs = []
+    used = set()
+    for filepath in files:
+        stem = os.path.splitext(os.path.basename(filepath))[0]
+        name = stem
+        idx = 2
+        while name in used:
+            name = F"{stem}_{idx}"
+            idx += 1
+        used.add(name)
+        dirs.append(os.path.join(batch_dir, name))
+    return dirs
+
+def analyse_batch(cfg, inputs, workers=None, summary_path=None):
+    """analyses all workbooks found in inputs and writes a summary table
+
+    inputs are directories, glob patterns, workbooks or manifest files. The workbooks are
+    distributed to a process pool with the given number of workers, one worker analyses
+    in this process. Returns the summary as data frame.
+    """
+    files = collect_files(cfg, inputs)
+    batch_dir = os.path.abspath(os.path.join(cfg['export_directory'], aminos.get_timestamp() + '_Batch'))
+    os.makedirs(batch_dir, exist_ok=True)
+    if summary_path is None:
+        summary_path = os.path.join(batch_dir, 'summary.csv')
+    _logger.info(F"start batch with {len(files)} files, results in {batch_dir}")
+
+    jobs = list(zip(files, export_directories(files, batch_dir)))
+    results = []
+    start = time.perf_counter()
+    if workers == 1:
+        init_worker(cfg)
+        for filepath, export_dir in jobs:
+            results.append(analyse_file(cfg, filepath, export_dir))
+    elif len(jobs):
+        log_queue, log_listener = config.forward_logging()
+        with worker_pool(cfg, workers, log_queue) as executor:
+            futures = {executor.submit(analyse_file, cfg, filepath, export_dir): filepath for filepath, export_dir in jobs}
+            for future in as_completed(futures):
+                try:
+                    result = future.result()
+                except Exception as e:
+                    # the worker process itself died, e.g. out of memory
+                    _logger.error(F"worker for {futures[future]} failed: {e}")
+                    result = {'file': futures[future], 'status': 'failed', 'error': F"{type(e).__name__}: {e}"}
+                _logger.info(F"{result['status']}: {result['file']}")
+                results.append(result)
+        if log_listener is not None:
+            log_listener.stop()
+
+    summary = pd.DataFrame(results, columns=['file', 'status', 'error', 'seconds', 'control', 'score', 'conflicts',
+                                             'second_control', 'second_score', 'export_excel_path'])
+    # keep the order of the inputs
+    summary['file'] = pd.Categorical(summary['file'], categories=files, ordered=True)
+    summary = summary.sort_values('file').reset_index(drop=True)
+    summary['file'] = summary['file'].astype(str)
+    summary.to_csv(summary_path, index=False)
+
+    failed = (summary['status'] != 'ok').sum()
+    _logger.info(F"finished batch in {time.perf_counter() - start:.1f} s: {len(summary) - failed} ok, {failed} failed. Summary: {summary_path}")
+    return summary
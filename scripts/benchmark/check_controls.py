@@ -0,0 +1,83 @@
+"""compares the vectorized check_controls with the former row by row loop
+
+run from the scripts directory: python -m benchmark.check_controls [--rows 10 100 1000 10000]
+"""
+import argparse
+import numpy as np
+import pandas as pd
+import aminos
+from benchmark.common import measure
+
+VARIANTS = ['_cs', '_ph', '_hp4']
+CONTROL_NAMES = ['Ko I (61)', 'Ko II (62)', 'Ko III (31)', 'Ko IV (32)']
+
+def check_controls_loop(cfg, data):
+    """check_controls as it was before the vectorization, kept as reference"""
+    controls = data['controls']
+    control_reference = data['control_reference']
+    ret = pd.DataFrame().reindex_like(controls)
+    ret[ret.isnull()] = 'NONE'
+    for idx_row, row_data in controls.iterrows():
+        control_name = row_data[cfg['columns']['sample_name']]
+        matches = [num for num in cfg['control_ring_samples'] if str(num) in control_name]
+        if len(matches):
+            match = matches[0]
+            matched_control = control_reference[control_reference['controls'] == match]
+            control_min = matched_control[matched_control['limits'] == 'min']
+            control_max = matched_control[matched_control['limits'] == 'max']
+            for col in control_reference.columns.values:
+                val_min = control_min[col].item() 
+                val_max = control_max[col].item()
+                col_names = controls.columns[controls.columns.str.contains(pat = col)]
+                if (len(col_names)):
+                    control_idx_bo = (controls[cfg['columns']['sample_name']] == control_name)
+                    for col_name in col_names:
+                        ret[col_name][control_idx_bo & (controls[col_name] < val_min)] = 'TOO_LOW'
+                        ret[col_name][control_idx_bo & (controls[col_name] > val_max)] = 'TOO_HIGH'
+                        ret[col_name][control_idx_bo & (controls[col_name] <= val_max) & (controls[col_name] >= val_min)] = 'NORMAL'
+    return ret
+
+def synthetic_controls(cfg, control_reference, rows, seed=0):
+    """control block with isomer variants, values scattered around the reference limits and missing peaks"""
+    rng = np.random.default_rng(seed)
+    aminos_ref = [col for col in control_reference.columns if col not in ('controls', 'limits')]
+    columns = ['Unnamed: 0', cfg['columns']['sample_name']] + aminos_ref
+    columns += [F"{col}{variant}" for col in aminos_ref for variant in VARIANTS]
+    names = np.array(CONTROL_NAMES)[np.arange(rows) % len(CONTROL_NAMES)]
+    
+    limits = control_reference.set_index(['controls', 'limits'])
+    mean = limits.xs('mean', level='limits').mean()
+    values = {}
+    for col in columns[2:]:
+        base = mean[col.split('_')[0]]
+        values[col] = rng.normal(base, base * 0.2, rows)
+        values[col][rng.random(rows) < 0.05] = np.nan
+    controls = pd.DataFrame(values)
+    controls.insert(0, columns[1], names)
+    controls.insert(0, columns[0], np.arange(rows))
+    return controls
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, nargs='+', default=[10, 100, 1000, 10000])
+    parser.add_argument('--loop-max-rows', type=int, default=100, help="skip the former loop above this number of rows (about 0.3 s per row)")
+    args = parser.parse_args()
+    
+    cfg = aminos.read_config()
+    control_reference = aminos.read_reference_data(cfg['control_reference_file_path'])
+    patients_reference = aminos.read_reference_data(cfg['patients_reference_file_path'])
+    print(F"{'rows':>8} {'loop [s]':>10} {'vectorized [s]':>15} {'speedup':>8}")
+    for rows in args.rows:
+        controls = synthetic_controls(cfg, control_reference, rows)
+        data = {'controls': controls, 'control_reference': control_reference}
+        data['column_index'] = aminos.build_column_index(cfg, controls.columns, control_reference, patients_reference)
+        vectorized, t_vectorized = measure(aminos.check_controls, cfg, data)
+        if rows > args.loop_max_rows:
+            print(F"{rows:>8} {'-':>10} {t_vectorized:>15.4f} {'-':>8}")
+            continue
+        loop, t_loop = measure(check_controls_loop, cfg, data)
+        assert loop.equals(vectorized.astype(object)), F"results differ for {rows} rows"
+        print(F"{rows:>8} {t_loop:>10.4f} {t_vectorized:>15.4f} {t_loop / t_vectorized:>7.0f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,32 @@
+"""timing helpers of the benchmarks"""
+import time
+import tracemalloc
+
+def measure(func, *args):
+    """(result of func(*args), wall seconds)"""
+    start = time.perf_counter()
+    ret = func(*args)
+    return ret, time.perf_counter() - start
+
+def repeated(func, runs, *args):
+    """the wall seconds of runs calls, e.g. for the median"""
+    return [measure(func, *args)[1] for _ in range(runs)]
+
+def fastest(func, runs, *args):
+    """(result, seconds) of the fastest of runs calls, the others are slowed down by cold caches"""
+    best = None
+    for _ in range(runs):
+        ret, seconds = measure(func, *args)
+        if best is None or seconds < best[1]:
+            best = (ret, seconds)
+    return best
+
+def measure_memory(func, *args):
+    """(result, wall seconds, peak of the python allocations in MB) of func(*args)"""
+    tracemalloc.start()
+    try:
+        ret, seconds = measure(func, *args)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return ret, seconds, peak / 2**20
@@ -0,0 +1,166 @@
+"""compares the patient sheet writer with the former cell by cell writer
+
+run from the scripts directory: python -m benchmark.export [--patients 20 200 2000]
+Checks first that a plate with controls only (no patient rows) is exported.
+"""
+import argparse
+import os
+import tempfile
+import numpy as np
+import pandas as pd
+import xlsxwriter
+import aminos
+import excel
+from benchmark.common import measure
+
+EXAMPLE_FILE = os.path.join(os.path.dirname(__file__), '..', '..', 'rohdaten_example.xlsx')
+
+def write_patients_data_per_cell(workbook, data, cfg):
+    """write_patients_data as it was before the format cache, kept as reference"""
+    ws_patients = workbook.add_worksheet('Patienten')
+    ws_patients.set_landscape()
+    fmt_heading = workbook.add_format(cfg['format_heading'])
+    fmt_heading_right = workbook.add_format(cfg['format_heading'])
+    fmt_heading_right.set_align("right")
+    ws_patients.write(0,0,"Normbereich", fmt_heading)
+    ws_patients.write(1,0,"min", fmt_heading_right)
+    ws_patients.write(1,1,"max", fmt_heading_right)
+    patients = data['data_filtered']
+    pat_ref = data['patients_reference']
+    fmt = pd.DataFrame().reindex_like(patients)
+    for col in pat_ref.columns.values:
+        col_name = patients.columns[patients.columns.str.contains(pat = col)][0]
+        fmt[col_name][patients[col_name] < pat_ref.loc[0,col]] = 1
+        fmt[col_name][patients[col_name] > pat_ref.loc[1,col]] = 2
+    fmt[patients.columns[data['idx_invalids']]] = -1
+    fmt.fillna(0, inplace=True)
+    gap_rows = 30
+    offset_col = 4
+    idx_row = 0
+    idx_col = offset_col
+    second_part = 0
+    fmt_bold = workbook.add_format(cfg['format_heading'])
+    amino_names = []
+    amino_min = []
+    amino_max = []
+    add_empty_row = [5, 8, 11, 14, 17, 20]
+    for idx in range(2, 22):                             
+        if idx in add_empty_row:
+            amino_names.append("")
+            amino_min.append("")
+            amino_max.append("")
+        as_name = data['data_filtered'].columns[idx]
+        amino_names.append(as_name)
+        amino_min.append(data['patients_reference'].loc[1, as_name[:3]])
+        amino_max.append(data['patients_reference'].loc[0, as_name[:3]])
+    ws_patients.write_column(idx_row+2, idx_col-1, amino_names, fmt_heading_right)
+    ws_patients.write_column(idx_row+2, idx_col+9, amino_names, fmt_bold)
+    ws_patients.write_column(idx_row+2, idx_col-3, amino_min)
+    ws_patients.write_column(idx_row+2, idx_col-4, amino_max)
+    for (idx, row) in data['data_filtered'].iterrows():
+        help_write(cfg, workbook, ws_patients, idx_row, idx_col+second_part, row.iloc[1], 3)    
+        empty_row = 0
+        for idx_as in range(2, 22):                             
+            if idx_as in add_empty_row:
+                empty_row += 1
+            val = F"{row.iloc[idx_as]:.1f}"
+            help_write(cfg, workbook, ws_patients, idx_row+idx_as+empty_row, idx_col+second_part, val, fmt.loc[idx][idx_as])
+        idx_col += 1
+        if idx_col%(4+offset_col) == 0: 
+            second_part = 1
+        elif idx_col%(8+offset_col) == 0:
+            idx_col = offset_col
+            idx_row += gap_rows
+            second_part = 0
+            ws_patients.write(idx_row,0,"Normbereich", fmt_heading)
+            ws_patients.write(idx_row+1,0,"min", fmt_heading_right)
+            ws_patients.write(idx_row+1,1,"max", fmt_heading_right)
+            ws_patients.write_column(idx_row+2, idx_col-1, amino_names, fmt_heading_right )
+            ws_patients.write_column(idx_row+2, idx_col+9, amino_names, fmt_bold )
+            ws_patients.write_column(idx_row+2, idx_col-3, amino_min)
+            ws_patients.write_column(idx_row+2, idx_col-4, amino_max)
+    for idx_row in (28, 29, 58, 59, 88, 89):
+        ws_patients.set_row(idx_row, 45)
+
+def help_write(cfg, wb, ws, idx_r, idx_c, val, fmt_nr):
+    if fmt_nr == -1:
+        fmt = wb.add_format(cfg['format_number_invalid'])
+    elif fmt_nr == 1:
+        fmt = wb.add_format(cfg['format_number_low'])
+    elif fmt_nr == 2:
+        fmt = wb.add_format(cfg['format_number_high'])
+    elif fmt_nr == 3:
+        fmt = wb.add_format(cfg['format_heading'])
+    else:
+        fmt = {}
+    ws.write(idx_r, idx_c, val, fmt)
+
+def tiled_plate(cfg, patients, seed=0):
+    """the example plate with its patients repeated and scattered until there are enough"""
+    rng = np.random.default_rng(seed)
+    raw = aminos.read_raw_data(EXAMPLE_FILE)
+    column_name = cfg['columns']['sample_name']
+    is_control = raw[column_name].astype(str).str.contains(cfg['control_name_prefix'])
+    template = raw[~is_control]
+    parts = [raw[is_control]]
+    for idx in range(0, patients, len(template)):
+        part = template.iloc[:patients - idx].copy()
+        part[column_name] = np.arange(idx + 1, idx + len(part) + 1)
+        part.iloc[:, 2:] = part.iloc[:, 2:] * rng.uniform(0.7, 1.3, part.iloc[:, 2:].shape)
+        parts.append(part)
+    return pd.concat(parts, ignore_index=True)
+
+def analysed_plate(cfg, patients):
+    data = {}
+    data['raw_data'] = tiled_plate(cfg, patients)
+    data.update(aminos.read_references(cfg))
+    data['column_index'] = aminos.build_column_index(cfg, data['raw_data'].columns, data['control_reference'], data['patients_reference'])
+    data['data'], data['controls'] = aminos.filter_raw_data(cfg, data['raw_data'], data['column_index'])
+    data['control_status'] = aminos.check_controls_status(cfg, data)
+    data['checked_controls'] = aminos.status_labels(data['controls'], data['control_status'])
+    data['selected_control'] = aminos.select_control(cfg, data)
+    data['data_filtered'], data['idx_invalids'], data['control_filtered'] = aminos.filter_patients_data(cfg, data)
+    data['patient_flags'] = aminos.patient_flags(data)
+    return data
+
+def write_workbook(filename, write, constant_memory=False):
+    workbook = xlsxwriter.Workbook(filename, {'constant_memory': constant_memory})
+    write(workbook)
+    workbook.close()
+
+def check_controls_only(cfg, tmp_dir):
+    """the whole export of a plate without patients: the patient sheet holds one empty page"""
+    import openpyxl
+    data = analysed_plate(cfg, 0)
+    assert len(data['data_filtered']) == 0, "the plate should hold controls only"
+    filename = os.path.join(tmp_dir, 'controls_only.xlsx')
+    excel.export(cfg, filename, data)
+    sheet = openpyxl.load_workbook(filename)[excel.SHEET_TITLES['patients']]
+    slot_cols = excel.patient_page_layout(len(data['data_filtered'].columns) - len(data['column_index']['meta']))[2]
+    assert sheet.cell(1, 1).value == "Normbereich", "the page of the patient sheet is missing"
+    assert all(sheet.cell(1, col + 1).value is None for col in slot_cols), "the patient sheet holds patients"
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--patients', type=int, nargs='+', default=[20, 200, 2000])
+    args = parser.parse_args()
+    
+    cfg = aminos.read_config()
+    writers = [
+        ('per cell', False, lambda wb, data: write_patients_data_per_cell(wb, data, cfg)),
+        ('cached', False, lambda wb, data: excel.write_plan(wb, excel.plan_patients_data(cfg, data), excel.build_formats(wb, cfg))),
+        ('constant_memory', True, lambda wb, data: excel.write_plan(wb, excel.plan_patients_data(cfg, data), excel.build_formats(wb, cfg))),
+    ]
+    print(F"{'patients':>8} {'writer':>16} {'time [s]':>10} {'size [kB]':>10}")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        check_controls_only(cfg, tmp_dir)
+        for patients in args.patients:
+            data = analysed_plate(cfg, patients)
+            for name, constant_memory, write in writers:
+                filename = os.path.join(tmp_dir, F"{patients}_{name}.xlsx")
+                _, seconds = measure(write_workbook, filename, lambda wb: write(wb, data), constant_memory)
+                size = os.path.getsize(filename)
+                print(F"{patients:>8} {name:>16} {seconds:>10.3f} {size / 1024:>10.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+"""compares the excel export with the result tables written as csv, json and parquet
+
+run from the scripts directory: python -m benchmark.formats [--patients 200 2000 5000]
+parquet is left out without pyarrow or fastparquet.
+"""
+import argparse
+import importlib.util
+import logging
+import os
+import tempfile
+import aminos
+import excel
+import exporters
+from benchmark.common import measure
+from benchmark.export import analysed_plate
+
+def write_excel(cfg, path, data, sheets):
+    excel.export(dict(cfg, excel_sheets=sheets), path, data)
+    return [path]
+
+def timed_write(write):
+    """(seconds, bytes of the written files)"""
+    paths, seconds = measure(write)
+    return seconds, sum(os.path.getsize(path) for path in paths)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--patients', type=int, nargs='+', default=[200, 2000, 5000])
+    args = parser.parse_args()
+    logging.disable(logging.WARNING) # the tiled plates are full of conflicts
+
+    cfg = aminos.read_config()
+    formats = [fmt for fmt in exporters.EXPORTERS if fmt != 'parquet' or importlib.util.find_spec('pyarrow') or importlib.util.find_spec('fastparquet')]
+    print(F"{'patients':>8} {'format':>14} {'time [s]':>10} {'size [kB]':>10} {'of xlsx':>8}")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for patients in args.patients:
+            data = analysed_plate(cfg, patients)
+            base_path = os.path.join(tmp_dir, F"{patients}_Analyse")
+            results = []
+            for name, sheets in (('xlsx', list(excel.SHEET_TITLES)), ('xlsx w/o raw', ['controls', 'patients', 'control'])):
+                path = F"{base_path}_{len(sheets)}.xlsx"
+                results.append((name, timed_write(lambda: write_excel(cfg, path, data, sheets))))
+            # the tables are built once for all formats
+            tables, seconds = measure(aminos.result_tables, cfg, data)
+            results.append(('result_tables', (seconds, 0)))
+            for fmt in formats:
+                results.append((fmt, timed_write(lambda: exporters.EXPORTERS[fmt](tables, base_path))))
+            xlsx_seconds = results[0][1][0]
+            for name, (seconds, size) in results:
+                print(F"{patients:>8} {name:>14} {seconds:>10.3f} {size / 1024:>10.1f} {seconds / xlsx_seconds:>8.1%}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+"""compares the peak memory and time of reading and splitting a plate as frame and row by row
+
+run from the scripts directory: python -m benchmark.ingest [--patients 500 5000] [--ignored 0 2000]
+"""
+import argparse
+import logging
+import os
+import tempfile
+import aminos
+from benchmark import plates
+from benchmark.common import measure_memory
+
+def frame_ingest(cfg, references, filepath):
+    raw = aminos.read_raw_data(filepath)
+    column_index = aminos.build_column_index(cfg, raw.columns, references['control_reference'], references['patients_reference'])
+    return aminos.filter_raw_data(cfg, raw, column_index)
+
+def streaming_ingest(cfg, references, filepath):
+    columns = aminos.read_raw_header(filepath)
+    column_index = aminos.build_column_index(cfg, columns, references['control_reference'], references['patients_reference'])
+    return aminos.stream_raw_data(cfg, filepath, column_index)
+
+def measure(func, *args):
+    """common.measure_memory and the size of the frames read"""
+    (data, controls), seconds, peak = measure_memory(func, *args)
+    output = data.memory_usage(deep=True).sum() + controls.memory_usage(deep=True).sum()
+    return (data, controls), seconds, peak, output / 2**20
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--patients', type=int, nargs='+', default=[500, 5000])
+    parser.add_argument('--ignored', type=int, nargs='+', default=[0, 2000], help="SIGMA/Phe rows dropped while reading")
+    parser.add_argument('--variants', type=int, default=2)
+    args = parser.parse_args()
+
+    cfg = aminos.read_config()
+    references = aminos.read_references(cfg)
+    logging.disable(logging.INFO)
+    print(F"{'patients':>8} {'ignored':>7} {'format':>6} {'mode':>9} {'time [s]':>9} {'peak [MB]':>10} {'output [MB]':>12}")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for patients in args.patients:
+            for ignored in args.ignored:
+                plate = plates.synthetic_plate(cfg, references['control_reference'], references['patients_reference'], patients,
+                                               variants=args.variants, no_peak=0.02, ignored=ignored)
+                paths = {'xlsx': os.path.join(tmp_dir, 'plate.xlsx'), 'csv': os.path.join(tmp_dir, 'plate.csv')}
+                plates.write_plate(plate, paths['xlsx'])
+                plate.rename(columns={'Unnamed: 0': ''}).to_csv(paths['csv'], index=False)
+                frames, seconds, peak, output = measure(frame_ingest, cfg, references, paths['xlsx'])
+                print(F"{patients:>8} {ignored:>7} {'xlsx':>6} {'frame':>9} {seconds:>9.3f} {peak:>10.1f} {output:>12.1f}")
+                for fmt, path in paths.items():
+                    streamed, seconds, peak, output = measure(streaming_ingest, cfg, references, path)
+                    assert frames[0].equals(streamed[0]) and frames[1].equals(streamed[1]), "streamed frames differ"
+                    print(F"{patients:>8} {ignored:>7} {fmt:>6} {'streaming':>9} {seconds:>9.3f} {peak:>10.1f} {output:>12.1f}")
+
+if __name__ == "__main__":
+    main()
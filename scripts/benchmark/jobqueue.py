@@ -0,0 +1,138 @@
+"""several queue workers on one machine, a temp directory stands in for the share
+
+run from the scripts directory: python -m benchmark.jobqueue [--files 24] [--workers 3] [--kill]
+Checks first that a job whose lease expired goes to another worker with a new export directory
+and that the result of the first worker is not recorded. Then that two workers finish a queue
+in which a dead worker holds a job: its lease expires, the job is taken again and every job is
+analysed once. Then writes synthetic plates, queues them with aminos.py queue add and starts workers as separate
+processes (aminos.py queue work --once), like PCs sharing the directory. --kill kills the first
+worker with its jobs in progress, the others take them over once the lease has expired.
+Prints the time, the jobs per worker and compares with one worker.
+"""
+import argparse
+import glob
+import json
+import logging
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+import aminos
+import jobqueue
+from benchmark import plates
+
+SCRIPTS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def queue_command(config_path, *args):
+    return [sys.executable, os.path.join(SCRIPTS_DIR, 'aminos.py'), '--config', config_path, 'queue', *args]
+
+def run_workers(config_path, workers, processes, lease, kill, cwd):
+    """starts the workers, waits for all of them and returns the seconds"""
+    start = time.perf_counter()
+    procs = [subprocess.Popen(queue_command(config_path, 'work', '--once', '-w', str(processes), '--lease', str(lease)),
+                              cwd=cwd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True)
+             for _ in range(workers)]
+    if kill:
+        time.sleep(lease / 2) # the first worker has taken jobs meanwhile
+        os.killpg(procs[0].pid, signal.SIGKILL) # with its analysis processes, like a PC switched off
+    for proc in procs:
+        proc.wait()
+    return time.perf_counter() - start
+
+def write_plates(cfg, references, raw_dir, files, patients):
+    os.makedirs(raw_dir)
+    for idx in range(files):
+        plate = plates.synthetic_plate(cfg, references['control_reference'], references['patients_reference'],
+                                       patients=patients, seed=idx)
+        plates.write_plate(plate, os.path.join(raw_dir, F"plate_{idx:03d}.xlsx"))
+
+def queue_config(cfg, run_dir):
+    """the config of the workers of run_dir with its queue, written to run_dir/config.json"""
+    os.makedirs(run_dir)
+    run_cfg = dict(cfg, export_directory=os.path.join(run_dir, 'analysed'), job_queue=os.path.join(run_dir, 'jobs.sqlite'),
+                   cache_directory='', result_cache=False, trend_store='', run_report=False,
+                   control_reference_file_path=os.path.abspath(cfg['control_reference_file_path']),
+                   patients_reference_file_path=os.path.abspath(cfg['patients_reference_file_path']))
+    config_path = os.path.join(run_dir, 'config.json')
+    with open(config_path, 'w') as f:
+        json.dump(run_cfg, f)
+    return run_cfg, config_path
+
+def check_lost_lease(tmp_dir):
+    """a worker which lost its lease keeps no job and no export directory of another worker"""
+    path = os.path.join(tmp_dir, 'lost.sqlite')
+    connection = jobqueue.connect(path)
+    try:
+        connection.execute("INSERT INTO jobs (file, export_directory, status, queued_at) VALUES ('plate.xlsx', 'out/plate', 'queued', '')")
+        job_id, _, first_dir = jobqueue.claim(connection, 'slow:0', 60, max_attempts=3)
+        connection.execute("UPDATE jobs SET lease_until = 0") # the first worker slept through its heartbeat
+        _, _, second_dir = jobqueue.claim(connection, 'next:0', 60, max_attempts=3)
+        assert second_dir == 'out/plate_attempt2' and second_dir != first_dir, F"job taken again into {second_dir}"
+        assert jobqueue.renew(connection, 'slow:0', [job_id], 60) == set(), "the first worker still holds the lease"
+        jobqueue.finish(connection, 'slow:0', job_id, {'file': 'plate.xlsx', 'status': 'ok'})
+        worker, job_status = connection.execute("SELECT worker, status FROM jobs").fetchone()
+        assert (worker, job_status) == ('next:0', 'running'), "the result of the first worker was recorded"
+    finally:
+        connection.close()
+    print("check: a lost lease goes with a new export directory, the late result is dropped")
+
+def check_leases(cfg, references, tmp_dir, files=6, lease=2.0):
+    """two workers and a job held by a worker which died: it is taken again, no job is analysed twice"""
+    raw_dir = os.path.join(tmp_dir, 'check_raw')
+    write_plates(cfg, references, raw_dir, files, 50)
+    run_dir = os.path.join(tmp_dir, 'check')
+    run_cfg, config_path = queue_config(cfg, run_dir)
+    subprocess.run(queue_command(config_path, 'add', raw_dir), cwd=run_dir, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    connection = jobqueue.connect(run_cfg['job_queue'])
+    try:
+        _, abandoned, _ = jobqueue.claim(connection, 'dead:0', lease, max_attempts=3) # never renewed
+    finally:
+        connection.close()
+    run_workers(config_path, 2, 1, lease, False, run_dir)
+
+    jobs = jobqueue.summary(run_cfg['job_queue'])
+    assert (jobs['status'] == 'ok').all(), F"jobs not done: {jobs[jobs['status'] != 'ok'][['file', 'status', 'error']]}"
+    taken_again = jobs[jobs['file'] == abandoned].iloc[0]
+    assert taken_again['attempts'] == 2 and taken_again['worker'] != 'dead:0', "the expired lease was not taken again"
+    assert '_attempt2' in taken_again['export_excel_path'], "the job taken again has no new export directory"
+    assert (jobs[jobs['file'] != abandoned]['attempts'] == 1).all(), "a job was taken twice"
+    for export_excel_path in jobs['export_excel_path']:
+        export_dir = os.path.dirname(os.path.dirname(export_excel_path))
+        workbooks = glob.glob(os.path.join(export_dir, '*', '*' + cfg['file_extension_analysis']))
+        assert len(workbooks) == 1, F"{export_dir} was analysed {len(workbooks)} times"
+    print(F"check: {files} jobs done once by {jobs['worker'].nunique()} workers, the job of the dead worker was taken again")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--files', type=int, default=24)
+    parser.add_argument('--patients', type=int, default=300)
+    parser.add_argument('--workers', type=int, default=3, help="worker processes, each like one PC")
+    parser.add_argument('--processes', type=int, default=1, help="analysis processes per worker")
+    parser.add_argument('--lease', type=float, default=6.0)
+    parser.add_argument('--kill', action='store_true')
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+
+    cfg = aminos.read_config()
+    references = aminos.read_references(cfg)
+    with tempfile.TemporaryDirectory() as share_dir:
+        check_lost_lease(share_dir)
+        check_leases(cfg, references, share_dir)
+        raw_dir = os.path.join(share_dir, 'raw')
+        write_plates(cfg, references, raw_dir, args.files, args.patients)
+        results = []
+        for workers, kill in ((1, False), (args.workers, args.kill)):
+            run_dir = os.path.join(share_dir, F"run_{workers}")
+            run_cfg, config_path = queue_config(cfg, run_dir)
+            subprocess.run(queue_command(config_path, 'add', raw_dir), cwd=run_dir, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            seconds = run_workers(config_path, workers, args.processes, args.lease, kill, run_dir)
+            jobs = jobqueue.summary(run_cfg['job_queue'])
+            results.append(seconds)
+            print(F"{workers} workers{' (first one killed)' if kill else ''}: {seconds:.1f} s, {jobqueue.status(run_cfg['job_queue'])}")
+            print(F"  jobs per worker: {jobs.groupby('worker').size().to_dict()}, taken again: {(jobs['attempts'] > 1).sum()}")
+        print(F"speedup {results[0] / results[1]:.2f}")
+
+if __name__ == "__main__":
+    main()
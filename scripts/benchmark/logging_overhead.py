@@ -0,0 +1,93 @@
+"""compares the former synchronous log handlers with the queue of config.setup_logging
+
+run from the scripts directory: python -m benchmark.logging_overhead [--patients 5000] [--variants 3] [--latency 0.5]
+Times an analysis of a synthetic plate (without export), the cost of one log call in the calling
+thread and an eager f-string debug message against a lazy one while DEBUG is off. The console
+takes latency ms per line, like the Windows console or a log on a network drive.
+"""
+import argparse
+import logging
+import os
+import tempfile
+import time
+import timeit
+import aminos
+import config
+from benchmark import plates
+
+class SlowStream:
+    def __init__(self, latency):
+        self.latency = latency
+
+    def write(self, text):
+        if self.latency:
+            time.sleep(self.latency)
+
+    def flush(self):
+        pass
+
+def setup_synchronous(filename, stream):
+    """the handlers as they were set up before: the file and the console written by the logging call"""
+    logging.basicConfig(level=logging.INFO, format=config.LOG_FORMAT, datefmt='%Y.%m.%d %H:%M:%S', filename=filename)
+    console_handler = logging.StreamHandler(stream)
+    console_handler.setFormatter(logging.Formatter(config.LOG_FORMAT))
+    logging.getLogger("main").addHandler(console_handler)
+
+def teardown_synchronous():
+    for logger in (logging.getLogger(), logging.getLogger("main")):
+        for handler in list(logger.handlers):
+            logger.removeHandler(handler)
+            handler.close()
+
+def count_records(filename):
+    with open(filename) as f:
+        return sum(1 for _ in f)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--patients', type=int, default=5000)
+    parser.add_argument('--variants', type=int, default=3)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--latency', type=float, default=0.5, help="ms per console line")
+    args = parser.parse_args()
+
+    cfg = aminos.read_config()
+    references = aminos.read_references(cfg)
+    logger = logging.getLogger("main")
+    console = SlowStream(args.latency / 1000)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        plate = plates.synthetic_plate(cfg, references['control_reference'], references['patients_reference'],
+                                       patients=args.patients, variants=args.variants, ignored=4)
+        path = os.path.join(tmp_dir, 'plate.xlsx')
+        plates.write_plate(plate, path)
+        # the parsed raw data comes from the cache of ingest, the xlsx parser would hide the rest
+        run_cfg = dict(cfg, file_to_analyze=path, export_directory=os.path.join(tmp_dir, 'analysed'), cache_directory=tmp_dir,
+                       result_cache=False, trend_store='', run_report=False, output_formats=[], stage_memo=False)
+        setups = [
+            ('synchronous', lambda log: setup_synchronous(log, console), teardown_synchronous),
+            ('queue', lambda log: config.setup_logging(log, stream=console), config.stop_logging),
+            ('queue + json', lambda log: config.setup_logging(log, log + '.jsonl', stream=console), config.stop_logging),
+        ]
+        print(F"{'handlers':>14} {'analysis [s]':>13} {'records':>8} {'log call [us]':>14}") # records per analysis
+        for name, setup, teardown in setups:
+            log = os.path.join(tmp_dir, name.replace(' ', '_') + '.log')
+            setup(log)
+            aminos.analyse(run_cfg, references) # warm up, fills the raw data cache
+            seconds = min(timeit.repeat(lambda: aminos.analyse(run_cfg, references), number=1, repeat=args.repeat))
+            calls = 2000
+            start = time.perf_counter()
+            for idx in range(calls):
+                logger.warning("Conflict in control %s with %s and %s (score %s), took %s", 61, 'Asp', 'Asp_cs', float(idx), 'Asp')
+            per_call = (time.perf_counter() - start) / calls * 1e6
+            teardown()
+            records = (count_records(log) - calls) // (args.repeat + 1)
+            print(F"{name:>14} {seconds:>13.3f} {records:>8} {per_call:>14.1f}")
+
+        # the former check_controls debug message: the frame is formatted although DEBUG is off
+        column = plate.iloc[:, 2]
+        eager = timeit.timeit(lambda: logger.debug(F"{column.to_string(index=False)}"), number=20)
+        lazy = timeit.timeit(lambda: logger.debug("%s", column), number=20)
+        print(F"debug message of a column while DEBUG is off: eager f-string {eager / 20 * 1e3:.2f} ms, lazy {lazy / 20 * 1e6:.2f} us")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+"""times an analysis whose raw file and export directory lie on a simulated network share
+
+run from the scripts directory: python -m benchmark.overlap_io [--patients 2000] [--latency 30] [--mbps 20]
+Every file below the share directory costs latency ms when it is opened and its size at mbps
+MB/s when it is closed, in the thread doing it, a rename onto the share copies like between two
+file systems. Compares background_io off (the copy, parse and
+workbook one after the other) and on, the stage timings come from the run report.
+Checks first that the exported files get the same permissions with and without background_io.
+"""
+import argparse
+import builtins
+import errno
+import io
+import json
+import logging
+import glob
+import os
+import stat
+import tempfile
+import time
+import aminos
+import ingest
+from benchmark import plates
+
+class ShareFile:
+    """a file on the share, closing it takes the time of the transfer"""
+    def __init__(self, f, latency, mbps):
+        self._f = f
+        self._bytes_per_second = mbps * 2**20
+        time.sleep(latency)
+
+    def __getattr__(self, name):
+        return getattr(self._f, name)
+
+    def __iter__(self):
+        return iter(self._f)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        if not self._f.closed:
+            size = os.fstat(self._f.fileno()).st_size
+            self._f.close()
+            time.sleep(size / self._bytes_per_second)
+
+def simulate_share(share_dir, latency, mbps):
+    """replaces open (zipfile uses io.open) and os.replace for files below share_dir, returns the function restoring them"""
+    real_open, real_replace = builtins.open, os.replace
+    share_dir = os.path.abspath(share_dir)
+
+    def on_share(file):
+        return isinstance(file, (str, bytes, os.PathLike)) and os.path.abspath(os.fsdecode(file)).startswith(share_dir)
+
+    def share_open(file, *args, **kwargs):
+        f = real_open(file, *args, **kwargs)
+        return ShareFile(f, latency, mbps) if on_share(file) else f
+
+    def share_replace(source, target):
+        if on_share(source) != on_share(target):
+            raise OSError(errno.EXDEV, "Invalid cross-device link")
+        real_replace(source, target)
+
+    builtins.open = io.open = share_open
+    os.replace = share_replace
+
+    def restore():
+        builtins.open = io.open = real_open
+        os.replace = real_replace
+    return restore
+
+def stage_seconds(report, names):
+    return {stage['name']: stage['wall_s'] for stage in report['stages'] if stage['name'] in names}
+
+def check_modes(cfg, references, path, tmp_dir):
+    """the workbook and the archive copy are readable like any new file (0666 without the umask)"""
+    umask = os.umask(0)
+    os.umask(umask)
+    expected = 0o666 & ~umask
+    for background in (False, True):
+        export_dir = os.path.join(tmp_dir, F"modes_{background}")
+        run_cfg = dict(cfg, file_to_analyze=path, export_directory=export_dir, cache_directory='', result_cache=False,
+                       trend_store='', run_report=False, stage_memo=False, background_io=background)
+        aminos.analyse(run_cfg, references)
+        for exported in glob.glob(os.path.join(export_dir, '*', '*.xlsx')):
+            mode = stat.S_IMODE(os.stat(exported).st_mode)
+            assert mode == expected, F"{os.path.basename(exported)} has mode {mode:o} with background_io {background}, expected {expected:o}"
+    print(F"check: exported files have mode {expected:o} with and without background_io")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--patients', type=int, default=2000)
+    parser.add_argument('--latency', type=float, default=30, help="ms per opened file")
+    parser.add_argument('--mbps', type=float, default=20, help="MB/s of the share")
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+
+    cfg = aminos.read_config()
+    references = aminos.read_references(cfg)
+    steps = ('preparation', 'read_raw_data', 'export_xlsx', 'transfers')
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        share_dir = os.path.join(tmp_dir, 'share')
+        os.makedirs(share_dir)
+        path = os.path.join(share_dir, 'plate.xlsx')
+        plates.write_plate(plates.synthetic_plate(cfg, references['control_reference'], references['patients_reference'],
+                                                  patients=args.patients, variants=2), path)
+        check_modes(cfg, references, path, tmp_dir)
+        print(F"raw file {os.path.getsize(path) / 2**20:.1f} MB, share {args.latency:g} ms per file, {args.mbps:g} MB/s")
+        print(F"{'background_io':>13} {'total [s]':>10} " + ' '.join(F"{step + ' [s]':>17}" for step in steps))
+        restore = simulate_share(share_dir, args.latency / 1000, args.mbps)
+        try:
+            for background in (False, True):
+                run_cfg = dict(cfg, file_to_analyze=path, export_directory=os.path.join(share_dir, 'analysed'), cache_directory='',
+                               result_cache=False, trend_store='', run_report=True, stage_memo=False, background_io=background)
+                best = None
+                for _ in range(args.repeat):
+                    ingest.clear_memo() # the raw file comes from the share every time
+                    start = time.perf_counter()
+                    data = aminos.analyse(run_cfg, references)
+                    seconds = time.perf_counter() - start
+                    with open(aminos.report_path(data['export_excel_path'])) as f:
+                        report = json.load(f)
+                    if best is None or seconds < best[0]:
+                        best = (seconds, stage_seconds(report, steps))
+                seconds, timings = best
+                print(F"{str(background):>13} {seconds:>10.3f} " + ' '.join(F"{timings.get(step, 0):>17.3f}" for step in steps))
+        finally:
+            restore()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+"""compares aminos.patient_flags with the former flag frame of the patient sheet writer
+
+run from the scripts directory: python -m benchmark.patient_flags [--patients 20 200 2000 20000]
+"""
+import argparse
+import logging
+import warnings
+import numpy as np
+import pandas as pd
+import aminos
+from benchmark import export
+from benchmark.common import measure
+
+def patient_flags_frame(data):
+    """the fmt frame of write_patients_data before the vectorization, kept as reference"""
+    patients = data['data_filtered']
+    pat_ref = data['patients_reference']
+    fmt = pd.DataFrame().reindex_like(patients)
+    for col in pat_ref.columns.values:
+        col_name = patients.columns[patients.columns.str.contains(pat = col)][0]
+        fmt[col_name][patients[col_name] < pat_ref.loc[0,col]] = 1
+        fmt[col_name][patients[col_name] > pat_ref.loc[1,col]] = 2
+    fmt[patients.columns[data['idx_invalids']]] = -1
+    fmt.fillna(0, inplace=True)
+    return fmt
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--patients', type=int, nargs='+', default=[20, 200, 2000, 20000])
+    args = parser.parse_args()
+
+    cfg = aminos.read_config()
+    logging.disable(logging.WARNING) # conflicts of the control selection
+    warnings.simplefilter('ignore') # the chained assignments of the former frame
+    print(F"{'patients':>8} {'frame [s]':>10} {'vectorized [s]':>15} {'speedup':>8}")
+    for patients in args.patients:
+        data = export.analysed_plate(cfg, patients)
+        frame, t_frame = measure(patient_flags_frame, data)
+        flags, t_flags = measure(aminos.patient_flags, data)
+        n_meta = len(data['column_index']['meta'])
+        assert np.array_equal(frame.iloc[:, n_meta:].to_numpy(dtype=np.int8), flags), F"flags differ for {patients} patients"
+        print(F"{patients:>8} {t_frame:>10.4f} {t_flags:>15.4f} {t_frame / t_flags:>7.0f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""times every stage of aminos.analyse on synthetic plates, results as json for comparisons between commits
+
+run from the scripts directory, no display needed:
+    python -m benchmark.pipeline [--patients 20 200 2000] [--variants 1 3] [--no-peak 0 0.05] [--repeat 3]
+    python -m benchmark.pipeline --compare old.json new.json
+"""
+import argparse
+import datetime
+import itertools
+import json
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import tempfile
+import numpy as np
+import pandas as pd
+import aminos
+from benchmark import plates
+
+# stages of the run report shown in the table, the json keeps all of them
+STAGES = ['read_raw_data', 'filter_raw_data', 'check_controls', 'select_control', 'filter_patients_data', 'export', 'total']
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run_scenario(cfg, references, scenario, repeat, tmp_dir):
+    """analyses the plate of the scenario repeat times, returns the median wall time per stage"""
+    plate = plates.synthetic_plate(cfg, references['control_reference'], references['patients_reference'], **scenario)
+    path = os.path.join(tmp_dir, 'plate.xlsx')
+    plates.write_plate(plate, path)
+    run_cfg = dict(cfg, file_to_analyze=path, export_directory=os.path.join(tmp_dir, 'analysed'),
+                   cache_directory='', run_report=True, stage_memo=False) # every repetition runs all stages
+    walls = {}
+    for _ in range(repeat):
+        data = aminos.analyse(run_cfg, references)
+        with open(aminos.report_path(data['export_excel_path'])) as fp:
+            run_report = json.load(fp)
+        for record in run_report['stages']:
+            walls.setdefault(record['name'], []).append(record['wall_s'])
+    return {'scenario': scenario, 'rows': len(plate), 'columns': plate.shape[1],
+            'stages': {name: statistics.median(times) for name, times in walls.items()}}
+
+def print_results(results):
+    print(F"{'patients':>8} {'var':>3} {'nopeak':>6} " + ' '.join(F"{name[:14]:>14}" for name in STAGES))
+    for result in results:
+        scenario = result['scenario']
+        times = ' '.join(F"{result['stages'].get(name, float('nan')):>14.4f}" for name in STAGES)
+        print(F"{scenario['patients']:>8} {scenario['variants']:>3} {scenario['no_peak']:>6} {times}")
+
+def compare(old_path, new_path):
+    """ratio new/old of every stage of the scenarios both files have"""
+    with open(old_path) as fp:
+        old = json.load(fp)
+    with open(new_path) as fp:
+        new = json.load(fp)
+    old_results = {json.dumps(result['scenario'], sort_keys=True): result for result in old['results']}
+    print(F"{old.get('commit')} -> {new.get('commit')}, new / old")
+    print(F"{'patients':>8} {'var':>3} {'nopeak':>6} " + ' '.join(F"{name[:14]:>14}" for name in STAGES))
+    for result in new['results']:
+        before = old_results.get(json.dumps(result['scenario'], sort_keys=True))
+        if before is None:
+            continue
+        ratios = ' '.join(F"{result['stages'][name] / before['stages'][name]:>13.2f}x" if name in result['stages'] and name in before['stages'] else F"{'-':>14}" for name in STAGES)
+        scenario = result['scenario']
+        print(F"{scenario['patients']:>8} {scenario['variants']:>3} {scenario['no_peak']:>6} {ratios}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--patients', type=int, nargs='+', default=[20, 200, 2000])
+    parser.add_argument('--variants', type=int, nargs='+', default=[1, 3])
+    parser.add_argument('--no-peak', type=float, nargs='+', default=[0.0, 0.05])
+    parser.add_argument('--control-repeats', type=int, default=3, help="measurements of every control ring per plate")
+    parser.add_argument('--ignored', type=int, default=4, help="SIGMA/Phe samples per plate")
+    parser.add_argument('--repeat', type=int, default=3, help="runs per scenario, the median is stored")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('-o', '--output', default=None, help="json file (default: benchmark_results/<date>_<commit>.json)")
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'), help="compares two result files instead of running")
+    args = parser.parse_args()
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    cfg = aminos.read_config()
+    references = aminos.read_references(cfg)
+    logging.disable(logging.INFO) # the analyse logs dominate the output otherwise
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for patients, variants, no_peak in itertools.product(args.patients, args.variants, args.no_peak):
+            scenario = {'patients': patients, 'control_repeats': args.control_repeats, 'variants': variants,
+                        'no_peak': no_peak, 'ignored': args.ignored, 'seed': args.seed}
+            results.append(run_scenario(cfg, references, scenario, args.repeat, tmp_dir))
+    print_results(results)
+
+    commit = git_commit()
+    output = args.output
+    if output is None:
+        output = os.path.join('..', 'benchmark_results', F"{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}_{commit or 'nogit'}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as fp:
+        json.dump({'commit': commit, 'created': datetime.datetime.now().isoformat(timespec='seconds'),
+                   'python': platform.python_version(), 'pandas': pd.__version__, 'numpy': np.__version__,
+                   'machine': platform.platform(), 'repeat': args.repeat, 'results': results}, fp, indent=4)
+    print(F"results written to {output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""synthetic raw data workbooks with the schema of the instrument export
+
+    python -m benchmark.plates out.xlsx [--patients 500] [--control-repeats 3] [--variants 2] [--no-peak 0.02]
+"""
+import argparse
+import numpy as np
+import pandas as pd
+import aminos
+
+# suffixes of the isomer columns as they appear in the instrument export, then numbered ones
+VARIANT_SUFFIXES = ['_cs', '_ph', '_HPH4', ' mit IS d5-Phe']
+ROMAN = ['I', 'II', 'III', 'IV', 'V', 'VI', 'VII', 'VIII']
+
+def variant_names(amino, variants):
+    names = [amino]
+    for idx in range(1, variants):
+        names.append(amino + (VARIANT_SUFFIXES[idx - 1] if idx <= len(VARIANT_SUFFIXES) else F"_v{idx}"))
+    return names
+
+def control_name(cfg, ring_pos, ring):
+    roman = ROMAN[ring_pos] if ring_pos < len(ROMAN) else str(ring_pos + 1)
+    return F"{cfg['control_name_prefix']} {roman} ({ring})"
+
+def synthetic_plate(cfg, control_reference, patients_reference, patients=100, control_repeats=3, rings=None,
+                    variants=1, no_peak=0.0, ignored=0, seed=0):
+    """a plate like the instrument exports it
+
+    The controls of all rings are measured control_repeats times, each time followed by an
+    equal share of the patients. Every amino gets variants columns. Controls scatter around the
+    mean of their ring, patients around the normal range. no_peak is the share of amino cells
+    holding "No Peak", ignored is the number of cfg['ignore_samples'] measurements mixed in.
+    """
+    rng = np.random.default_rng(seed)
+    if rings is None:
+        rings = cfg['control_ring_samples']
+    aminos_ref = [col for col in control_reference.columns if col not in ('controls', 'limits')]
+    # first all aminos, then their variants, like the instrument export
+    groups = [variant_names(amino, variants) for amino in aminos_ref]
+    amino_columns = [group[0] for group in groups] + [col for group in groups for col in group[1:]]
+    column_amino = {col: amino for amino, group in zip(aminos_ref, groups) for col in group}
+
+    names = []
+    for block in range(control_repeats):
+        names += [control_name(cfg, ring_pos, ring) for ring_pos, ring in enumerate(rings)]
+        start = block * patients // control_repeats
+        end = (block + 1) * patients // control_repeats
+        names += list(range(start + 1, end + 1))
+    if control_repeats == 0:
+        names += list(range(1, patients + 1))
+    for idx in range(ignored):
+        names.insert(int(rng.integers(0, len(names) + 1)), cfg['ignore_samples'][idx % len(cfg['ignore_samples'])])
+
+    amino_of_columns = [column_amino[col] for col in amino_columns]
+    # patients uniform around their normal range, aminos without patient limits anywhere in 1..100
+    patient_limits = patients_reference.reindex(columns=amino_of_columns).to_numpy(dtype=float)
+    low = np.nan_to_num(patient_limits[0], nan=1.0)
+    high = np.nan_to_num(patient_limits[1], nan=100.0)
+    values = rng.uniform(low - 0.2 * (high - low), high + 0.2 * (high - low), (len(names), len(amino_columns)))
+    # controls normal distributed around the mean of their ring, most of them within the limits
+    ring_of = {control_name(cfg, ring_pos, ring): ring for ring_pos, ring in enumerate(rings)}
+    for name, ring in ring_of.items():
+        rows = [row for row, sample in enumerate(names) if sample == name]
+        limits = control_reference[control_reference['controls'] == ring].set_index('limits')[amino_of_columns]
+        if 'mean' not in limits.index:
+            continue # ring without reference, its controls look like patients
+        mean = limits.loc['mean'].to_numpy(dtype=float)
+        scale = (limits.loc['max'] - limits.loc['min']).to_numpy(dtype=float) / 4
+        values[rows] = rng.normal(mean, scale, (len(rows), len(amino_columns)))
+    values = np.round(np.abs(values), 3)
+
+    plate = pd.DataFrame(values, columns=amino_columns)
+    if no_peak > 0:
+        plate = plate.astype(object).mask(rng.random(plate.shape) < no_peak, 'No Peak')
+    plate.insert(0, cfg['columns']['sample_name'], names)
+    plate.insert(0, 'Unnamed: 0', np.arange(1, len(names) + 1))
+    return plate
+
+def write_plate(plate, path):
+    # the first header cell of the instrument export is empty, pandas reads it as "Unnamed: 0"
+    plate.rename(columns={'Unnamed: 0': ''}).to_excel(path, index=False)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('output')
+    parser.add_argument('--patients', type=int, default=100)
+    parser.add_argument('--control-repeats', type=int, default=3)
+    parser.add_argument('--variants', type=int, default=1)
+    parser.add_argument('--no-peak', type=float, default=0.0)
+    parser.add_argument('--ignored', type=int, default=0)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    cfg = aminos.read_config()
+    references = aminos.read_references(cfg)
+    plate = synthetic_plate(cfg, references['control_reference'], references['patients_reference'], args.patients,
+                            args.control_repeats, variants=args.variants, no_peak=args.no_peak, ignored=args.ignored, seed=args.seed)
+    write_plate(plate, args.output)
+    print(F"{args.output}: {len(plate)} rows, {plate.shape[1]} columns")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""compares the vectorized control scoring and variant selection with the former per ring and per column loops
+
+run from the scripts directory: python -m benchmark.select_control [--rings 2 8 32] [--variants 1 4 16]
+"""
+import argparse
+import logging
+import numpy as np
+import pandas as pd
+import aminos
+from benchmark.common import measure
+
+def select_control_loop(cfg, data):
+    """score_controls, switch_amino_columns and rank_controls as they were before the vectorization, kept as reference"""
+    controls = data['controls']
+    checked_controls = data['checked_controls']
+    column_index = data['column_index']
+    column_name = cfg['columns']['sample_name']
+    dat = {'data': {}}
+    best_control = [0, 0]
+    second_best_control = [0, 0]
+    for ring in cfg['control_ring_samples']:
+        mask = controls[column_name].str.contains(str(ring))
+        if any(mask):
+            ring_data = {}
+            ring_data['checked'] = checked_controls[mask]
+            counts = ring_data['checked'].astype(object).apply(pd.value_counts).fillna(0)
+            ring_data['score'] = counts[(counts.index == 'NORMAL')]
+            ring_data['prios'], ring_data['conflicts'] = switch_amino_columns_loop(cfg, ring_data['score'], column_index)
+            ring_data['prios_score'] = ring_data['prios'].sum(axis = 1, skipna = True).item()
+            dat['data'][str(ring)] = ring_data
+            if best_control[1] < ring_data['prios_score']:
+                second_best_control = best_control.copy()
+                best_control[1] = ring_data['prios_score'] 
+                best_control[0] = ring
+    dat['best_control_name'] = best_control[0]
+    dat['second_best_control_name'] = second_best_control[0]
+    return dat
+
+def switch_amino_columns_loop(cfg, score, column_index):
+    ret = pd.DataFrame().reindex_like(score)
+    conflicts = []
+    meta = column_index['meta']
+    ret[meta] = score[meta]
+    for amino in column_index['aminos']:
+        variants = column_index['variants'][amino]
+        if not len(variants):
+            continue
+        idx_name = score[variants].idxmax(axis=1).item()
+        for col in variants:
+            if col == idx_name:
+                continue
+            if score[col].item() == score[idx_name].item() and score[col].item() != 0:
+                if len(cfg['prefer_aminos']) > 0:
+                    if (col in cfg['prefer_aminos']):
+                        idx_name = col
+                else:
+                    conflicts.append((idx_name, col))
+        ret[idx_name] = score[idx_name]
+    return ret, conflicts
+
+def synthetic_data(cfg, control_reference, patients_reference, rings, variants, repeats=3, seed=0):
+    """checked controls of rings x repeats controls with every amino in several variants"""
+    rng = np.random.default_rng(seed)
+    amino_names = [col for col in control_reference.columns if col not in ('controls', 'limits')]
+    columns = ['Unnamed: 0', cfg['columns']['sample_name']]
+    columns += [amino if idx == 0 else F"{amino}_v{idx}" for amino in amino_names for idx in range(variants)]
+    ring_names = list(range(100, 100 + rings))
+    names = np.repeat([F"Ko ({ring})" for ring in ring_names], repeats)
+    controls = pd.DataFrame(np.nan, index=np.arange(len(names)), columns=columns)
+    controls[columns[1]] = names
+    
+    data = {'controls': controls}
+    data['column_index'] = aminos.build_column_index(dict(cfg, control_ring_samples=ring_names), columns, control_reference, patients_reference)
+    # few distinct states, so ties between variants are common
+    status = rng.choice([aminos.STATUS_TOO_LOW, aminos.STATUS_NORMAL, aminos.STATUS_TOO_HIGH], size=controls.shape, p=[0.2, 0.6, 0.2]).astype(np.int8)
+    status[:, :2] = aminos.STATUS_NONE
+    data['control_status'] = status
+    data['checked_controls'] = aminos.status_labels(controls, status)
+    return dict(cfg, control_ring_samples=ring_names), data
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rings', type=int, nargs='+', default=[2, 8, 32])
+    parser.add_argument('--variants', type=int, nargs='+', default=[1, 4, 16])
+    args = parser.parse_args()
+    
+    cfg = aminos.read_config()
+    references = aminos.read_references(cfg)
+    logging.disable(logging.CRITICAL) # both implementations log every conflict
+    print(F"{'rings':>6} {'variants':>9} {'loop [s]':>10} {'vectorized [s]':>15} {'speedup':>8}")
+    for rings in args.rings:
+        for variants in args.variants:
+            ring_cfg, data = synthetic_data(cfg, references['control_reference'], references['patients_reference'], rings, variants)
+            loop, t_loop = measure(select_control_loop, ring_cfg, data)
+            vectorized, t_vectorized = measure(aminos.select_control, ring_cfg, data)
+            assert loop['best_control_name'] == vectorized['best_control_name'], "best control differs"
+            for ring, ring_data in loop['data'].items():
+                other = vectorized['data'][ring]
+                assert ring_data['score'].equals(other['score']), F"scores of ring {ring} differ"
+                assert ring_data['prios'].equals(other['prios']), F"selection of ring {ring} differs"
+                assert ring_data['conflicts'] == other['conflicts'], F"conflicts of ring {ring} differ"
+            print(F"{rings:>6} {variants:>9} {t_loop:>10.4f} {t_vectorized:>15.4f} {t_loop / t_vectorized:>7.0f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""compares cold analyses (a new python process per file) with jobs of the warm analysis service
+
+run from the scripts directory: python -m benchmark.service [--runs 5] [--file ../rohdaten_example.xlsx]
+Checks first that jobs and re-runs finished within one second get export paths of their own and
+that unknown preferences are answered with 400.
+"""
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+import aminos
+import client
+from benchmark.common import repeated
+
+SCRIPTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+EXAMPLE_FILE = os.path.join(SCRIPTS_DIR, '..', 'rohdaten_example.xlsx')
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind((client.HOST, 0))
+        return sock.getsockname()[1]
+
+def run(args):
+    subprocess.run([sys.executable] + args, cwd=SCRIPTS_DIR, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+def start_service(config_file, port, timeout=60):
+    process = subprocess.Popen([sys.executable, 'aminos.py', '--config', config_file, 'serve', '--port', str(port)],
+                               cwd=SCRIPTS_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    start = time.perf_counter()
+    while not client.is_running(port):
+        if process.poll() is not None or time.perf_counter() - start > timeout:
+            process.kill()
+            raise RuntimeError("service did not start")
+        time.sleep(0.05)
+    return process, time.perf_counter() - start
+
+def check_unique_exports(port, filepath, jobs=3):
+    """the warm service finishes several jobs per second, none may write into the files of another"""
+    results = [client.submit(port, filepath) for _ in range(jobs)]
+    results += [client.resubmit(port, results[0]['job'], {}) for _ in range(jobs)]
+    paths = [result['export_excel_path'] for result in results]
+    assert len(set(paths)) == len(paths), F"export paths used twice: {paths}"
+    assert len({result['export_dir'] for result in results[:jobs]}) == jobs, "jobs share an export directory"
+    assert all(os.path.isfile(path) for path in paths), "an excel sheet is missing"
+    print(F"check: {jobs} jobs and {jobs} re-runs in a row, each with its own excel sheet")
+
+def status_code(port, path, payload):
+    req = urllib.request.Request(F"http://{client.HOST}:{port}{path}", data=json.dumps(payload).encode('utf-8'),
+                                 headers={'Content-Type': 'application/json'})
+    try:
+        with urllib.request.urlopen(req) as response:
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+
+def check_bad_preferences(port, filepath):
+    """a ring or column the plate does not have is a bad request, not an error of the service"""
+    job = client.submit(port, filepath)['job']
+    rings = sorted(client.submit(port, filepath)['selected_control']['data'])
+    requests = [('/analyse', {'file': filepath, 'config': {'prefer_control': 99}}),
+                ('/analyse', {'file': filepath, 'config': {'prefer_aminos': 'Asp'}}),
+                ('/reanalyse', {'job': job, 'config': {'prefer_control': 12345}}),
+                ('/reanalyse', {'job': job, 'config': {'prefer_aminos': ['NoSuchAmino']}})]
+    # a ring of control_ring_samples which is not on this plate
+    missing = [ring for ring in aminos.default_config()['control_ring_samples'] if str(ring) not in rings]
+    requests += [('/reanalyse', {'job': job, 'config': {'prefer_control': ring}}) for ring in missing[:1]]
+    for path, payload in requests:
+        code = status_code(port, path, payload)
+        assert code == 400, F"{path} {payload['config']} answered {code}"
+    assert status_code(port, '/reanalyse', {'job': job, 'config': {'prefer_control': int(rings[-1])}}) == 200
+    print(F"check: unknown preferences answered with 400, rings of the plate {', '.join(rings)} work")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--file', default=EXAMPLE_FILE)
+    args = parser.parse_args()
+    filepath = os.path.abspath(args.file)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        cfg = aminos.default_config()
+        cfg['file_to_analyze'] = filepath
+        cfg['export_directory'] = os.path.join(tmp_dir, 'analysed')
+        cfg['cache_directory'] = os.path.join(tmp_dir, 'cache')
+        config_file = os.path.join(tmp_dir, 'config.json')
+        with open(config_file, 'w') as fp:
+            json.dump(cfg, fp, indent=4)
+        port = free_port()
+
+        rows = []
+        rows.append(('cold: python aminos.py', repeated(lambda: run(['aminos.py', '--config', config_file]), args.runs)))
+        process, startup = start_service(config_file, port)
+        try:
+            check_unique_exports(port, filepath)
+            check_bad_preferences(port, filepath)
+            rows.append(('warm: python client.py', repeated(lambda: run(['client.py', '--port', str(port), filepath]), args.runs)))
+            rows.append(('warm: request only', repeated(lambda: client.submit(port, filepath), args.runs)))
+        finally:
+            client.shutdown(port)
+            process.wait(timeout=30)
+
+    print(F"service start (once): {startup:.3f} s")
+    print(F"{'mode':<24} {'median [s]':>11} {'min [s]':>9} {'max [s]':>9}")
+    for name, times in rows:
+        print(F"{name:<24} {statistics.median(times):>11.3f} {min(times):>9.3f} {max(times):>9.3f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""times an analysis after changing one setting or reference file, with the stage memo and without
+
+run from the scripts directory: python -m benchmark.stage_memo [--patients 2000] [--variants 3]
+The export is left out (output_formats empty), it runs every time either way.
+"""
+import argparse
+import logging
+import os
+import tempfile
+import time
+import aminos
+import pipeline
+import profiling
+from benchmark import plates
+
+def changed_reference(path, tmp_dir):
+    """a copy of the patient reference with a wider range of its first amino"""
+    reference = aminos.read_reference_data(path)
+    reference.iloc[1, 0] = reference.iloc[1, 0] * 1.5
+    changed = os.path.join(tmp_dir, 'patienten_kontrollwerte.csv')
+    reference.to_csv(changed, index=False)
+    return changed
+
+def timed_run(cfg):
+    """wall time and the stages which actually ran"""
+    start = time.perf_counter()
+    with profiling.report(True) as run_report:
+        aminos.analyse(cfg)
+    seconds = time.perf_counter() - start
+    ran = [record['name'] for record in run_report['stages'] if record['parent'] == 'total' and 'memo' not in record]
+    return seconds, ran
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--patients', type=int, default=2000)
+    parser.add_argument('--variants', type=int, default=3)
+    args = parser.parse_args()
+    logging.disable(logging.WARNING) # the synthetic plates are full of conflicts
+
+    cfg = aminos.read_config()
+    references = aminos.read_references(cfg)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        plate = plates.synthetic_plate(cfg, references['control_reference'], references['patients_reference'],
+                                       patients=args.patients, variants=args.variants, ignored=4)
+        path = os.path.join(tmp_dir, 'plate.xlsx')
+        plates.write_plate(plate, path)
+        base = dict(cfg, file_to_analyze=path, export_directory=os.path.join(tmp_dir, 'analysed'), cache_directory='',
+                    result_cache=False, trend_store='', run_report=False, output_formats=[])
+        changes = [
+            ('unchanged', {}),
+            ('prefer_control', {'prefer_control': cfg['control_ring_samples'][1]}),
+            ('prefer_aminos', {'prefer_aminos': ['Asp_cs']}),
+            ('ignore_samples', {'ignore_samples': cfg['ignore_samples'][:1]}),
+            ('patients reference', {'patients_reference_file_path': changed_reference(cfg['patients_reference_file_path'], tmp_dir)}),
+        ]
+        print(F"{'change':>20} {'all stages [s]':>15} {'memo [s]':>10}  stages run with memo")
+        for name, change in changes:
+            changed = dict(base, **change)
+            full, _ = timed_run(dict(changed, stage_memo=False))
+            pipeline.clear_memory()
+            timed_run(dict(base, stage_memo=True)) # fills the memo with the unchanged config
+            memo, ran = timed_run(dict(changed, stage_memo=True))
+            print(F"{name:>20} {full:>15.3f} {memo:>10.3f}  {', '.join(ran)}")
+
+if __name__ == "__main__":
+    main()
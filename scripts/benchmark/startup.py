@@ -0,0 +1,80 @@
+"""cold start of the entry modules: import time per module as reported by python -X importtime
+
+run from the scripts directory: python -m benchmark.startup [--modules config client aminos gui] [--repeat 5] [--top 8]
+
+Every measurement runs in a fresh interpreter. Shows the total import time of each module,
+the slowest packages it pulls in and the wall time of the whole interpreter start. Then the
+wall time of python aminos.py --help and of a run stopped by an invalid config, both return
+before pandas is imported.
+"""
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+import tempfile
+from benchmark.common import fastest
+
+SCRIPTS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LINE = re.compile(r'import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)')
+
+def import_times(module):
+    """{module: (self us, cumulative us, depth)} of one fresh import, None if it fails"""
+    process = subprocess.run([sys.executable, '-X', 'importtime', '-c', F"import {module}"],
+                             stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    if process.returncode != 0:
+        return None
+    times = {}
+    for line in process.stderr.splitlines():
+        match = LINE.match(line)
+        if match is not None:
+            own, cumulative, indent, name = match.groups()
+            times[name] = (int(own), int(cumulative), len(indent) // 2)
+    return times
+
+def run_command(args, cwd):
+    """the return code of python aminos.py args, run in cwd for its logger.log"""
+    return subprocess.run([sys.executable, os.path.join(SCRIPTS_DIR, 'aminos.py'), *args], cwd=cwd,
+                          stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL).returncode
+
+def packages(times):
+    """cumulative import time of the top level packages, e.g. pandas with all its submodules"""
+    found = {}
+    for name, (own, cumulative, depth) in times.items():
+        top = name.split('.')[0]
+        if name == top:
+            found[top] = max(found.get(top, 0), cumulative)
+    return found
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--modules', nargs='+', default=['config', 'cli', 'client', 'excel', 'aminos', 'service', 'gui'])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--top', type=int, default=6, help="packages shown per module")
+    args = parser.parse_args()
+
+    _, baseline = fastest(import_times, args.repeat, 'sys')
+    print(F"empty interpreter start: {baseline * 1000:.0f} ms\n")
+    print(F"{'module':10s} {'import ms':>10s} {'wall ms':>9s}  slowest packages (ms)")
+    for module in args.modules:
+        times, wall = fastest(import_times, args.repeat, module)
+        if times is None:
+            print(F"{module:10s} {'failed':>10s}  (a dependency is missing)")
+            continue
+        total = times[module][1] if module in times else 0
+        heavy = sorted(((cumulative, name) for name, cumulative in packages(times).items() if name != module), reverse=True)
+        heavy = ', '.join(F"{name} {cumulative / 1000:.0f}" for cumulative, name in heavy[:args.top])
+        print(F"{module:10s} {total / 1000:10.0f} {wall * 1000:9.0f}  {heavy}")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        bad_config = os.path.join(tmp_dir, 'config.json')
+        with open(bad_config, 'w') as f:
+            json.dump({'control_ring_samples': 61}, f)
+        print()
+        for name, command in (('--help', ['--help']), ('invalid config', ['--config', bad_config, 'analyse'])):
+            returncode, wall = fastest(run_command, args.repeat, command, tmp_dir)
+            print(F"aminos.py {name:15s} {wall * 1000:6.0f} ms wall, exit code {returncode}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+"""fills a trend store with thousands of synthetic runs and times the trend queries
+
+run from the scripts directory: python -m benchmark.trends [--runs 5000] [--aminos 30] [--variants 3]
+"""
+import argparse
+import datetime
+import os
+import tempfile
+import time
+import numpy as np
+import trends
+from benchmark.common import fastest
+
+def fill(path, runs, aminos, variants, rings=(31, 32, 61, 62), samples=3, seed=0):
+    """writes runs the way trends.record does, one synthetic run per day"""
+    rng = np.random.default_rng(seed)
+    names = [F"A{i:02d}" for i in range(aminos)]
+    columns = [(amino, amino if v == 0 else F"{amino}_v{v}") for amino in names for v in range(variants)]
+    start = datetime.datetime(2015, 1, 1)
+    connection = trends.connect(path)
+    try:
+        with connection:
+            connection.executemany("INSERT OR IGNORE INTO amino_columns VALUES (?, ?)", ((variant, amino) for amino, variant in columns))
+            for run in range(runs):
+                date = (start + datetime.timedelta(days=run)).isoformat(timespec='seconds')
+                cursor = connection.execute("INSERT INTO runs (file_hash, raw_file, run_date, analysed_at) VALUES (?, ?, ?, ?)",
+                                            (F"hash{run}", F"run{run}.xlsx", date, date))
+                run_id = cursor.lastrowid
+                values = rng.normal(1.0, 0.1, (len(rings), samples, len(columns)))
+                connection.executemany("INSERT INTO control_values VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                                       ((run_id, date, ring, F"Ko ({ring})", amino, variant, float(values[r, s, c]), 2)
+                                        for r, ring in enumerate(rings) for s in range(samples)
+                                        for c, (amino, variant) in enumerate(columns)))
+                connection.executemany("INSERT INTO ring_scores VALUES (?, ?, ?, ?, ?)",
+                                       ((run_id, date, ring, float(rng.integers(0, 60)), int(r == 0)) for r, ring in enumerate(rings)))
+    finally:
+        connection.close()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--runs', type=int, default=5000)
+    parser.add_argument('--aminos', type=int, default=30)
+    parser.add_argument('--variants', type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'trends.sqlite')
+        start = time.perf_counter()
+        fill(path, args.runs, args.aminos, args.variants)
+        print(F"{args.runs} runs written in {time.perf_counter() - start:.1f} s, "
+              F"{os.path.getsize(path) / 2**20:.0f} MB")
+        queries = [('trend, amino, all runs', trends.trend, (path, 61, 'A07')),
+                   ('trend, amino column, all runs', trends.trend, (path, 62, 'A07_v1')),
+                   ('trend, amino, last year', trends.trend, (path, 61, 'A07', (datetime.datetime(2015, 1, 1) + datetime.timedelta(days=args.runs - 365)).date().isoformat())),
+                   ('ring scores, all runs', trends.ring_scores, (path, 61))]
+        for name, func, query_args in queries:
+            result, seconds = fastest(func, 5, *query_args)
+            print(F"{name:32s} {len(result):7d} rows {seconds * 1000:8.1f} ms")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,152 @@
+"""the command line of aminos.py, python aminos.py --help
+
+Only needs the standard library and config: the arguments are parsed and the config is checked
+before a command imports pandas, numpy and the analysis modules, --help or a wrong setting
+return at once.
+"""
+import argparse
+import logging
+import multiprocessing
+import os
+import sys
+import config
+
+_logger = logging.getLogger("main")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="AMINOS amino acid analysis")
+    parser.add_argument('--config', default='config.json', help="path to the config file")
+    parser.add_argument('--profile', action='store_true', help="writes a cProfile trace of the run, show it with python -m pstats <file>")
+    parser.add_argument('--profile-file', default='aminos.prof', help="file of the cProfile trace (default: aminos.prof)")
+    parser.add_argument('--log-json', default=None, help="also writes the log as one json object per line to this file, e.g. for batch runs")
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.add_parser('analyse', help="analyse cfg['file_to_analyze'] (default)")
+    parser_batch = subparsers.add_parser('batch', help="analyse many raw data workbooks in a process pool")
+    parser_batch.add_argument('inputs', nargs='+', help="directories, glob patterns, workbooks or manifest files with one path per line")
+    parser_batch.add_argument('-w', '--workers', type=int, default=None, help="number of worker processes (default: number of CPUs)")
+    parser_batch.add_argument('-o', '--export-directory', default=None, help="overrides export_directory of the config")
+    parser_batch.add_argument('--sheets', nargs='+', default=None, choices=config.EXCEL_SHEETS, help="overrides excel_sheets of the config, e.g. --sheets controls patients control")
+    parser_batch.add_argument('--formats', nargs='+', default=None, choices=config.OUTPUT_FORMATS, help="overrides output_formats of the config, e.g. --formats parquet")
+    parser_serve = subparsers.add_parser('serve', help="keep the analysis loaded and answer jobs of client.py and the GUI on localhost")
+    parser_serve.add_argument('-p', '--port', type=int, default=None, help="overrides service_port of the config")
+    parser_invalidate = subparsers.add_parser('invalidate', help="remove stored results from the result cache")
+    parser_invalidate.add_argument('files', nargs='*', help="raw data files whose results are removed (default: all results)")
+    parser_trend = subparsers.add_parser('trend', help="values of one amino of a control ring over all recorded runs")
+    parser_trend.add_argument('ring', type=int, help="control ring, e.g. 61")
+    parser_trend.add_argument('amino', help="amino (all variants) or amino column, e.g. Asp or Asp_cs")
+    parser_trend.add_argument('--since', default=None, help="first date, e.g. 2024-01-01")
+    parser_trend.add_argument('--until', default=None, help="date after the last one")
+    parser_trend.add_argument('--csv', default=None, help="writes the values to a csv file")
+    parser_trend.add_argument('--scores', action='store_true', help="scores of the ring per run instead of the values")
+    parser_watch = subparsers.add_parser('watch', help="analyse every new or changed workbook of a folder")
+    parser_watch.add_argument('directory', help="folder the instrument exports into")
+    parser_watch.add_argument('-w', '--workers', type=int, default=None, help="number of worker processes (default: number of CPUs)")
+    parser_watch.add_argument('-i', '--interval', type=float, default=2.0, help="seconds between two scans of the folder")
+    parser_watch.add_argument('--once', action='store_true', help="analyse what is there and stop")
+    parser_watch.add_argument('-o', '--export-directory', default=None, help="overrides export_directory of the config")
+    parser_watch.add_argument('--sheets', nargs='+', default=None, choices=config.EXCEL_SHEETS, help="overrides excel_sheets of the config, e.g. --sheets controls patients control")
+    parser_watch.add_argument('--formats', nargs='+', default=None, choices=config.OUTPUT_FORMATS, help="overrides output_formats of the config, e.g. --formats parquet")
+    parser_queue = subparsers.add_parser('queue', help="share a backlog between several PCs: add workbooks to the job queue, work them off, show the status")
+    parser_queue.add_argument('action', choices=['add', 'work', 'status'], help="add inputs, work until stopped (or --once) or print the jobs per status")
+    parser_queue.add_argument('inputs', nargs='*', help="for add: directories, glob patterns, workbooks or manifest files")
+    parser_queue.add_argument('-q', '--queue', default=None, help="overrides job_queue of the config, the same file on the share for all PCs")
+    parser_queue.add_argument('-w', '--workers', type=int, default=None, help="number of worker processes of this PC (default: number of CPUs)")
+    parser_queue.add_argument('--once', action='store_true', help="stop working once all jobs are done")
+    parser_queue.add_argument('--lease', type=float, default=120.0, help="seconds without heartbeat after which a job is taken by another worker")
+    parser_queue.add_argument('--csv', default=None, help="for status: writes all jobs as summary table")
+    parser_queue.add_argument('-o', '--export-directory', default=None, help="for add: overrides export_directory of the config")
+    parser_queue.add_argument('--sheets', nargs='+', default=None, choices=config.EXCEL_SHEETS, help="for work: overrides excel_sheets of the config")
+    parser_queue.add_argument('--formats', nargs='+', default=None, choices=config.OUTPUT_FORMATS, help="for work: overrides output_formats of the config")
+    args = parser.parse_args(argv)
+    
+    config.setup_logging(json_filename=args.log_json)
+    cfg = config.read_config(args.config)
+    if args.command in (None, 'analyse', 'batch', 'watch', 'serve', 'queue'):
+        # fails before references and raw data are read
+        problems = config.validate_config(cfg, analyse=args.command in (None, 'analyse'))
+        for problem in problems:
+            _logger.error(F"{args.config}: {problem}")
+        if len(problems):
+            return 2
+    if not args.profile:
+        return run_command(cfg, args)
+    import cProfile
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        return run_command(cfg, args)
+    finally:
+        profiler.disable()
+        profiler.dump_stats(args.profile_file)
+        _logger.info(F"cProfile trace written to {os.path.abspath(args.profile_file)}")
+
+def run_command(cfg, args):
+    if args.command == 'batch':
+        import batch
+        if args.export_directory:
+            cfg['export_directory'] = args.export_directory
+        if args.sheets:
+            cfg['excel_sheets'] = args.sheets
+        if args.formats:
+            cfg['output_formats'] = args.formats
+        summary = batch.analyse_batch(cfg, args.inputs, workers=args.workers)
+        return int((summary['status'] != 'ok').any())
+    if args.command == 'invalidate':
+        import result_cache
+        removed = result_cache.invalidate(cfg['cache_directory'], args.files if len(args.files) else None)
+        print(F"{removed} stored results removed")
+        return 0
+    if args.command == 'trend':
+        if not cfg['trend_store']:
+            _logger.error("trend_store is empty, no runs are recorded, set it in the config file")
+            return 2
+        import trends
+        if args.scores:
+            values = trends.ring_scores(cfg['trend_store'], args.ring, args.since, args.until)
+        else:
+            values = trends.trend(cfg['trend_store'], args.ring, args.amino, args.since, args.until)
+            print(trends.summary(values).to_string(float_format=lambda value: F"{value:.4g}"))
+        if args.csv:
+            values.to_csv(args.csv, index=False)
+        else:
+            print(values.to_string(index=False))
+        return 0
+    if args.command == 'watch':
+        import watch
+        if args.export_directory:
+            cfg['export_directory'] = args.export_directory
+        if args.sheets:
+            cfg['excel_sheets'] = args.sheets
+        if args.formats:
+            cfg['output_formats'] = args.formats
+        watch.watch(cfg, args.directory, workers=args.workers, interval=args.interval, once=args.once)
+        return 0
+    if args.command == 'queue':
+        import jobqueue
+        path = args.queue or cfg['job_queue']
+        if args.export_directory:
+            cfg['export_directory'] = args.export_directory
+        if args.sheets:
+            cfg['excel_sheets'] = args.sheets
+        if args.formats:
+            cfg['output_formats'] = args.formats
+        if args.action == 'add':
+            print(F"{jobqueue.add(cfg, path, args.inputs)} files queued")
+        elif args.action == 'work':
+            jobqueue.work(cfg, path, workers=args.workers, lease=args.lease, once=args.once)
+        else:
+            print(', '.join(F"{key}: {value}" for key, value in jobqueue.status(path).items()))
+            if args.csv:
+                jobqueue.summary(path).to_csv(args.csv, index=False)
+        return 0
+    if args.command == 'serve':
+        import service
+        service.serve(args.config, args.port)
+        return 0
+    import aminos
+    aminos.analyse(cfg)
+    return 0
+
+if __name__== "__main__":
+    multiprocessing.freeze_support()
+    sys.exit(main())
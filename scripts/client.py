@@ -0,0 +1,90 @@
+"""thin client of the analysis service (python aminos.py serve)
+
+Only needs the standard library, so it starts without loading pandas:
+    python client.py <Rohdaten.xlsx> [--set prefer_control=62] [--port 50507]
+"""
+import argparse
+import json
+import os
+import sys
+import urllib.error
+import urllib.request
+
+HOST = '127.0.0.1'
+DEFAULT_PORT = 50507
+
+def service_port(config_file='config.json'):
+    """service_port of the config file, without loading aminos"""
+    try:
+        with open(config_file) as json_data_file:
+            return int(json.load(json_data_file).get('service_port', DEFAULT_PORT))
+    except (OSError, ValueError):
+        return DEFAULT_PORT
+
+def request(port, path, payload=None, timeout=None):
+    """sends one request to the service and returns the decoded answer, failed jobs raise a RuntimeError"""
+    url = F"http://{HOST}:{port}{path}"
+    data = None if payload is None else json.dumps(payload).encode('utf-8')
+    req = urllib.request.Request(url, data=data, headers={'Content-Type': 'application/json'})
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as response:
+            return json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        answer = json.loads(e.read() or b'{}')
+        raise RuntimeError(answer.get('error', str(e))) from None
+
+def is_running(port, timeout=0.5):
+    try:
+        return request(port, '/status', timeout=timeout)['status'] == 'ok'
+    except (OSError, ValueError):
+        return False
+
+def submit(port, filepath, overrides=None):
+    """analyses filepath in the service, overrides replace settings of the config file"""
+    return request(port, '/analyse', {'file': os.path.abspath(filepath), 'config': overrides or {}})
+
+def resubmit(port, job, overrides):
+    """repeats a job of the service with other prefer_control/prefer_aminos"""
+    return request(port, '/reanalyse', {'job': job, 'config': overrides})
+
+def shutdown(port):
+    return request(port, '/shutdown', {})
+
+def parse_overrides(items):
+    """key=value pairs, values are read as json if possible (62, [\"Thy_ph\"]) otherwise as text"""
+    overrides = {}
+    for item in items:
+        key, _, value = item.partition('=')
+        try:
+            overrides[key] = json.loads(value)
+        except ValueError:
+            overrides[key] = value
+    return overrides
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('files', nargs='*', help="raw data workbooks")
+    parser.add_argument('--config', default='config.json', help="config file with the service_port")
+    parser.add_argument('--port', type=int, default=None)
+    parser.add_argument('--set', dest='overrides', action='append', default=[], metavar='KEY=VALUE', help="overrides a setting of the config file")
+    parser.add_argument('--stop', action='store_true', help="stops the service")
+    args = parser.parse_args(argv)
+    port = args.port if args.port is not None else service_port(args.config)
+
+    if not is_running(port):
+        print(F"no service running on port {port}, start it with: python aminos.py serve", file=sys.stderr)
+        return 2
+    failed = 0
+    for filepath in args.files:
+        try:
+            results = submit(port, filepath, parse_overrides(args.overrides))
+            print(F"{filepath}: control {results['selected_control']['best_control_name']}, {results['export_excel_path']} ({results['seconds']:.2f} s)")
+        except RuntimeError as e:
+            print(F"{filepath}: failed, {e}", file=sys.stderr)
+            failed += 1
+    if args.stop:
+        shutdown(port)
+    return int(failed > 0)
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,208 @@
+import atexit
+import datetime
+import importlib.util
+import json
+import logging
+import logging.handlers
+import os
+import queue
+
+_logger = logging.getLogger("config")
+
+# stages of an analysis in their order, reported to the progress callback of aminos.analyse
+STAGES = ['read', 'filter', 'check', 'select', 'filter patients', 'export']
+# keys of the sheets of the excel export, see excel.SHEET_TITLES
+EXCEL_SHEETS = ('raw', 'controls', 'patients', 'control')
+# xlsx is the excel sheet, the others write the result tables, see exporters.EXPORTERS
+OUTPUT_FORMATS = ('xlsx', 'csv', 'json', 'parquet')
+LOG_FORMAT = "%(asctime)s - %(name)s (%(lineno)s) - %(levelname)s: %(message)s"
+# settings whose type may differ from the default, the GUI sets prefer_control to the ring name
+UNTYPED_SETTINGS = ('prefer_control',)
+
+# fields added to every record of this process, e.g. the file a batch worker analyses (see JsonFormatter)
+log_context = {}
+# the thread writing the records of setup_logging and the process which started it
+_listener = None
+_listener_pid = None
+# attributes of every record, the others come from extra= or log_context
+_RECORD_FIELDS = set(vars(logging.makeLogRecord({}))) | {'message', 'asctime'}
+
+class ContextFilter(logging.Filter):
+    def filter(self, record):
+        record.__dict__.update(log_context)
+        return True
+
+class JsonFormatter(logging.Formatter):
+    """one json object per record: time, level, logger, message, process, line and the extra fields"""
+    def format(self, record):
+        entry = {'time': datetime.datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+                 'level': record.levelname, 'logger': record.name, 'message': record.getMessage(),
+                 'process': record.process, 'line': record.lineno}
+        entry.update((key, value) for key, value in vars(record).items() if key not in _RECORD_FIELDS)
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+def setup_logging(filename="logger.log", json_filename=None, log_queue=None, stream=None):
+    """sends all records through a queue to a listener thread, called by the entry points instead of on import
+
+    A logging call only puts the record into the queue, the listener formats and writes it:
+    filename gets all loggers, the console (stream, default stderr) main, json_filename one
+    json object per line. Worker processes pass the queue of forward_logging instead, their
+    records are written by the listener of the parent process. Arguments in loops are passed
+    lazily (_logger.debug("... %s", value)), disabled levels do not format them at all.
+    """
+    global _listener, _listener_pid
+    root = logging.getLogger()
+    if log_queue is None and _listener is not None and _listener_pid == os.getpid():
+        return
+    # forked workers inherit the handlers, but not the listener thread
+    for handler in [handler for handler in root.handlers if isinstance(handler, logging.handlers.QueueHandler)]:
+        root.removeHandler(handler)
+    root.setLevel(logging.INFO)
+    queue_handler = logging.handlers.QueueHandler(log_queue if log_queue is not None else queue.Queue())
+    queue_handler.addFilter(ContextFilter())
+    root.addHandler(queue_handler)
+    if log_queue is not None:
+        return
+    file_handler = logging.FileHandler(filename)
+    file_handler.setFormatter(logging.Formatter(LOG_FORMAT, datefmt='%Y.%m.%d %H:%M:%S'))
+    console_handler = logging.StreamHandler(stream)
+    console_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    console_handler.addFilter(logging.Filter("main"))
+    handlers = [file_handler, console_handler]
+    if json_filename:
+        json_handler = logging.FileHandler(json_filename)
+        json_handler.setFormatter(JsonFormatter())
+        handlers.append(json_handler)
+    if _listener is None:
+        atexit.register(stop_logging)
+    _listener = logging.handlers.QueueListener(queue_handler.queue, *handlers, respect_handler_level=True)
+    _listener_pid = os.getpid()
+    _listener.start()
+
+def stop_logging():
+    """writes the queued records and closes the files of setup_logging"""
+    global _listener
+    if _listener is None or _listener_pid != os.getpid():
+        return
+    _listener.stop()
+    for handler in _listener.handlers:
+        handler.close()
+    root = logging.getLogger()
+    for handler in [handler for handler in root.handlers if isinstance(handler, logging.handlers.QueueHandler)]:
+        root.removeHandler(handler)
+    _listener = None
+
+def forward_logging():
+    """a queue for the setup_logging of worker processes and the listener writing their records here
+
+    Returns (None, None) without setup_logging, the workers write their own log then.
+    """
+    if _listener is None or _listener_pid != os.getpid():
+        return None, None
+    import multiprocessing
+    log_queue = multiprocessing.Queue()
+    listener = logging.handlers.QueueListener(log_queue, *_listener.handlers, respect_handler_level=True)
+    listener.start()
+    return log_queue, listener
+
+def default_config():
+    data = {}
+    data['file_to_analyze'] = '../rohdaten_example.xlsx'
+    data['export_directory'] = '../analysed/'
+    data['file_extension_raw_data'] = '_Rohdaten.xlsx'
+    data['file_extension_analysis'] = '_Analyse.xlsx'
+    data['ignore_samples'] = ['SIGMA200', 'SIGMA500', 'Phe200', 'Phe1000']
+    data['control_name_prefix'] = 'Ko'
+    data['control_ring_samples'] = [61, 62, 31, 32]
+    data['control_reference_file_path'] = './reference/kontrollwerte.csv'
+    data['patients_reference_file_path'] = './reference/patienten_kontrollwerte.csv'
+    data['cache_directory'] = '../cache/' # parsed raw data, empty string disables the cache
+    data['excel_constant_memory'] = False # stream rows to disk, for very large runs
+    data['background_io'] = True # read the raw file once, copy it and move the excel sheet into export_directory in background threads
+    data['excel_sheets'] = list(EXCEL_SHEETS) # sheets of the export, e.g. without 'raw' when the raw file copy is enough
+    data['output_formats'] = ['xlsx'] # files of an analysis, csv/json/parquet write the result tables for other systems
+    data['streaming_ingest'] = False # read the raw data row by row without a frame of the whole file, for very large runs
+    data['service_port'] = 50507 # localhost port of the analysis service (aminos.py serve)
+    data['run_report'] = False # stage timings as json next to the excel sheet
+    data['profile_memory'] = False # peak memory per stage in the run report, slows the analysis down
+    data['trend_store'] = '' # sqlite file with the control values of every run for trends (aminos.py trend), e.g. '../trends.sqlite', empty string disables it
+    data['stage_memo'] = True # keep the result of every stage in memory, a changed setting only recomputes the stages depending on it
+    data['stage_memo_disk'] = False # also keep them in cache_directory/stages for later runs, limited by result_cache_size_mb
+    data['job_queue'] = '../jobs.sqlite' # queue of aminos.py queue, a file on a share when several PCs work off one backlog
+    data['result_cache'] = True # reuse the result of identical raw data, settings and reference files (needs cache_directory)
+    data['result_cache_size_mb'] = 500 # the least recently used results are removed above this size
+    data['result_cache_export'] = 'copy' # 'copy' or 'link' (hard link) the stored excel sheet on a hit
+    data['format_heading'] = {'bold': True} #, 'bg_color': '#f1f2f6'
+    data['format_number_invalid'] = {'bg_color': '#d1d8e0', 'font_color': '#636e72'}
+    data['format_number_valid'] = {'bg_color': '#2bcbba'} ##26de81
+    data['format_number_high'] = {'bg_color': '#fc5c65'}
+    data['format_number_low'] = {'bg_color': '#45aaf2'} 
+    data['prefer_control'] = 0
+    data['prefer_aminos'] = []
+    #warning-color: #fd9644, background: #4b6584
+    columns = {}
+    columns['sample_name'] = 'Sample Name'
+    data['columns'] = columns
+    return data
+
+def read_config(config_file = 'config.json', create_new_file=False):
+    _logger.info("read config file")
+    data = default_config()
+    if create_new_file == False and os.path.isfile(config_file):
+        with open(config_file) as json_data_file:
+            loaded = json.load(json_data_file)
+        # settings added in newer versions keep their defaults in older config files
+        missing = [key for key in data if key not in loaded]
+        if len(missing):
+            _logger.info("config file misses " + ', '.join(missing) + ", using defaults")
+        data.update(loaded)
+    else:
+        _logger.warning("config file does not exist. A default config file has been created.")
+        with open(config_file, 'w') as fp:
+            json.dump(data, fp, indent=4, sort_keys=True)
+            
+    return data
+
+def validate_config(cfg, analyse=True):
+    """problems of cfg which would only show up late in an analysis, empty if there are none
+
+    Needs no pandas, the entry points call it before the analysis modules are loaded.
+    analyse also checks the raw data file, batch and watch get their files elsewhere.
+    """
+    problems = []
+    for key, default in default_config().items():
+        if key not in cfg or key in UNTYPED_SETTINGS:
+            continue
+        value = cfg[key]
+        if isinstance(default, bool):
+            valid = isinstance(value, bool)
+        elif isinstance(default, (int, float)):
+            valid = isinstance(value, (int, float)) and not isinstance(value, bool)
+        else:
+            valid = isinstance(value, type(default))
+        if not valid:
+            problems.append(F"{key} should be of type {type(default).__name__}, not {value!r}")
+    if len(problems):
+        return problems # the checks below rely on the types
+    for key in ('control_reference_file_path', 'patients_reference_file_path'):
+        if not os.path.isfile(cfg[key]):
+            problems.append(F"{key}: file is missing: {os.path.abspath(cfg[key])}")
+    if analyse and not os.path.isfile(cfg['file_to_analyze']):
+        problems.append(F"file_to_analyze: file is missing: {os.path.abspath(cfg['file_to_analyze'])}")
+    if not len(cfg['control_ring_samples']):
+        problems.append("control_ring_samples is empty")
+    if 'sample_name' not in cfg['columns']:
+        problems.append("columns misses sample_name")
+    unknown = [sheet for sheet in cfg['excel_sheets'] if sheet not in EXCEL_SHEETS]
+    if len(unknown):
+        problems.append(F"excel_sheets: unknown sheets {', '.join(map(str, unknown))}, known are {', '.join(EXCEL_SHEETS)}")
+    unknown = [fmt for fmt in cfg['output_formats'] if fmt not in OUTPUT_FORMATS]
+    if len(unknown):
+        problems.append(F"output_formats: unknown formats {', '.join(map(str, unknown))}, known are {', '.join(OUTPUT_FORMATS)}")
+    if 'parquet' in cfg['output_formats'] and not any(importlib.util.find_spec(engine) for engine in ('pyarrow', 'fastparquet')):
+        problems.append("output_formats: parquet needs the package pyarrow or fastparquet")
+    if cfg['result_cache_export'] not in ('copy', 'link'):
+        problems.append(F"result_cache_export should be copy or link, not {cfg['result_cache_export']!r}")
+    return problems
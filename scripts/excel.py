@@ -1,199 +1,278 @@
-import xlsxwriter
-import pandas as pd
+import numpy as np
 import logging
+from concurrent.futures import ThreadPoolExecutor
+import ingest
+import profiling
 _logger = logging.getLogger("excel")
 
+# sheets of the export in workbook order, cfg['excel_sheets'] selects them by key
+SHEET_TITLES = {'raw': 'Rohdaten', 'controls': 'Kontrollen', 'patients': 'Patienten', 'control': 'Gewählte Kontrolle'}
+
 def export(cfg, filename, data):    
-    workbook = xlsxwriter.Workbook(filename)
+    """writes the selected sheets, their plans are built in parallel threads before the workbook is written
+
+    A plan holds everything of a sheet as plain arrays (see grid_runs), writing it is a single
+    loop over write_row calls. The workbook itself can only be written by one thread.
+    """
+    import xlsxwriter # loaded on the first export, the GUI and service start without it
+    sheets = [key for key in SHEET_TITLES if key in cfg['excel_sheets']]
+    with profiling.stage('plan_sheets', sheets=len(sheets)):
+        plans = plan_sheets(cfg, data, sheets)
     
-    _logger.info("write raw data to excel")
-    write_raw_data(workbook, data, cfg)
-        
-    _logger.info("write controls data to excel")
-    write_controls_data(workbook, data, cfg)
-   
-    _logger.info("write patients data")
-    write_patients_data(workbook, data, cfg)
+    # constant_memory streams every row to disk once the next row is started, all writers go row by row
+    workbook = xlsxwriter.Workbook(filename, {'constant_memory': cfg['excel_constant_memory']})
+    formats = build_formats(workbook, cfg)
+    for key, plan in zip(sheets, plans):
+        _logger.info(F"write {plan['title']} to excel")
+        with profiling.stage(F"write_{key}", runs=sum(len(runs['rows']) for runs in plan['blocks'])):
+            write_plan(workbook, plan, formats)
     
-    _logger.info("write control data")
-    write_control_data(workbook, data, cfg)
+    with profiling.stage('workbook.close'):
+        workbook.close()
+
+def plan_sheets(cfg, data, sheets):
+    """the plans of the given sheets, built in a thread each (numpy and pandas release the GIL for much of it)"""
+    planners = [PLANNERS[key] for key in sheets]
+    if len(planners) < 2:
+        return [planner(cfg, data) for planner in planners]
+    with ThreadPoolExecutor(max_workers=len(planners)) as executor:
+        futures = [executor.submit(planner, cfg, data) for planner in planners]
+        return [future.result() for future in futures]
+
+def build_formats(workbook, cfg):
+    """creates every format of the export once per workbook, in the order of STYLE_NAMES"""
+    formats = {}
+    formats['heading'] = workbook.add_format(cfg['format_heading'])
+    formats['heading_right'] = workbook.add_format(cfg['format_heading'])
+    formats['heading_right'].set_align("right")
+    formats['heading_rotated'] = workbook.add_format(cfg['format_heading'])
+    formats['heading_rotated'].set_rotation(90)
+    formats['invalid'] = workbook.add_format(cfg['format_number_invalid'])
+    formats['low'] = workbook.add_format(cfg['format_number_low'])
+    formats['high'] = workbook.add_format(cfg['format_number_high'])
+    formats['blank'] = workbook.add_format()
+    return [formats[name] if name else None for name in STYLE_NAMES]
+
+# cell styles of a plan, STYLE_SKIP cells are not written
+STYLE_SKIP = -1
+STYLE_NAMES = [None, 'heading', 'heading_right', 'invalid', 'low', 'high', 'blank', 'heading_rotated']
+STYLE_NONE, STYLE_HEADING, STYLE_HEADING_RIGHT, STYLE_INVALID, STYLE_LOW, STYLE_HIGH, STYLE_BLANK, STYLE_HEADING_ROTATED = range(len(STYLE_NAMES))
+
+def new_plan(key):
+    """title, worksheet calls (method name and arguments) and blocks of cell runs of a sheet"""
+    return {'title': SHEET_TITLES[key], 'setup': [], 'blocks': [], 'raw_data_file': None}
+
+def write_plan(workbook, plan, formats):
+    ws = workbook.add_worksheet(plan['title'])
+    for method, *args in plan['setup']:
+        getattr(ws, method)(*args)
+    if plan['raw_data_file'] is not None:
+        write_raw_rows(ws, ingest.iter_rows(plan['raw_data_file']), formats[STYLE_HEADING])
+    for runs in plan['blocks']:
+        write_runs(ws, runs, formats)
+    return ws
+
+def grid_runs(idx_row, idx_col, values, styles):
+    """the cells of a 2D value grid as runs: neighbouring cells of a row with the same style
     
-    workbook.close()
-
-def write_raw_data(workbook, data, cfg):
-    ws_raw_data = workbook.add_worksheet('Rohdaten')
-    ws_raw_data.set_landscape()
-    fmt_heading = workbook.add_format(cfg['format_heading'])
-    write_maxtrix(0, 0, data['raw_data'], ws_raw_data, format_header=fmt_heading)
-
-def write_controls_data(workbook, data, cfg):
-    ws_controls = workbook.add_worksheet('Kontrollen')    
-    ws_controls.set_landscape()
-    fmt_heading = workbook.add_format(cfg['format_heading'])
+    styles holds the index of each cell format in STYLE_NAMES, cells with a negative style are
+    skipped. Returns row, first column and style of every run in row order, plus the slice
+    (starts, ends) of its cells in the flat values list.
+    """
+    rows, cols = np.nonzero(styles >= 0)
+    cell_styles = styles[rows, cols]
+    # a run ends where the row changes, a column is skipped or the style changes
+    new_run = np.ones(len(rows), dtype=bool)
+    new_run[1:] = (np.diff(rows) != 0) | (np.diff(cols) != 1) | (np.diff(cell_styles) != 0)
+    starts = np.flatnonzero(new_run)
+    return {'rows': (rows[starts] + idx_row).tolist(), 'cols': (cols[starts] + idx_col).tolist(),
+            'styles': cell_styles[starts].tolist(), 'starts': starts.tolist(),
+            'ends': starts[1:].tolist() + [len(rows)], 'values': values[rows, cols].tolist()}
+
+def write_runs(ws, runs, formats):
+    # ascending rows, usable with the constant_memory mode of xlsxwriter
+    values = runs['values']
+    for row, col, style, start, end in zip(runs['rows'], runs['cols'], runs['styles'], runs['starts'], runs['ends']):
+        ws.write_row(row, col, values[start:end], formats[style])
+
+def cell_runs(idx_row, idx_col, value, style):
+    return grid_runs(idx_row, idx_col, np.array([[value]], dtype=object), np.array([[style]], dtype=np.int8))
+
+def matrix_runs(idx_row, idx_col, data, style_header):
+    """a frame without its first column below a header row, returns the runs and the row after it"""
+    values = np.empty((len(data) + 1, max(data.shape[1] - 1, 0)), dtype=object)
+    values[0] = data.columns.values[1:]
+    values[1:] = data.astype(object).fillna('NaN').to_numpy()[:, 1:] # categorical columns take no new values
+    styles = np.full(values.shape, STYLE_NONE, dtype=np.int8)
+    styles[0] = style_header
+    return grid_runs(idx_row, idx_col, values, styles), idx_row + len(values)
+
+def plan_raw_data(cfg, data):
+    plan = new_plan('raw')
+    plan['setup'].append(('set_landscape',))
+    if data['raw_data'] is None:
+        # streaming_ingest keeps no frame of the raw data, the rows are copied from the file while writing
+        plan['raw_data_file'] = data['raw_data_file']
+        return plan
+    runs, _ = matrix_runs(0, 0, data['raw_data'], STYLE_HEADING)
+    plan['blocks'].append(runs)
+    return plan
+
+def write_raw_rows(ws, rows, format_header):
+    """writes the rows of a raw data file like matrix_runs writes the frame read from it"""
+    header = ingest.header_names(next(rows))
+    ws.write_row(0, 0, header[1:], format_header)
+    idx_row = 1
+    for row in rows:
+        row = tuple(row) + (None,) * (len(header) - len(row))
+        values = [ingest.cell_value(value) for value in row[1:len(header)]]
+        ws.write_row(idx_row, 0, ['NaN' if value is None else value for value in values])
+        idx_row += 1
+    profiling.annotate(rows=idx_row, columns=len(header))
+
+def plan_controls_data(cfg, data):
+    plan = new_plan('controls')
+    plan['setup'].append(('set_landscape',))
+    blocks = plan['blocks']
      
     splitted_controls = data['selected_control']['data']
     first = F"1. Wahl: Kontrolle: {str(data['selected_control']['best_control_name'])} Score: {str(data['selected_control']['best_control_score'])}"
     second = F"2. Wahl: Kontrolle: {str(data['selected_control']['second_best_control_name'])} Score: {str(data['selected_control']['second_best_control_score'])}"
-    ws_controls.write(0, 0, first, fmt_heading)
-    ws_controls.write(1, 0, second, fmt_heading)
+    blocks.append(cell_runs(0, 0, first, STYLE_HEADING))
+    blocks.append(cell_runs(1, 0, second, STYLE_HEADING))
     
     last_idx = 1
     for key in splitted_controls:
-        ws_controls.write(last_idx+2, 0, "Rohdaten für Kontrolle: " + str(key), fmt_heading)
-        last_idx = write_maxtrix(last_idx+3, 0, splitted_controls[str(key)]['data'], ws_controls, format_header=fmt_heading)
+        blocks.append(cell_runs(last_idx+2, 0, "Rohdaten für Kontrolle: " + str(key), STYLE_HEADING))
+        runs, last_idx = matrix_runs(last_idx+3, 0, splitted_controls[str(key)]['data'], STYLE_HEADING)
+        blocks.append(runs)
         
-        ws_controls.write(last_idx+1, 0, "Bereichsanalyse", fmt_heading)
-        last_idx = write_maxtrix(last_idx+2, 0, splitted_controls[str(key)]['checked'], ws_controls, format_header=fmt_heading)
+        blocks.append(cell_runs(last_idx+1, 0, "Bereichsanalyse", STYLE_HEADING))
+        runs, last_idx = matrix_runs(last_idx+2, 0, splitted_controls[str(key)]['checked'], STYLE_HEADING)
+        blocks.append(runs)
         
-        ws_controls.write(last_idx+1, 0, "Wie viele sind im Normbereich?", fmt_heading)
-        last_idx = write_maxtrix(last_idx+2, 0, splitted_controls[str(key)]['score'], ws_controls, format_header=fmt_heading)
+        blocks.append(cell_runs(last_idx+1, 0, "Wie viele sind im Normbereich?", STYLE_HEADING))
+        runs, last_idx = matrix_runs(last_idx+2, 0, splitted_controls[str(key)]['score'], STYLE_HEADING)
+        blocks.append(runs)
         
-        ws_controls.write(last_idx+1, 0, "Priorisierung der AS", fmt_heading)
-        prios = splitted_controls[str(key)]['prios']
+        blocks.append(cell_runs(last_idx+1, 0, "Priorisierung der AS", STYLE_HEADING))
+        prios = splitted_controls[str(key)]['prios'].copy() # keep the numbers for a re-analysis
         greater_zero = prios > 0
         prios[greater_zero] = 'okay'
         prios.replace(0, 'unpassend', inplace=True)
         prios = prios.fillna('ignoriert')
-        last_idx = write_maxtrix(last_idx+2, 0, prios, ws_controls, format_header=fmt_heading)
+        runs, last_idx = matrix_runs(last_idx+2, 0, prios, STYLE_HEADING)
+        blocks.append(runs)
+    return plan
 
-def write_patients_data(workbook, data, cfg):    
-    ws_patients = workbook.add_worksheet('Patienten')
-    ws_patients.set_landscape()
-    ws_patients.set_column("A:C", 4.5)
-    ws_patients.set_column("I:I", 4.5)
-    
+# layout of the patient pages: 4 patients, an empty column, 4 patients. The aminos are
+# grouped by 3 rows with an empty row in between, two high gap rows close every page.
+PATIENTS_PER_BLOCK = 4
+BLOCKS_PER_PAGE = 2
+AMINOS_PER_GROUP = 3
+HEADER_ROWS = 2
+GAP_ROWS = 2
+GAP_ROW_HEIGHT = 45
+COL_MIN = 0
+COL_MAX = 1
+COL_NAMES = 3
+COL_FIRST_PATIENT = 4
+
+# patient flags -1 (invalid), 0 (valid), 1 (too low), 2 (too high) to styles
+FLAG_STYLES = np.array([STYLE_INVALID, STYLE_NONE, STYLE_LOW, STYLE_HIGH])
+
+def patient_page_layout(n_aminos):
+    """rows of the aminos on a page, the page height and the columns of the patient slots"""
+    aminos = np.arange(n_aminos)
+    amino_rows = HEADER_ROWS + aminos + aminos // AMINOS_PER_GROUP
+    page_rows = HEADER_ROWS + n_aminos + max(0, (n_aminos - 1) // AMINOS_PER_GROUP) + GAP_ROWS
+    slots = np.arange(PATIENTS_PER_BLOCK * BLOCKS_PER_PAGE)
+    slot_cols = COL_FIRST_PATIENT + slots + slots // PATIENTS_PER_BLOCK # one empty column between the blocks
+    return amino_rows, page_rows, slot_cols
+
+def patient_pages(n_patients):
+    """page and slot of every patient"""
+    per_page = PATIENTS_PER_BLOCK * BLOCKS_PER_PAGE
+    idx = np.arange(n_patients)
+    return idx // per_page, idx % per_page
+
+def plan_patients_data(cfg, data):    
+    plan = new_plan('patients')
+    setup = plan['setup']
+    setup.append(('set_landscape',))
     header3 = '&L&A' + '&CMessergebnisse des Aminosäure-Screenings' + '&RLSeite &P von &N'
     footer3 = '&RDatum: &D, &T'
-    ws_patients.set_header(header3)
-    ws_patients.set_footer(footer3)
-
-    fmt_heading = workbook.add_format(cfg['format_heading'])
-    fmt_heading_right = workbook.add_format(cfg['format_heading'])
-    fmt_heading_right.set_align("right")
-    # write additional infos to the the patient sheet
-    #ws_patients.write(0,0,"Messergebnisse des Aminosäure-Screenings")
-    ws_patients.write(0,0,"Normbereich", fmt_heading)
-    ws_patients.write(1,0,"min", fmt_heading_right)
-    ws_patients.write(1,1,"max", fmt_heading_right)
-	    
-    #format the patient data
+    setup.append(('set_header', header3))
+    setup.append(('set_footer', footer3))
+    
+    # the flags of the analysis: 1 too low, 2 too high, -1 invalid AS, 0 valid
     patients = data['data_filtered']
-    pat_ref = data['patients_reference']
-    fmt = pd.DataFrame().reindex_like(patients)
+    column_index = data['column_index']
+    amino_names = patients.columns[len(column_index['meta']):]
+    amino_pos = [column_index['positions'][col] for col in amino_names]
+    val_min = column_index['patients_min'][amino_pos]
+    val_max = column_index['patients_max'][amino_pos]
+    values = patients[amino_names].to_numpy(dtype=float)
+    flags = data['patient_flags']
     
-    for col in pat_ref.columns.values:
-        val_min = pat_ref.loc[0,col]
-        val_max = pat_ref.loc[1,col]
-        col_name = patients.columns[patients.columns.str.contains(pat = col)][0]
-        fmt[col_name][patients[col_name] < val_min] = 1 # mark as too low
-        fmt[col_name][patients[col_name] > val_max] = 2 # mark as too high
-        
-    fmt[patients.columns[data['idx_invalids']]] = -1 # mark as AS invalid
-    fmt.fillna(0, inplace=True) # mark rest as zero = valid
-     
-    gap_rows = 30
-    offset_col = 4
-    idx_row = 0
-    idx_col = offset_col
-    second_part = 0
-    fmt_bold = workbook.add_format(cfg['format_heading'])
-    #page_break = []
-    # write min max and amino names 
-    amino_names = []
-    amino_min = []
-    amino_max = []
-    add_empty_row = [5, 8, 11, 14, 17, 20]
-    for idx in range(2, 22):                             
-        if idx in add_empty_row:
-            amino_names.append("")
-            amino_min.append("")
-            amino_max.append("")
-        as_name = data['data_filtered'].columns[idx]
-        amino_names.append(as_name)
-        amino_min.append(data['patients_reference'].loc[1, as_name[:3]])
-        amino_max.append(data['patients_reference'].loc[0, as_name[:3]])
-        
-    ws_patients.write_column(idx_row+2, idx_col-1, amino_names, fmt_heading_right)
-    ws_patients.write_column(idx_row+2, idx_col+9, amino_names, fmt_bold)
-    ws_patients.write_column(idx_row+2, idx_col-3, amino_min)
-    ws_patients.write_column(idx_row+2, idx_col-4, amino_max)
+    amino_rows, page_rows, slot_cols = patient_page_layout(len(amino_names))
+    n_cols = slot_cols[-1] + 2
+    setup.append(('set_column', COL_MIN, COL_NAMES - 1, 4.5))
+    setup.append(('set_column', slot_cols[PATIENTS_PER_BLOCK] - 1, slot_cols[PATIENTS_PER_BLOCK] - 1, 4.5))
     
-    for (idx, row) in data['data_filtered'].iterrows():
-        # write patient id
-        help_write(cfg, workbook, ws_patients, idx_row, idx_col+second_part, row.iloc[1], 3)    
-        # write aminos for one patient
-        empty_row = 0
-        for idx_as in range(2, 22):                             
-            if idx_as in add_empty_row:
-                empty_row += 1
-			val = F"{row.iloc[idx_as]:.1f}"
-            help_write(cfg, workbook, ws_patients, idx_row+idx_as+empty_row, idx_col+second_part, val, fmt.loc[idx][idx_as])
-            
-        # go to the next patient slot
-        idx_col += 1
-        # first four patients are printed, an empty columns follows
-        if idx_col%(4+offset_col) == 0: 
-            second_part = 1
-        # after 8 patients a new page shall start
-        elif idx_col%(8+offset_col) == 0:
-            idx_col = offset_col # start idx
-            #page_break.append(idx_row)
-            idx_row += gap_rows
-            second_part = 0
-            # write min max and amino names 
-            ws_patients.write(idx_row,0,"Normbereich", fmt_heading)
-            ws_patients.write(idx_row+1,0,"min", fmt_heading_right)
-            ws_patients.write(idx_row+1,1,"max", fmt_heading_right)
-            ws_patients.write_column(idx_row+2, idx_col-1, amino_names, fmt_heading_right )
-            ws_patients.write_column(idx_row+2, idx_col+9, amino_names, fmt_bold )
-            ws_patients.write_column(idx_row+2, idx_col-3, amino_min)
-            ws_patients.write_column(idx_row+2, idx_col-4, amino_max)
+    # the grid every page starts with: headings, amino names and reference limits
+    page_values = np.full((page_rows, n_cols), None, dtype=object)
+    page_styles = np.full((page_rows, n_cols), STYLE_SKIP, dtype=np.int8)
+    page_values[0, COL_MIN] = "Normbereich"
+    page_values[1, COL_MIN] = "min"
+    page_values[1, COL_MAX] = "max"
+    page_styles[0, COL_MIN] = STYLE_HEADING
+    page_styles[1, [COL_MIN, COL_MAX]] = STYLE_HEADING_RIGHT
+    # the name columns are formatted including the empty rows between the groups
+    name_rows = slice(HEADER_ROWS, amino_rows[-1] + 1)
+    page_values[name_rows, [COL_NAMES, n_cols - 1]] = ""
+    page_styles[name_rows, COL_NAMES] = STYLE_HEADING_RIGHT
+    page_styles[name_rows, n_cols - 1] = STYLE_HEADING
+    page_values[amino_rows, COL_NAMES] = amino_names
+    page_values[amino_rows, n_cols - 1] = amino_names
+    # aminos without patient reference get empty cells
+    page_values[amino_rows, COL_MIN] = np.where(np.isnan(val_min), None, val_min)
+    page_values[amino_rows, COL_MAX] = np.where(np.isnan(val_max), None, val_max)
+    page_styles[amino_rows, COL_MIN] = STYLE_NONE
+    page_styles[amino_rows, COL_MAX] = STYLE_NONE
+    # constant_memory only keeps the height of rows with a cell
+    page_styles[page_rows - GAP_ROWS:, COL_MIN] = STYLE_BLANK
     
-    #ws_patients.h_pagebreaks = [20, 40, 80] #page_break
-    #ws_patients.set_row(7, 30) 
-    #ws_patients.set_row(12, 30) 
-    #ws_patients.set_row(17, 30) 
-    #ws_patients.set_row(22, 30) 
+    # all pages in one grid, every patient goes to its slot: id, values formatted with one decimal
+    # and the style of their flag
+    pages, slots = patient_pages(len(patients))
+    n_pages = int(pages[-1]) + 1 if len(pages) else 1
+    grid_values = np.tile(page_values, (n_pages, 1))
+    grid_styles = np.tile(page_styles, (n_pages, 1))
+    id_rows = pages * page_rows
+    cols = slot_cols[slots]
+    grid_values[id_rows, cols] = patients[cfg['columns']['sample_name']].to_numpy()
+    grid_styles[id_rows, cols] = STYLE_HEADING
+    value_rows = id_rows[:, np.newaxis] + amino_rows
+    # np.char.mod flattens an empty array, a plate with controls only has no patient rows
+    grid_values[value_rows, cols[:, np.newaxis]] = np.char.mod('%.1f', values).astype(object).reshape(values.shape)
+    grid_styles[value_rows, cols[:, np.newaxis]] = FLAG_STYLES[flags + 1]
     
-    ws_patients.set_row(28, 45) 
-    ws_patients.set_row(29, 45) 
-    ws_patients.set_row(58, 45) 
-    ws_patients.set_row(59, 45) 
-    ws_patients.set_row(88, 45) 
-    ws_patients.set_row(89, 45) 
+    for page in range(n_pages):
+        for gap_row in range(page_rows - GAP_ROWS, page_rows):
+            setup.append(('set_row', page * page_rows + gap_row, GAP_ROW_HEIGHT))
+    setup.append(('set_h_pagebreaks', [page * page_rows for page in range(1, n_pages)]))
+    plan['blocks'].append(grid_runs(0, 0, grid_values, grid_styles))
+    return plan
     
-def write_control_data(wb, data, cfg):    
-    ws = wb.add_worksheet('Gewählte Kontrolle')
-    ws.set_landscape()
+def plan_control_data(cfg, data):    
+    plan = new_plan('control')
     header3 = '&L&A' + '&CMessergebnisse des Aminosäure-Screenings' + '&RSeite &P von &N'
     footer3 = '&RDatum: &D, &T'
-    ws.set_header(header3)
-    ws.set_footer(footer3)
-    ws.set_column("A:A", 13)
-    ws.set_column("B:Z", 4.5)
-    fmt_heading = wb.add_format(cfg['format_heading'])
-    fmt_heading.set_rotation(90)
-    write_maxtrix(0, 0, data['control_filtered'], ws, format_header=fmt_heading)
-         
-def help_write(cfg, wb, ws, idx_r, idx_c, val, fmt_nr):
-    if fmt_nr == -1:
-        fmt = wb.add_format(cfg['format_number_invalid'])
-    elif fmt_nr == 1:
-        fmt = wb.add_format(cfg['format_number_low'])
-    elif fmt_nr == 2:
-        fmt = wb.add_format(cfg['format_number_high'])
-    elif fmt_nr == 3:
-        fmt = wb.add_format(cfg['format_heading'])
-    else:
-        fmt = {}
-    ws.write(idx_r, idx_c, val, fmt)
-    
-def write_maxtrix(idx_row, idx_col, data, worksheet, format_header):
-    worksheet.write_row(idx_row, idx_col, data.columns.values.tolist()[1:], format_header)
-    idx_row += 1
-    data = data.fillna('NaN')
-    for index, row in data.iterrows():
-        worksheet.write_row(idx_row, idx_col, row.to_numpy()[1:])
-        idx_row += 1    
-    
-    return idx_row
\ No newline at end of file
+    plan['setup'] += [('set_landscape',), ('set_header', header3), ('set_footer', footer3),
+                      ('set_column', "A:A", 13), ('set_column', "B:Z", 4.5)]
+    runs, _ = matrix_runs(0, 0, data['control_filtered'], STYLE_HEADING_ROTATED)
+    plan['blocks'].append(runs)
+    return plan
+
+PLANNERS = {'raw': plan_raw_data, 'controls': plan_controls_data, 'patients': plan_patients_data, 'control': plan_control_data}
@@ -0,0 +1,40 @@
+"""writers of the result tables (aminos.result_tables) for systems which should not parse the excel sheet
+
+Every writer gets the tables and the base path of the analysis (<timestamp>_Analyse) and returns
+the written files. Each table is written with one call of pandas, csv and parquet give a file per
+table (<base>_patients.csv, ...), json one file with a list of records per table.
+"""
+import json
+import logging
+
+_logger = logging.getLogger("exporters")
+
+def write_csv(tables, base_path):
+    paths = []
+    for name, table in tables.items():
+        path = F"{base_path}_{name}.csv"
+        table.to_csv(path, index=False)
+        paths.append(path)
+    return paths
+
+def write_parquet(tables, base_path):
+    """needs pyarrow or fastparquet, config.validate_config checks for them"""
+    paths = []
+    for name, table in tables.items():
+        path = F"{base_path}_{name}.parquet"
+        table.to_parquet(path, index=False)
+        paths.append(path)
+    return paths
+
+def write_json(tables, base_path):
+    """{"patients": [{"sample": ..., "value": ...}, ...], "control": [...], ...}"""
+    path = base_path + '.json'
+    # to_json serialises the tables, the object around them is put together as text
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('{')
+        f.write(', '.join(F"{json.dumps(name)}: {table.to_json(orient='records')}" for name, table in tables.items()))
+        f.write('}')
+    return [path]
+
+# output_formats of the config besides xlsx (excel.export)
+EXPORTERS = {'csv': write_csv, 'json': write_json, 'parquet': write_parquet}
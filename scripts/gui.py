@@ -1,18 +1,29 @@
 import sys
 from PyQt5 import QtWidgets, QtCore
 import os
-#import pickle needed for loading data from binary file
-import pandas as pd
-import aminos
+import client
+import config
 import logging
 
 _logger = logging.getLogger("gui")
 
+STAGE_LABELS = {'read': "Rohdaten lesen", 'filter': "Daten filtern", 'check': "Kontrollen prüfen",
+                'select': "Kontrolle auswählen", 'filter patients': "Patienten filtern", 'export': "Excel exportieren"}
+
+class AnalysisCancelled(Exception):
+    pass
+
+class ImportThread(QtCore.QThread):
+    """loads aminos (pandas, numpy) while the window is already shown, a job started earlier waits for it"""
+    def run(self):
+        import aminos
+        _logger.info("analysis modules loaded")
+
 class Button(QtWidgets.QPushButton):
     def __init__(self, title, parent):
         super().__init__(title, parent)
         self.setAcceptDrops(True)
-        self.raw_data_file_path = "rohdaten_example.xlsx"
+        self.raw_data_file_paths = ["rohdaten_example.xlsx"]
         
     def dragEnterEvent(self, e):
         m = e.mimeData()
@@ -24,20 +35,85 @@ class Button(QtWidgets.QPushButton):
     def dropEvent(self, e):
         m = e.mimeData()
         if m.hasUrls():
-            filepath = m.urls()[0].toLocalFile()
-            print(F"filepath: {filepath}")
-            if (os.path.splitext(filepath)[-1].lower() != ".xlsx"):
+            filepaths = [url.toLocalFile() for url in m.urls()]
+            _logger.debug("filepaths: %s", filepaths)
+            filepaths = [filepath for filepath in filepaths if os.path.splitext(filepath)[-1].lower() == ".xlsx"]
+            if not len(filepaths):
                 self.setText("Netter Versuch..\n\nBitte Rohdaten im Format *.xlsx wählen!")
+            elif len(filepaths) == 1:
+                self.setText("Bitte Analyse starten\n\n.." + filepaths[0][-40:])
             else:
-                self.setText("Bitte Analyse starten\n\n.." + filepath[-40:])
-                self.raw_data_file_path = filepath
+                self.setText(F"Bitte Analyse starten\n\n{len(filepaths)} Dateien")
+            self.raw_data_file_paths = filepaths
                 
-    def get_path(self):
-        return self.raw_data_file_path
+    def get_paths(self):
+        return self.raw_data_file_paths
+
+class AnalysisThread(QtCore.QThread):
+    """runs one job off the event thread, ('analyse', filepath) or ('reanalyse', (results, control, aminos))"""
+    stage = QtCore.pyqtSignal(str, int, int)
+    finished_job = QtCore.pyqtSignal(object, object)
+    failed = QtCore.pyqtSignal(object, str)
+    cancelled = QtCore.pyqtSignal(object)
+
+    def __init__(self, job, parent = None):
+        super().__init__(parent)
+        self.job = job
+        self.cancel_requested = False
+
+    def cancel(self):
+        self.cancel_requested = True
+
+    def report(self, stage):
+        # called by aminos between the stages, the only place where a job can be stopped
+        if self.cancel_requested:
+            raise AnalysisCancelled()
+        self.stage.emit(STAGE_LABELS[stage], config.STAGES.index(stage), len(config.STAGES))
+
+    def run(self):
+        try:
+            results = self.run_job()
+        except AnalysisCancelled:
+            self.cancelled.emit(self.job)
+            return
+        except Exception as e:
+            _logger.exception(F"job {self.job[0]} failed")
+            self.failed.emit(self.job, str(e))
+            return
+        if self.cancel_requested:
+            self.cancelled.emit(self.job)
+        else:
+            self.finished_job.emit(self.job, results)
+
+    def run_job(self):
+        cfg = config.read_config()
+        kind, payload = self.job
+        # a running service (aminos.py serve) saves the start of pandas and the reference tables,
+        # it does not report stages and finishes a job before a cancel takes effect
+        if kind == 'analyse':
+            cfg["file_to_analyze"] = payload
+            problems = config.validate_config(cfg)
+            if len(problems):
+                raise ValueError("Fehler in config.json:\n" + "\n".join(problems))
+            if client.is_running(cfg['service_port']):
+                self.report('read')
+                return client.submit(cfg['service_port'], payload)
+            import aminos
+            return aminos.analyse(cfg, progress=self.report)
+        results, cfg['prefer_control'], cfg['prefer_aminos'] = payload
+        if 'job' in results:
+            self.report('select')
+            return client.resubmit(cfg['service_port'], results['job'], {'prefer_control': cfg['prefer_control'], 'prefer_aminos': cfg['prefer_aminos']})
+        import aminos
+        return aminos.reanalyse(cfg, results, progress=self.report)
   
 class MainGui(QtWidgets.QDialog):
     def __init__(self):
         super().__init__()
+        self.queue = []
+        self.worker = None
+        self.held = False # the queue waits while the DateDialog of a finished file is open
+        self.importer = None
         self.initUI()
         
     def initUI(self):
@@ -46,48 +122,123 @@ class MainGui(QtWidgets.QDialog):
         self.button.setStyleSheet("border: 2px dashed black;border-radius: 10px")
         self.button.move(10, 10)
         
+        self.progress = QtWidgets.QProgressBar(self)
+        self.progress.resize(330, 20)
+        self.progress.move(10, 195)
+        self.progress.setRange(0, len(config.STAGES))
+        self.progress.setValue(0)
+        self.progress.setFormat("bereit")
+        
         btn_run = QtWidgets.QPushButton("Analyse starten", self)
-        btn_run.resize(330, 40)
-        btn_run.move(10, 200)
+        btn_run.resize(215, 40)
+        btn_run.move(10, 220)
         btn_run.clicked.connect(self.start_analyses)
         
+        self.btn_cancel = QtWidgets.QPushButton("Abbrechen", self)
+        self.btn_cancel.resize(110, 40)
+        self.btn_cancel.move(230, 220)
+        self.btn_cancel.setEnabled(False)
+        self.btn_cancel.clicked.connect(self.cancel_analyses)
+        
         self.setWindowTitle('AMINOS v0.1')
-        self.setGeometry(400, 400, 350, 250)
-        self.setFixedSize(350, 260)
+        self.setGeometry(400, 400, 350, 270)
+        self.setFixedSize(350, 270)
+
+    def preload(self):
+        # a running service does the analyses, the GUI never needs pandas then
+        if client.is_running(config.read_config()['service_port']):
+            return
+        self.importer = ImportThread(self)
+        self.importer.start()
 
     def start_analyses(self):
-        if not os.path.isfile(self.button.get_path()):    
+        filepaths = [filepath for filepath in self.button.get_paths() if os.path.isfile(filepath)]
+        if not len(filepaths):
             self.button.setText("Bitte wähle eine Datei aus.")
-        else:
-            try:
-                #with open('data.pickle', 'rb') as handle:
-                    #results = pickle.load(handle)
-                cfg = aminos.read_config()
-                cfg["file_to_analyze"] = self.button.get_path()
-                results = aminos.analyse(cfg)
-                #open_path = results['export_excel_path']
-                #subprocess.Popen(['explorer.exe', '/select,"{open_path}"'])
-                conflicts, ret = DateDialog.ShowDialog(results)
-                _logger.info(conflicts)
-                
-                if (ret == True):
-                    _logger.info("re-run with prefered control and AS")
-                    cfg['prefer_control'] = conflicts[0]
-                    cfg['prefer_aminos'] = conflicts[1]
-                    data = aminos.analyse(cfg)
-                    msgBox = QtWidgets.QMessageBox()
-                    msgBox.setText("Analyse erfolgreich durchgeführt.\nFenster wird geschlossen.");
-                    msgBox.exec();
-                    self.close()
-                else:
-                    _logger.info("program finished")
-                    self.close()
-            except Exception as e:
-                err_message = F"Unexpected error: {e}\nPlease save raw data excel sheet and scripts/logger.log and contact the software developer."
-                _logger.error(err_message)
-                msgBox = QtWidgets.QMessageBox()
-                msgBox.setText(err_message);
-                msgBox.exec();
+            return
+        self.queue.extend(('analyse', filepath) for filepath in filepaths)
+        self.start_next()
+
+    def start_next(self):
+        if self.worker is not None or self.held or not len(self.queue):
+            self.update_status()
+            return
+        self.worker = AnalysisThread(self.queue.pop(0), self)
+        self.worker.stage.connect(self.on_stage)
+        self.worker.finished_job.connect(self.on_finished)
+        self.worker.failed.connect(self.on_failed)
+        self.worker.cancelled.connect(self.on_cancelled)
+        self.worker.finished.connect(self.on_thread_finished)
+        self.btn_cancel.setEnabled(True)
+        self.update_status()
+        self.worker.start()
+
+    def cancel_analyses(self):
+        # stops the running job after its current stage and drops the waiting ones
+        self.queue.clear()
+        if self.worker is not None:
+            self.worker.cancel()
+            self.progress.setFormat("wird abgebrochen..")
+
+    def update_status(self):
+        waiting = F" ({len(self.queue)} in der Warteschlange)" if len(self.queue) else ""
+        self.setWindowTitle(F"AMINOS v0.1{waiting}")
+
+    def on_stage(self, label, idx, total):
+        self.progress.setValue(idx)
+        self.progress.setFormat(F"{label} ({idx + 1}/{total})")
+
+    def on_thread_finished(self):
+        self.worker.deleteLater()
+        self.worker = None
+        self.btn_cancel.setEnabled(False)
+        self.start_next()
+
+    def on_cancelled(self, job):
+        _logger.info(F"job {job[0]} cancelled")
+        self.progress.setValue(0)
+        self.progress.setFormat("abgebrochen")
+
+    def on_failed(self, job, error):
+        self.progress.setValue(0)
+        self.progress.setFormat("fehlgeschlagen")
+        err_message = F"Unexpected error: {error}\nPlease save raw data excel sheet and scripts/logger.log and contact the software developer."
+        _logger.error(err_message)
+        msgBox = QtWidgets.QMessageBox()
+        msgBox.setText(err_message);
+        msgBox.exec();
+
+    def on_finished(self, job, results):
+        self.progress.setValue(len(config.STAGES))
+        self.progress.setFormat("fertig")
+        if job[0] == 'reanalyse':
+            _logger.info(F"re-run finished: {results['export_excel_path']}")
+            msgBox = QtWidgets.QMessageBox()
+            msgBox.setText(F"Analyse erfolgreich durchgeführt.\n{results['export_excel_path']}");
+            msgBox.exec();
+            return
+        #open_path = results['export_excel_path']
+        #subprocess.Popen(['explorer.exe', '/select,"{open_path}"'])
+        # the modal dialog runs its own event loop, on_thread_finished would start the next file meanwhile
+        self.held = True
+        try:
+            conflicts, ret = DateDialog.ShowDialog(results, self)
+        finally:
+            self.held = False
+        _logger.info(conflicts)
+        if (ret == True):
+            # the re-run goes before the waiting files
+            self.queue.insert(0, ('reanalyse', (results, conflicts[0], conflicts[1])))
+        self.start_next()
+
+    def closeEvent(self, e):
+        self.cancel_analyses()
+        if self.worker is not None:
+            self.worker.wait()
+        if self.importer is not None:
+            self.importer.wait()
+        _logger.info("program finished")
+        super().closeEvent(e)
 
 class DateDialog(QtWidgets.QDialog):
     def __init__(self, results, parent = None):
@@ -114,7 +265,7 @@ class DateDialog(QtWidgets.QDialog):
         l_description = QtWidgets.QLabel(description)
         l_export_dir = QtWidgets.QLabel(F"Die Ergebnisse liegen unter:\n{export_dir}\n\nDie besten Aminosäuren wurden bereits ausgetauscht. Es wurden jedoch gleichwertige Kontrollen gefunden. Falls die Analyse mit anderen Kontrollen durchlaufen werden soll, bitte auswählen:")
         l_export_dir.setWordWrap(True)
-        l_new_analyse = QtWidgets.QLabel("Wähle OK für eine erneute Analyse mit den ausgewählten Parametern oder Cancel um das Program zu beenden. Bei OK werden die neuen Ergebnisse in einem neuen Ordner mit aktuellem Zeitstempel abgelegt.")
+        l_new_analyse = QtWidgets.QLabel("Wähle OK für eine erneute Analyse mit den ausgewählten Parametern oder Cancel um das Program zu beenden. Bei OK werden die neuen Ergebnisse mit aktuellem Zeitstempel im selben Ordner abgelegt.")
         l_new_analyse.setWordWrap(True)
         #l_export_dir.setOpenExternalLinks(True)
         #l_export_excel_path = QtWidgets.QLabel("<a href=\"file:///{export_excel_path}\">Öffne Excel Analyse</a>")
@@ -144,7 +295,7 @@ class DateDialog(QtWidgets.QDialog):
             as_idx = 0
             layout =  QtWidgets.QGridLayout()
             for conflict in dat[control]['conflicts']:
-                label = QtWidgets.QLabel(F"{conflict[0][0:3]}")
+                label = QtWidgets.QLabel(results['column_index']['amino_of'][conflict[0]])
                 combobox = QtWidgets.QComboBox()
                 combobox.addItems(conflict)
                 self.aminos[control].append(combobox)
@@ -181,9 +332,12 @@ class DateDialog(QtWidgets.QDialog):
 
 
 def show_main():          
+    config.setup_logging()
     app = QtWidgets.QApplication(sys.argv)
     ex = MainGui()
     ex.show()
+    # after the first paint, the window is visible while pandas loads
+    QtCore.QTimer.singleShot(0, ex.preload)
     app.exec_()
     
 if __name__ == '__main__':  
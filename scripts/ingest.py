@@ -0,0 +1,202 @@
+import collections
+import csv
+import hashlib
+import io
+import logging
+import os
+import threading
+import numpy as np
+import pandas as pd
+
+_logger = logging.getLogger("ingest")
+
+# bump when the parsing changes, old cache entries are ignored afterwards
+CACHE_VERSION = 1
+MISSING_VALUES = ['No Peak']
+# hashes of file_hash and read_file per process, keyed by path, size and modification time, a raw
+# file is hashed once for the result cache, the stage keys and the trends
+HASHED_FILES = 256
+
+_hashes = collections.OrderedDict()
+_memo_lock = threading.Lock() # the service runs jobs in several threads
+
+def stat_key(filepath):
+    stat = os.stat(filepath)
+    return (os.path.abspath(filepath), stat.st_size, stat.st_mtime_ns)
+
+def memo_get(memo, key):
+    with _memo_lock:
+        if key not in memo:
+            return None
+        memo.move_to_end(key)
+        return memo[key]
+
+def memo_put(memo, key, value, entries):
+    with _memo_lock:
+        memo[key] = value
+        memo.move_to_end(key)
+        while len(memo) > entries:
+            memo.popitem(last=False)
+
+def clear_memo():
+    with _memo_lock:
+        _hashes.clear()
+
+def file_hash(filepath, chunk_size=1 << 20):
+    """sha256 of the content, not read again while size and modification time stay the same"""
+    key = stat_key(filepath)
+    digest = memo_get(_hashes, key)
+    if digest is not None:
+        return digest
+    sha = hashlib.sha256()
+    with open(filepath, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            sha.update(chunk)
+    digest = sha.hexdigest()
+    memo_put(_hashes, key, digest, HASHED_FILES)
+    return digest
+
+def read_file(filepath):
+    """the content of a file as bytes, its hash is kept for file_hash
+
+    The caller holds the content for one analysis (archive copy and parser), it is not kept here.
+    """
+    key = stat_key(filepath)
+    with open(filepath, 'rb') as f:
+        content = f.read()
+    memo_put(_hashes, key, hashlib.sha256(content).hexdigest(), HASHED_FILES)
+    return content
+
+def excel_engine():
+    """calamine parses xlsx several times faster than openpyxl, it needs pandas >= 2.2 and python-calamine"""
+    try:
+        import python_calamine # noqa: F401
+    except ImportError:
+        return None
+    major, minor = (int(part) for part in pd.__version__.split('.')[:2])
+    if (major, minor) < (2, 2):
+        return None
+    return 'calamine'
+
+def parse_raw_data(filepath, content=None):
+    """reads the instrument export, missing peaks become NaN so the amino columns stay float
+
+    content is the file already read into memory (see read_file), the file is not opened then.
+    """
+    return pd.read_excel(filepath if content is None else io.BytesIO(content), engine=excel_engine(), na_values=MISSING_VALUES)
+
+def header_names(row):
+    """column names like pandas reads them: empty cells become "Unnamed: <pos>", repeated names get .1, .2"""
+    names = []
+    for pos, value in enumerate(row):
+        name = F"Unnamed: {pos}" if value is None or value == '' else str(value)
+        base, count = name, 0
+        while name in names:
+            count += 1
+            name = F"{base}.{count}"
+        names.append(name)
+    return names
+
+def cell_value(value):
+    """a cell as pandas reads it: missing values and empty cells become None, integral floats int"""
+    if value is None or value == '' or value in MISSING_VALUES:
+        return None
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+def cell_number(value):
+    """a cell of an amino column as float, everything that is not a number becomes NaN"""
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+def csv_cell(text):
+    """a csv cell typed like an excel cell: empty None, numbers int or float, otherwise text"""
+    if text == '':
+        return None
+    for number in (int, float):
+        try:
+            return number(text)
+        except ValueError:
+            pass
+    return text
+
+def iter_rows(filepath):
+    """the rows of the first sheet one by one as tuples, the header first
+
+    xlsx files are read with openpyxl in read-only mode, csv files (the csv export of the
+    instrument) with the csv module. Completely empty rows are skipped.
+    """
+    if os.path.splitext(filepath)[-1].lower() == '.csv':
+        with open(filepath, newline='') as f:
+            for row in csv.reader(f):
+                if any(cell != '' for cell in row):
+                    yield tuple(csv_cell(cell) for cell in row)
+        return
+    import openpyxl
+    workbook = openpyxl.load_workbook(filepath, read_only=True, data_only=True)
+    try:
+        for row in workbook.worksheets[0].iter_rows(values_only=True):
+            if any(cell is not None for cell in row):
+                yield row
+    finally:
+        workbook.close()
+
+class RowBuffer:
+    """float rows of a fixed width collected one by one, grows by doubling like a list"""
+    __slots__ = ('values', 'size')
+
+    def __init__(self, width, capacity=256):
+        self.values = np.empty((capacity, width))
+        self.size = 0
+
+    def append(self, row):
+        if self.size == len(self.values):
+            grown = np.empty((2 * len(self.values), self.values.shape[1]))
+            grown[:self.size] = self.values
+            self.values = grown
+        self.values[self.size] = row
+        self.size += 1
+
+    def take(self, order):
+        """the collected rows in the given order"""
+        return self.values[:self.size][order]
+
+def cache_path(cache_directory, key):
+    return os.path.join(cache_directory, F"{key}_v{CACHE_VERSION}.npz")
+
+def read_cache(path):
+    with np.load(path, allow_pickle=True) as npz:
+        columns = npz['columns'].tolist()
+        return pd.DataFrame({col: npz[F"c{idx}"] for idx, col in enumerate(columns)}, columns=columns)
+
+def write_cache(path, data):
+    # one array per column, the sample names stay object arrays because they mix numbers and text
+    arrays = {F"c{idx}": data[col].to_numpy() for idx, col in enumerate(data.columns)}
+    arrays['columns'] = np.array(data.columns.tolist(), dtype=object)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = F"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        np.savez(f, **arrays)
+    os.replace(tmp_path, path) # parallel batch workers may write the same entry
+
+def load_raw_data(filepath, cache_directory=None, content=None):
+    """parses the workbook once, later calls with identical file content load the cache"""
+    if not cache_directory:
+        return parse_raw_data(filepath, content)
+    path = cache_path(cache_directory, file_hash(filepath))
+    if os.path.isfile(path):
+        try:
+            data = read_cache(path)
+            _logger.info(F"raw data loaded from cache {path}")
+            return data
+        except Exception as e:
+            _logger.warning(F"cache entry {path} is unreadable, parse again: {e}")
+    data = parse_raw_data(filepath, content)
+    try:
+        write_cache(path, data)
+    except OSError as e:
+        _logger.warning(F"could not write cache entry {path}: {e}")
+    return data
@@ -0,0 +1,252 @@
+"""a queue of raw files in an SQLite file on a share, worked off by any number of PCs
+
+add puts the workbooks of a backlog into the queue, work takes them out in the process pool
+of this PC until the queue is empty. A taken job has a lease: its worker renews it every few
+seconds while the analysis runs (heartbeat). A worker which crashed or lost the share stops
+renewing, the job is queued again once the lease has expired and taken by the next worker.
+It gets a new export directory <directory>_attempt<n>, the first worker may still be running
+the analysis into the old one (its result is not recorded).
+A job whose lease expired max_attempts times (e.g. a file which kills the worker) fails.
+Analysis errors are recorded as failed without retry, the file would fail again.
+
+The file, the export directories and the raw files must have the same path on all PCs (UNC
+paths like \\\\server\\share on Windows). The journal stays in rollback mode, WAL does not work
+over a network file system. Leases compare the clocks of the PCs, keep them in sync.
+"""
+import contextlib
+import logging
+import os
+import re
+import socket
+import sqlite3
+import time
+from concurrent.futures import FIRST_COMPLETED, wait
+from concurrent.futures.process import BrokenProcessPool
+import aminos
+import batch
+import config
+
+_logger = logging.getLogger("jobqueue")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id INTEGER PRIMARY KEY, file TEXT NOT NULL, export_directory TEXT NOT NULL, status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0, worker TEXT, lease_until REAL, queued_at TEXT NOT NULL, finished_at TEXT,
+    error TEXT, seconds REAL, export_excel_path TEXT, control TEXT, score REAL, conflicts TEXT,
+    second_control TEXT, second_score REAL);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, job_id);
+"""
+# queued -> running -> ok or failed, running jobs with an expired lease count as queued
+STATUSES = ('queued', 'running', 'ok', 'failed')
+RESULT_FIELDS = ('error', 'seconds', 'export_excel_path', 'control', 'score', 'conflicts', 'second_control', 'second_score')
+
+def connect(path):
+    # isolation_level None: the transactions are started explicitly, BEGIN IMMEDIATE locks before reading
+    connection = sqlite3.connect(path, timeout=60, isolation_level=None)
+    connection.executescript(SCHEMA)
+    return connection
+
+@contextlib.contextmanager
+def transaction(connection):
+    """BEGIN IMMEDIATE ... COMMIT, rolled back on any error so no write lock stays behind for the other workers"""
+    connection.execute("BEGIN IMMEDIATE")
+    try:
+        yield connection
+        connection.execute("COMMIT")
+    except BaseException:
+        if connection.in_transaction:
+            connection.execute("ROLLBACK")
+        raise
+
+def worker_name():
+    return F"{socket.gethostname()}:{os.getpid()}"
+
+def add(cfg, path, inputs):
+    """queues the workbooks of inputs (see batch.collect_files) and returns the number of new jobs
+
+    Every file gets its export directory in a new <timestamp>_Queue directory of export_directory,
+    files waiting or running already are not queued twice.
+    """
+    files = batch.collect_files(cfg, inputs)
+    queue_dir = os.path.abspath(os.path.join(cfg['export_directory'], aminos.get_timestamp() + '_Queue'))
+    now = aminos.get_timestamp()
+    connection = connect(path)
+    try:
+        with transaction(connection):
+            pending = {row[0] for row in connection.execute("SELECT file FROM jobs WHERE status IN ('queued', 'running')")}
+            files = [filepath for filepath in files if filepath not in pending]
+            connection.executemany("INSERT INTO jobs (file, export_directory, status, queued_at) VALUES (?, ?, 'queued', ?)",
+                                   ((filepath, export_dir, now) for filepath, export_dir in zip(files, batch.export_directories(files, queue_dir))))
+    finally:
+        connection.close()
+    _logger.info(F"{len(files)} files queued in {path}, results in {queue_dir}")
+    return len(files)
+
+def claim(connection, worker, lease, max_attempts):
+    """takes the next queued job or one with an expired lease, returns (job_id, file, export_directory) or None"""
+    now = time.time()
+    with transaction(connection):
+        expired = connection.execute("UPDATE jobs SET status = 'failed', finished_at = ?, error = ? "
+                                     "WHERE status = 'running' AND lease_until < ? AND attempts >= ?",
+                                     (aminos.get_timestamp(), F"lease expired {max_attempts} times, the worker stopped during the analysis",
+                                      now, max_attempts)).rowcount
+        if expired:
+            _logger.warning(F"{expired} jobs failed after {max_attempts} expired leases")
+        row = connection.execute("SELECT job_id, file, export_directory, worker, attempts FROM jobs "
+                                 "WHERE status = 'queued' OR (status = 'running' AND lease_until < ?) ORDER BY job_id LIMIT 1",
+                                 (now,)).fetchone()
+        if row is not None:
+            job_id, filepath, export_dir, previous, attempts = row
+            if previous is not None:
+                # the worker which lost the lease may still be writing into the old directory
+                export_dir = F"{re.sub(r'_attempt[0-9]+$', '', export_dir)}_attempt{attempts + 1}"
+            connection.execute("UPDATE jobs SET status = 'running', worker = ?, lease_until = ?, attempts = attempts + 1, "
+                               "export_directory = ? WHERE job_id = ?", (worker, now + lease, export_dir, job_id))
+    if row is None:
+        return None
+    if previous is not None:
+        _logger.warning(F"lease of {previous} on {filepath} expired, job taken again, results in {export_dir}")
+    return job_id, filepath, export_dir
+
+def renew(connection, worker, job_ids, lease):
+    """the heartbeat: extends the leases of the running jobs, returns those the worker still holds"""
+    if not len(job_ids):
+        return set()
+    with transaction(connection):
+        connection.executemany("UPDATE jobs SET lease_until = ? WHERE job_id = ? AND worker = ? AND status = 'running'",
+                               ((time.time() + lease, job_id, worker) for job_id in job_ids))
+        return {row[0] for row in connection.execute(F"SELECT job_id FROM jobs WHERE worker = ? AND status = 'running' "
+                                                     F"AND job_id IN ({', '.join('?' * len(job_ids))})", (worker, *job_ids))}
+
+def finish(connection, worker, job_id, result):
+    """records the result of batch.analyse_file, ignored if the lease went to another worker meanwhile"""
+    with transaction(connection):
+        updated = connection.execute(F"UPDATE jobs SET status = ?, finished_at = ?, {', '.join(F'{field} = ?' for field in RESULT_FIELDS)} "
+                                     "WHERE job_id = ? AND worker = ? AND status = 'running'",
+                                     (result['status'], aminos.get_timestamp(), *(result.get(field) for field in RESULT_FIELDS),
+                                      job_id, worker)).rowcount
+    if not updated:
+        _logger.warning(F"job {job_id} ({result['file']}) was taken by another worker, result not recorded")
+
+def release(connection, worker, job_ids, max_attempts=None):
+    """puts jobs back into the queue
+
+    Without max_attempts the worker stops and the attempt does not count. With it the worker
+    process died during the jobs, those with max_attempts attempts fail.
+    """
+    if not len(job_ids):
+        return
+    if max_attempts is None:
+        update = "status = 'queued', attempts = attempts - 1"
+    else:
+        update = F"status = CASE WHEN attempts >= {int(max_attempts)} THEN 'failed' ELSE 'queued' END, " \
+                 F"error = CASE WHEN attempts >= {int(max_attempts)} THEN 'worker process died {int(max_attempts)} times' END"
+    with transaction(connection):
+        connection.executemany(F"UPDATE jobs SET {update}, worker = NULL, lease_until = NULL "
+                               "WHERE job_id = ? AND worker = ? AND status = 'running'", ((job_id, worker) for job_id in job_ids))
+
+def pending(connection):
+    """the number of queued and running jobs"""
+    return connection.execute("SELECT COUNT(*) FROM jobs WHERE status IN ('queued', 'running')").fetchone()[0]
+
+def work(cfg, path, workers=None, lease=120.0, max_attempts=3, interval=5.0, once=False):
+    """analyses the jobs of the queue in a process pool until interrupted, with once until all jobs are done
+
+    lease is the time in seconds after which a job of a silent worker is taken again, the leases
+    are renewed every lease / 4 seconds. interval is the pause while the queue is empty.
+    Returns the number of analysed jobs.
+    """
+    workers = workers or os.cpu_count() or 1
+    worker = worker_name()
+    connection = connect(path)
+    running = {} # future -> (job_id, file)
+    # futures of jobs whose lease went to another worker, they occupy a process until they end
+    # and their result is dropped
+    orphaned = set()
+    done_jobs = 0
+    _logger.info(F"worker {worker} takes jobs of {path} with {workers} processes")
+    log_queue, log_listener = config.forward_logging()
+    executor = batch.worker_pool(cfg, workers, log_queue)
+    try:
+        while True:
+            while len(running) + len(orphaned) < workers:
+                job = claim(connection, worker, lease, max_attempts)
+                if job is None:
+                    break
+                job_id, filepath, export_dir = job
+                running[executor.submit(batch.analyse_file, cfg, filepath, export_dir)] = (job_id, filepath)
+                _logger.info(F"took job {job_id}: {filepath}")
+            if not len(running) and not len(orphaned):
+                # with once the worker also waits for the jobs of others, their leases may still expire
+                if once and not pending(connection):
+                    break
+                time.sleep(interval)
+                continue
+
+            done, _ = wait(list(running) + list(orphaned), timeout=lease / 4, return_when=FIRST_COMPLETED)
+            broken = False
+            for future in done:
+                if future in orphaned:
+                    orphaned.discard(future)
+                    continue
+                job_id, filepath = running.pop(future)
+                try:
+                    result = future.result()
+                except BrokenProcessPool as e:
+                    # a worker process died, e.g. out of memory, the file gets another attempt
+                    _logger.error(F"worker process for {filepath} died: {e}")
+                    release(connection, worker, [job_id], max_attempts)
+                    broken = True
+                    continue
+                finish(connection, worker, job_id, result)
+                done_jobs += 1
+                _logger.info(F"{result['status']}: {filepath}")
+            if broken:
+                release(connection, worker, [job_id for job_id, _ in running.values()], max_attempts)
+                running = {}
+                orphaned = set()
+                executor.shutdown()
+                executor = batch.worker_pool(cfg, workers, log_queue)
+                continue
+            held = renew(connection, worker, [job_id for job_id, _ in running.values()], lease)
+            for future, (job_id, filepath) in list(running.items()):
+                if job_id not in held:
+                    # the lease expired before the heartbeat (e.g. the PC slept), the job runs elsewhere now
+                    # and the result of this worker is dropped
+                    _logger.warning(F"lost the lease of job {job_id}: {filepath}")
+                    running.pop(future)
+                    if not future.cancel():
+                        orphaned.add(future)
+    except KeyboardInterrupt:
+        _logger.info("worker stopped")
+    finally:
+        for future in running:
+            future.cancel()
+        release(connection, worker, [job_id for job_id, _ in running.values()])
+        executor.shutdown()
+        connection.close()
+        if log_listener is not None:
+            log_listener.stop()
+    return done_jobs
+
+def status(path):
+    """the number of jobs per status, running jobs with an expired lease are counted as queued"""
+    connection = connect(path)
+    try:
+        counts = dict.fromkeys(STATUSES, 0)
+        for job_status, expired, count in connection.execute("SELECT status, status = 'running' AND lease_until < ?, COUNT(*) "
+                                                             "FROM jobs GROUP BY 1, 2", (time.time(),)):
+            counts['queued' if expired else job_status] += count
+        return counts
+    finally:
+        connection.close()
+
+def summary(path):
+    """all jobs like the summary of a batch, with status, attempts and worker"""
+    import pandas as pd
+    connection = connect(path)
+    try:
+        return pd.read_sql_query("SELECT file, status, error, seconds, control, score, conflicts, second_control, second_score, "
+                                 "export_excel_path, attempts, worker, queued_at, finished_at FROM jobs ORDER BY job_id", connection)
+    finally:
+        connection.close()
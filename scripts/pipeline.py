@@ -0,0 +1,189 @@
+"""runs the stages of an analysis as a graph and memoizes the results of every stage
+
+A stage declares the values it needs (outputs of other stages or roots like the raw data file),
+the settings of the config its result depends on and the values it returns. Its key hashes its
+name, these settings and the keys of its inputs, the roots are keyed by the content of their files.
+A stage whose key is known returns the stored outputs instead of running, so a changed setting
+or reference file only recomputes the stages below it. Stages whose inputs are ready run side by
+side in threads (the raw data and the two references). Stages must not change their inputs, the
+memoized outputs are shared by all runs of the process.
+"""
+import collections
+import glob
+import hashlib
+import json
+import logging
+import os
+import pickle
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import profiling
+
+_logger = logging.getLogger("pipeline")
+
+Stage = collections.namedtuple('Stage', ['name', 'run', 'inputs', 'outputs', 'settings', 'progress', 'memo', 'disk'])
+# stage results kept in memory per process, the least recently used are dropped
+MEMORY_ENTRIES = 16
+STAGES_DIRECTORY = 'stages'
+
+_memory = collections.OrderedDict()
+_memory_lock = threading.Lock() # the service runs jobs in several threads
+
+def stage(name, run, inputs, outputs, settings=(), progress=None, memo=True, disk=True):
+    """declares a stage, run(cfg, inputs) gets a dict of its inputs and returns a dict of its outputs
+
+    settings: keys of the config the outputs depend on
+    progress: the entry of config.STAGES reported when the stage is reached
+    memo:     False for side effects (the export), these run every time
+    disk:     False keeps the outputs in memory only, e.g. if they have a cache of their own
+    """
+    return Stage(name, run, tuple(inputs), tuple(outputs), tuple(settings), progress, memo, disk)
+
+def stage_key(stage, cfg, keys, version=''):
+    sha = hashlib.sha256(F"{version}/{stage.name}".encode('utf-8'))
+    sha.update(json.dumps([cfg[key] for key in stage.settings], sort_keys=True, default=str).encode('utf-8'))
+    for name in stage.inputs:
+        sha.update(keys[name].encode('utf-8'))
+    return sha.hexdigest()
+
+def memory_get(key):
+    with _memory_lock:
+        if key not in _memory:
+            return None
+        _memory.move_to_end(key)
+        return _memory[key]
+
+def memory_put(key, outputs):
+    with _memory_lock:
+        _memory[key] = outputs
+        _memory.move_to_end(key)
+        while len(_memory) > MEMORY_ENTRIES:
+            _memory.popitem(last=False)
+
+def clear_memory():
+    with _memory_lock:
+        _memory.clear()
+
+def disk_path(directory, key):
+    return os.path.join(directory, STAGES_DIRECTORY, key + '.pickle')
+
+def disk_get(directory, key):
+    path = disk_path(directory, key)
+    if not os.path.isfile(path):
+        return None
+    try:
+        with open(path, 'rb') as f:
+            outputs = pickle.load(f)
+    except Exception as e:
+        _logger.warning(F"stage cache entry {key} is unreadable, run the stage again: {e}")
+        return None
+    os.utime(path)
+    return outputs
+
+def disk_put(directory, key, outputs, max_size_mb):
+    path = disk_path(directory, key)
+    tmp_path = F"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(outputs, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        _logger.warning(F"could not store stage cache entry {key}: {e}")
+        if os.path.isfile(tmp_path):
+            os.remove(tmp_path)
+        return
+    evict(directory, max_size_mb)
+
+def evict(directory, max_size_mb):
+    """removes the least recently used stage results until they fit into max_size_mb"""
+    found = []
+    for path in glob.glob(os.path.join(directory, STAGES_DIRECTORY, '*.pickle')):
+        try:
+            found.append((os.path.getmtime(path), os.path.getsize(path), path))
+        except OSError:
+            pass # removed by another process meanwhile
+    found.sort()
+    total = sum(size for _, size, _ in found)
+    while len(found) and total > max_size_mb * 2**20:
+        _, size, path = found.pop(0)
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        total -= size
+
+def lookup(stage, key, values, previous, memory, directory):
+    """the stored outputs of a stage and where they come from or (None, None)"""
+    if all(name in values for name in stage.outputs):
+        return {name: values[name] for name in stage.outputs}, 'given'
+    previous_keys = previous['stage_keys'] if previous is not None and previous['stage_keys'] is not None else {}
+    if all(previous_keys.get(name) == key for name in stage.outputs):
+        return {name: previous[name] for name in stage.outputs}, 'previous'
+    outputs = memory_get(key) if memory else None
+    if outputs is not None:
+        return outputs, 'memory'
+    outputs = disk_get(directory, key) if directory and stage.disk else None
+    if outputs is not None:
+        if memory:
+            memory_put(key, outputs)
+        return outputs, 'disk'
+    return None, None
+
+def run_stage(stage, cfg, inputs, report):
+    with profiling.attach(report):
+        with profiling.stage(stage.name):
+            outputs = stage.run(cfg, inputs)
+    if set(outputs) != set(stage.outputs):
+        raise ValueError(F"stage {stage.name} returned {', '.join(outputs)} instead of {', '.join(stage.outputs)}")
+    return outputs
+
+def run(cfg, stages, values, keys, previous=None, memory=True, directory=None, max_size_mb=500, version='', progress=None):
+    """runs the stages in the order of their inputs, fills values with their outputs and returns the keys of all values
+
+    values holds the roots and outputs given beforehand (their stages are skipped), keys the
+    content hashes of the roots. A memo stage whose key is known takes its outputs from previous
+    (the values of an earlier run with their keys in previous['stage_keys']), the memory
+    or (with directory) the disk instead of running. version is part of every key, e.g. a hash
+    of the source code. progress is called with the progress name of every reached stage.
+    """
+    keys = dict(keys)
+    pending = list(stages)
+    reported = set()
+    while len(pending):
+        ready = [stage for stage in pending if all(name in keys for name in stage.inputs)]
+        if not len(ready):
+            raise ValueError(F"inputs of the stages {', '.join(stage.name for stage in pending)} are missing")
+        pending = [stage for stage in pending if stage not in ready]
+        for stage in ready:
+            if progress is not None and stage.progress is not None and stage.progress not in reported:
+                reported.add(stage.progress)
+                progress(stage.progress)
+
+        to_run = []
+        for stage in ready:
+            key = stage_key(stage, cfg, keys, version)
+            outputs, source = lookup(stage, key, values, previous, memory, directory) if stage.memo else (None, None)
+            if outputs is None:
+                to_run.append((stage, key))
+                continue
+            with profiling.stage(stage.name, memo=source):
+                values.update(outputs)
+                keys.update((name, key) for name in stage.outputs)
+
+        if len(to_run) < 2:
+            results = [run_stage(stage, cfg, {name: values[name] for name in stage.inputs}, profiling.active()) for stage, _ in to_run]
+        else:
+            # independent stages, mostly file reads and parsing in pandas which releases the GIL
+            with ThreadPoolExecutor(max_workers=len(to_run)) as executor:
+                futures = [executor.submit(run_stage, stage, cfg, {name: values[name] for name in stage.inputs}, profiling.active())
+                           for stage, _ in to_run]
+                results = [future.result() for future in futures]
+        for (stage, key), outputs in zip(to_run, results):
+            values.update(outputs)
+            keys.update((name, key) for name in stage.outputs)
+            if stage.memo and memory:
+                memory_put(key, outputs)
+            if stage.memo and directory and stage.disk:
+                disk_put(directory, key, outputs, max_size_mb)
+    return keys
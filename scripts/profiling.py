@@ -0,0 +1,133 @@
+import datetime
+import functools
+import json
+import logging
+import os
+import platform
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+_logger = logging.getLogger("profiling")
+
+# report of the running analysis per thread, keeps the jobs of the GUI and service threads apart
+_local = threading.local()
+
+# cpu time of the calling thread, the whole process before Python 3.7
+cpu_time = getattr(time, 'thread_time', time.process_time)
+
+def active():
+    return getattr(_local, 'active', None)
+
+def shape(frame):
+    """row and column counts of a data frame or array for a stage record"""
+    if hasattr(frame, 'shape') and len(frame.shape) == 2:
+        return {'rows': int(frame.shape[0]), 'columns': int(frame.shape[1])}
+    return {}
+
+def reset_peak():
+    # before Python 3.9 the peak can not be reset, stages report the peak since their start or an earlier one
+    if hasattr(tracemalloc, 'reset_peak'):
+        tracemalloc.reset_peak()
+
+@contextmanager
+def report(enabled=True, memory=False, **info):
+    """collects the records of all stages run inside, see write_report
+
+    memory traces the peak memory of every stage with tracemalloc, which slows python
+    allocations down noticeably. info is stored as is in the report.
+    """
+    if not enabled:
+        yield None
+        return
+    run_report = {'started': datetime.datetime.now().isoformat(timespec='seconds'),
+                  'python': platform.python_version(), 'pid': os.getpid(), 'memory': memory,
+                  'info': info, 'stages': []}
+    started_tracing = memory and not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+    previous = active()
+    _local.active = {'report': run_report, 'stack': []}
+    try:
+        with stage('total'):
+            yield run_report
+    finally:
+        _local.active = previous
+        if started_tracing:
+            tracemalloc.stop()
+
+@contextmanager
+def stage(name, **counts):
+    """records wall time, cpu time of this thread and (if traced) peak memory of the block
+
+    yields the record, counts can be added to it inside the block. Does nothing outside of report.
+    """
+    current = active()
+    if current is None:
+        yield {}
+        return
+    stack = current['stack']
+    record = {'name': name, 'parent': stack[-1]['record']['name'] if len(stack) else None}
+    record.update(counts)
+    current['report']['stages'].append(record) # in start order, parents before their children
+    frame = {'record': record, 'peak': 0}
+    tracing = current['report']['memory'] and tracemalloc.is_tracing()
+    if tracing:
+        memory, peak = tracemalloc.get_traced_memory()
+        if len(stack):
+            stack[-1]['peak'] = max(stack[-1]['peak'], peak)
+        frame['start_memory'] = memory
+        reset_peak()
+    stack.append(frame)
+    start_wall = time.perf_counter()
+    start_cpu = cpu_time()
+    try:
+        yield record
+    finally:
+        record['wall_s'] = time.perf_counter() - start_wall
+        record['cpu_s'] = cpu_time() - start_cpu
+        stack.pop()
+        if tracing:
+            # the peak of a stage includes the peaks of its children
+            peak = max(frame['peak'], tracemalloc.get_traced_memory()[1])
+            record['peak_mb'] = (peak - frame['start_memory']) / 2**20
+            if len(stack):
+                stack[-1]['peak'] = max(stack[-1]['peak'], peak)
+            reset_peak()
+
+@contextmanager
+def attach(current):
+    """records the stages of this thread into current (active() of another thread), e.g. in a thread pool"""
+    previous = active()
+    # an own stack, the stages of the threads run side by side below the current stage of the caller
+    _local.active = None if current is None else {'report': current['report'], 'stack': list(current['stack'])}
+    try:
+        yield
+    finally:
+        _local.active = previous
+
+def annotate(**counts):
+    """adds counts to the record of the innermost running stage"""
+    current = active()
+    if current is not None and len(current['stack']):
+        current['stack'][-1]['record'].update(counts)
+
+def profiled(name=None):
+    """decorator, records every call of the function as stage"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(name or func.__name__):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def write_report(run_report, path):
+    with open(path, 'w') as fp:
+        json.dump(run_report, fp, indent=4)
+    total = run_report['stages'][0]['wall_s']
+    top_stages = [record for record in run_report['stages'] if record['parent'] == 'total']
+    slowest = max(top_stages, key=lambda record: record['wall_s'], default=None)
+    if slowest is not None:
+        _logger.info(F"run report {path}: {total:.2f} s, slowest stage {slowest['name']} {slowest['wall_s']:.2f} s")
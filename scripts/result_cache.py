@@ -0,0 +1,147 @@
+import glob
+import hashlib
+import json
+import logging
+import os
+import pickle
+import shutil
+import ingest
+
+_logger = logging.getLogger("result_cache")
+
+# bump when the stored data changes, old entries are ignored afterwards
+CACHE_VERSION = 1
+RESULTS_DIRECTORY = 'results'
+DATA_FILE = 'data.pickle'
+EXCEL_FILE = 'analysis.xlsx'
+# settings of the config which do not change the result of an analysis
+UNHASHED_SETTINGS = ('file_to_analyze', 'export_directory', 'cache_directory', 'service_port', 'run_report',
+                     'profile_memory', 'streaming_ingest', 'excel_constant_memory',
+                     'result_cache', 'result_cache_size_mb', 'result_cache_export', 'trend_store',
+                     'stage_memo', 'stage_memo_disk', 'background_io', 'job_queue')
+# the analysis code itself, a changed tool must not return results of the old one
+SOURCE_FILES = ('aminos.py', 'excel.py', 'exporters.py', 'ingest.py', 'pipeline.py')
+
+def enabled(cfg):
+    return bool(cfg['result_cache'] and cfg['cache_directory'])
+
+def settings_hash(cfg):
+    """fingerprint of everything besides the raw data which changes an analysis: config and reference files"""
+    sha = hashlib.sha256()
+    settings = {key: value for key, value in cfg.items() if key not in UNHASHED_SETTINGS}
+    sha.update(json.dumps(settings, sort_keys=True).encode('utf-8'))
+    for key in ('control_reference_file_path', 'patients_reference_file_path'):
+        if os.path.isfile(cfg[key]):
+            sha.update(ingest.file_hash(cfg[key]).encode('utf-8'))
+    return sha.hexdigest()
+
+def source_hash():
+    sha = hashlib.sha256(str(CACHE_VERSION).encode('utf-8'))
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    for name in SOURCE_FILES:
+        path = os.path.join(script_dir, name)
+        if os.path.isfile(path): # frozen executables have no sources, the version has to do
+            sha.update(ingest.file_hash(path).encode('utf-8'))
+    return sha.hexdigest()
+
+def result_key(cfg):
+    """<raw data hash>_<settings hash>, all entries of one raw file share the prefix"""
+    settings = hashlib.sha256((settings_hash(cfg) + source_hash()).encode('utf-8')).hexdigest()
+    return F"{ingest.file_hash(cfg['file_to_analyze'])}_{settings[:32]}"
+
+def entry_path(cache_directory, key):
+    return os.path.join(cache_directory, RESULTS_DIRECTORY, key)
+
+def load(cache_directory, key):
+    """the stored data of an earlier analysis or None, a hit counts as use for the eviction"""
+    path = os.path.join(entry_path(cache_directory, key), DATA_FILE)
+    if not os.path.isfile(path):
+        return None
+    try:
+        with open(path, 'rb') as f:
+            data = pickle.load(f)
+    except Exception as e:
+        _logger.warning(F"result cache entry {key} is unreadable, analyse again: {e}")
+        return None
+    os.utime(path)
+    _logger.info(F"result cache hit {key}")
+    return data
+
+def export_excel(cache_directory, key, excel_path, mode='copy'):
+    """puts the stored excel sheet to excel_path, as copy or (mode 'link') as hard link where possible
+    
+    Returns False for an analysis stored without excel sheet (empty excel_sheets).
+    """
+    source = os.path.join(entry_path(cache_directory, key), EXCEL_FILE)
+    if not os.path.isfile(source):
+        return False
+    if mode == 'link':
+        try:
+            os.link(source, excel_path)
+            return True
+        except OSError as e:
+            _logger.info(F"hard link not possible, copy instead: {e}")
+    shutil.copyfile(source, excel_path)
+    return True
+
+def store(cache_directory, key, data, max_size_mb):
+    """stores data and its excel sheet, the raw data frame is left out (the raw file is kept in the export)"""
+    path = entry_path(cache_directory, key)
+    tmp_path = F"{path}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(tmp_path, exist_ok=True)
+        stored = data.copy()
+        stored['raw_data'] = None
+        if stored['stage_keys'] is not None:
+            # a later reanalyse reads the raw data again (see aminos.run_stages)
+            stored['stage_keys'] = {name: key for name, key in stored['stage_keys'].items() if name != 'raw_data'}
+        with open(os.path.join(tmp_path, DATA_FILE), 'wb') as f:
+            pickle.dump(stored, f, protocol=pickle.HIGHEST_PROTOCOL)
+        if data['export_excel_path'] is not None:
+            shutil.copyfile(data['export_excel_path'], os.path.join(tmp_path, EXCEL_FILE))
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        _logger.warning(F"could not store result cache entry {key}: {e}")
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        return
+    evict(cache_directory, max_size_mb)
+
+def entries(cache_directory):
+    """(last use, size in bytes, path) of all entries"""
+    found = []
+    for path in glob.glob(os.path.join(cache_directory, RESULTS_DIRECTORY, '*')):
+        data_file = os.path.join(path, DATA_FILE)
+        if not path.endswith('.tmp') and os.path.isfile(data_file):
+            size = sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+            found.append((os.path.getmtime(data_file), size, path))
+    return found
+
+def evict(cache_directory, max_size_mb):
+    """removes the least recently used entries until the cache fits into max_size_mb"""
+    found = sorted(entries(cache_directory))
+    total = sum(size for _, size, _ in found)
+    while len(found) and total > max_size_mb * 2**20:
+        _, size, path = found.pop(0)
+        shutil.rmtree(path, ignore_errors=True)
+        total -= size
+        _logger.info(F"result cache entry {os.path.basename(path)} evicted")
+
+def invalidate(cache_directory, files=None):
+    """removes the entries of the given raw data files (all settings) or all entries, returns their number"""
+    if files is None:
+        paths = [path for _, _, path in entries(cache_directory)]
+    else:
+        paths = []
+        for filepath in files:
+            try:
+                file_hash = ingest.file_hash(filepath)
+            except OSError as e:
+                _logger.warning(F"file not found, no cache entries removed for {filepath}: {e}")
+                continue
+            paths += glob.glob(os.path.join(cache_directory, RESULTS_DIRECTORY, file_hash + '_*'))
+    for path in paths:
+        shutil.rmtree(path, ignore_errors=True)
+    _logger.info(F"{len(paths)} result cache entries removed")
+    return len(paths)
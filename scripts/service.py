@@ -0,0 +1,198 @@
+import json
+import logging
+import os
+import socketserver
+import threading
+import time
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import aminos
+import config
+
+_logger = logging.getLogger("service")
+
+# the service only listens on the local machine
+HOST = '127.0.0.1'
+# analyses kept in memory for a re-run with other preferences (see reanalyse)
+JOB_HISTORY = 8
+
+# state of the running service, filled by serve
+_config = {'path': None, 'mtime': None, 'cfg': None}
+_references = {}        # absolute path -> ((mtime, size), table)
+_jobs = OrderedDict()   # job id -> data of the analysis
+_lock = threading.Lock() # one analysis at a time, the export is not made for parallel threads
+_job_counter = 0
+
+def file_stamp(filepath):
+    try:
+        stat = os.stat(filepath)
+    except OSError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+def current_config():
+    """the config of the service, read again when the config file has been changed"""
+    stamp = file_stamp(_config['path'])
+    if _config['cfg'] is None or stamp != _config['mtime']:
+        _logger.info(F"load config {_config['path']}")
+        _config['cfg'] = aminos.read_config(_config['path'])
+        _config['mtime'] = stamp
+    return _config['cfg']
+
+def load_reference(filepath):
+    """a reference table from memory, read again only when the csv file has been changed"""
+    filepath = os.path.abspath(filepath)
+    stamp = file_stamp(filepath)
+    cached = _references.get(filepath)
+    if cached is not None and stamp is not None and cached[0] == stamp:
+        return cached[1]
+    table = aminos.read_reference_data(filepath)
+    if stamp is not None:
+        _references[filepath] = (stamp, table)
+    return table
+
+def load_references(cfg):
+    references = {}
+    references['control_reference'] = load_reference(cfg['control_reference_file_path'])
+    references['patients_reference'] = load_reference(cfg['patients_reference_file_path'])
+    return references
+
+def job_results(cfg, job, data):
+    """the part of the analysis a client needs, keys as in the data of aminos.analyse"""
+    selected = data['selected_control']
+    rings = {}
+    amino_of = {}
+    for ring, ring_data in selected['data'].items():
+        rings[ring] = {'prios_score': float(ring_data['prios_score']),
+                       'conflicts': [list(conflict) for conflict in ring_data['conflicts']]}
+        for conflict in ring_data['conflicts']:
+            for col in conflict:
+                amino_of[col] = data['column_index']['amino_of'][col]
+    results = {}
+    results['job'] = job
+    results['export_dir'] = data['export_dir']
+    results['export_excel_path'] = data['export_excel_path']
+    results['export_paths'] = data['export_paths']
+    results['selected_control'] = {'data': rings,
+                                   'ties': [dict(tie, score=float(tie['score'])) for tie in selected['ties']],
+                                   'best_control_name': selected['best_control_name'],
+                                   'best_control_score': float(selected['best_control_score']),
+                                   'second_best_control_name': selected['second_best_control_name'],
+                                   'second_best_control_score': float(selected['second_best_control_score'])}
+    results['column_index'] = {'amino_of': amino_of}
+    # FLAG_* of aminos.patient_flags, a row per patient
+    patients = data['data_filtered']
+    results['patient_flags'] = {'samples': patients[cfg['columns']['sample_name']].astype(str).tolist(),
+                                'columns': patients.columns[len(data['column_index']['meta']):].tolist(),
+                                'flags': data['patient_flags'].tolist()}
+    return results
+
+def keep_job(data):
+    global _job_counter
+    _job_counter += 1
+    _jobs[_job_counter] = data
+    while len(_jobs) > JOB_HISTORY:
+        _jobs.popitem(last=False)
+    return _job_counter
+
+def analyse_job(request):
+    """analyses request['file'], request['config'] overrides settings of the config file"""
+    cfg = request_config(request)
+    cfg['file_to_analyze'] = os.path.abspath(request['file'])
+    if not os.path.isfile(cfg['file_to_analyze']):
+        raise FileNotFoundError(F"raw data file is missing: {cfg['file_to_analyze']}")
+    data = aminos.analyse(cfg, load_references(cfg))
+    return job_results(cfg, keep_job(data), data)
+
+def reanalyse_job(request):
+    """repeats the analysis request['job'] with the preferences of request['config']"""
+    job = int(request['job'])
+    if job not in _jobs:
+        raise KeyError(F"job {job} is unknown or too old, analyse the file again")
+    cfg = request_config(request)
+    data = aminos.reanalyse(cfg, _jobs[job])
+    return job_results(cfg, keep_job(data), data)
+
+class BadRequest(ValueError):
+    """a request the service cannot analyse, answered with 400"""
+
+def request_config(request):
+    """the config of the service with the overrides of request['config'], checked before the analysis"""
+    cfg = dict(current_config(), **request.get('config', {}))
+    problems = config.validate_config(cfg, analyse=False)
+    if cfg['prefer_control'] != 0 and str(cfg['prefer_control']) not in map(str, cfg['control_ring_samples']):
+        problems.append(F"prefer_control: {cfg['prefer_control']} is not in control_ring_samples "
+                        F"{', '.join(map(str, cfg['control_ring_samples']))}")
+    if len(problems):
+        raise BadRequest('; '.join(problems))
+    return cfg
+
+class ThreadingHTTPServer(socketserver.ThreadingMixIn, HTTPServer):
+    # http.server has its own ThreadingHTTPServer only since Python 3.7
+    daemon_threads = True
+
+class RequestHandler(BaseHTTPRequestHandler):
+    routes = {'/analyse': analyse_job, '/reanalyse': reanalyse_job}
+
+    def reply(self, code, body):
+        content = json.dumps(body, default=str).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def do_GET(self):
+        if self.path == '/status':
+            self.reply(200, {'status': 'ok', 'pid': os.getpid(), 'jobs': list(_jobs.keys())})
+        else:
+            self.reply(404, {'status': 'failed', 'error': F"unknown path {self.path}"})
+
+    def do_POST(self):
+        if self.path == '/shutdown':
+            self.reply(200, {'status': 'ok'})
+            threading.Thread(target=self.server.shutdown).start()
+            return
+        if self.path not in self.routes:
+            self.reply(404, {'status': 'failed', 'error': F"unknown path {self.path}"})
+            return
+        start = time.perf_counter()
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            request = json.loads(self.rfile.read(length) or b'{}')
+            with _lock:
+                results = self.routes[self.path](request)
+        except (BadRequest, aminos.InvalidPreference) as e:
+            # the ring or column is not on the plate, a wrong override, not an error of the service
+            _logger.warning(F"{self.path} rejected: {e}")
+            self.reply(400, {'status': 'failed', 'error': str(e)})
+            return
+        except Exception as e:
+            _logger.exception(F"{self.path} failed")
+            self.reply(500, {'status': 'failed', 'error': F"{type(e).__name__}: {e}"})
+            return
+        results['status'] = 'ok'
+        results['seconds'] = time.perf_counter() - start
+        self.reply(200, results)
+
+    def log_message(self, format, *args):
+        _logger.debug(format % args)
+
+def serve(config_file='config.json', port=None):
+    """answers analysis jobs on localhost until /shutdown is posted
+
+    Python, pandas and the reference tables stay loaded between the jobs, the reference
+    tables and the config file are read again when they have been changed on disk.
+    """
+    _config['path'] = os.path.abspath(config_file)
+    cfg = current_config()
+    if port is None:
+        port = cfg['service_port']
+    load_references(cfg)
+    server = ThreadingHTTPServer((HOST, port), RequestHandler)
+    _logger.info(F"service listens on http://{HOST}:{server.server_address[1]}")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        _logger.info("service stopped")
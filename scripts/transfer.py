@@ -0,0 +1,126 @@
+"""writes into the export directory in the background, it often is a network share with a high latency
+
+An analysis hands the archive copy of the raw file and its finished workbook to Transfers and goes
+on while threads write them (file I/O releases the GIL), wait() returns once everything arrived.
+A file is written under a temporary name in its target directory and renamed there at the end,
+a half written file never shows up under its real name. The workbook is written to the local
+temp directory first (local_path) and moved, xlsxwriter seeks in its output several times.
+"""
+import logging
+import os
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+_logger = logging.getLogger("transfer")
+
+# concurrent writes to the share, the archive copy and the workbook of one analysis
+WORKERS = 2
+
+def part_path(path):
+    return F"{path}.{os.getpid()}.{threading.get_ident()}.part"
+
+def atomic_write(path, content):
+    """writes content (bytes) to path under a temporary name and renames it"""
+    tmp_path = part_path(path)
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+    except OSError:
+        if os.path.isfile(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+def atomic_copy(source, path):
+    """copies source to a temporary name in the target directory and renames it"""
+    tmp_path = part_path(path)
+    try:
+        shutil.copyfile(source, tmp_path)
+        os.replace(tmp_path, path)
+    except OSError:
+        if os.path.isfile(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+def atomic_move(source, path):
+    """moves source to path, a rename on the same file system, else an atomic_copy"""
+    try:
+        os.replace(source, path)
+        return
+    except OSError:
+        pass # another file system, e.g. the local temp directory and a share
+    atomic_copy(source, path)
+    os.remove(source)
+
+def move_staged(local_path, path):
+    """atomic_move of a file of Transfers.local_path, its temp directory is removed afterwards"""
+    atomic_move(local_path, path)
+    os.rmdir(os.path.dirname(local_path))
+
+class Transfers:
+    """the pending writes of one analysis, with background=False every write happens in the calling thread"""
+
+    def __init__(self, background=True):
+        self.background = background
+        self._executor = None
+        self._futures = []
+
+    def submit(self, write, *args):
+        if not self.background:
+            write(*args)
+            return
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix='transfer')
+        self._futures.append(self._executor.submit(write, *args))
+
+    def write(self, path, content):
+        self.submit(atomic_write, path, content)
+
+    def copy(self, source, path):
+        self.submit(atomic_copy, source, path)
+
+    def local_path(self, path):
+        """where to write a file moved to path afterwards (see move), path itself without background
+
+        The file goes into a temp directory of its own and is created by the writer, it gets the
+        usual permissions like a file written to path directly. A mkstemp file would keep its mode
+        0600 through the rename and the other users of the share could not open it.
+        """
+        if not self.background:
+            return path
+        return os.path.join(tempfile.mkdtemp(prefix='aminos_'), os.path.basename(path))
+
+    def move(self, local_path, path):
+        if local_path != path:
+            self.submit(move_staged, local_path, path)
+
+    def discard(self, local_path, path):
+        """removes a file of local_path which is not moved after all, e.g. its writer failed"""
+        if local_path != path:
+            shutil.rmtree(os.path.dirname(local_path), ignore_errors=True)
+
+    def wait(self):
+        """blocks until all writes are done, raises the error of the first failed one"""
+        futures, self._futures = self._futures, []
+        try:
+            for future in futures:
+                future.result()
+        finally:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.wait()
+            return
+        # the analysis failed already, its error is the one to report
+        try:
+            self.wait()
+        except OSError as e:
+            _logger.warning(F"background write failed: {e}")
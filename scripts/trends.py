@@ -0,0 +1,138 @@
+import datetime
+import logging
+import os
+import sqlite3
+import numpy as np
+import pandas as pd
+import ingest
+
+_logger = logging.getLogger("trends")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id INTEGER PRIMARY KEY, file_hash TEXT NOT NULL UNIQUE, raw_file TEXT NOT NULL, run_date TEXT NOT NULL,
+    analysed_at TEXT NOT NULL, export_excel_path TEXT, best_control TEXT, best_score REAL);
+CREATE TABLE IF NOT EXISTS amino_columns (variant TEXT PRIMARY KEY, amino TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS control_values (
+    run_id INTEGER NOT NULL, run_date TEXT NOT NULL, ring INTEGER NOT NULL, sample TEXT NOT NULL,
+    amino TEXT NOT NULL, variant TEXT NOT NULL, value REAL, status INTEGER NOT NULL);
+-- covers the trend query, it is answered from the index without touching the table
+CREATE INDEX IF NOT EXISTS control_values_trend ON control_values (ring, amino, run_date, variant, sample, value, status);
+CREATE TABLE IF NOT EXISTS ring_scores (
+    run_id INTEGER NOT NULL, run_date TEXT NOT NULL, ring INTEGER NOT NULL, score REAL, selected INTEGER NOT NULL);
+CREATE INDEX IF NOT EXISTS ring_scores_ring_date ON ring_scores (ring, run_date, score, selected);
+"""
+
+def connect(path):
+    # several batch workers may record at the same time
+    connection = sqlite3.connect(path, timeout=30)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.executescript(SCHEMA)
+    return connection
+
+def run_date(filepath):
+    """the date of the measurement: the modification time of the instrument export"""
+    return datetime.datetime.fromtimestamp(os.path.getmtime(filepath)).isoformat(timespec='seconds')
+
+def control_records(cfg, data):
+    """one row per control, amino column and measurement: ring, sample, amino, variant, value, status"""
+    controls = data['controls']
+    column_index = data['column_index']
+    ring_idx = np.asarray(data['control_rings'].codes)
+    rings = np.array(cfg['control_ring_samples'])
+    known = ring_idx >= 0
+    amino_pos = [column_index['positions'][col] for col in column_index['amino_columns']]
+    values = controls[column_index['amino_columns']].to_numpy(dtype=float)[known]
+    status = data['control_status'][known][:, amino_pos]
+    n_controls, n_columns = values.shape
+    samples = controls[cfg['columns']['sample_name']].astype(str).to_numpy()[known]
+    return pd.DataFrame({
+        'ring': np.repeat(rings[ring_idx[known]], n_columns),
+        'sample': np.repeat(samples, n_columns),
+        'amino': np.tile([column_index['amino_of'][col] for col in column_index['amino_columns']], n_controls),
+        'variant': np.tile(column_index['amino_columns'], n_controls),
+        'value': values.ravel(),
+        'status': status.ravel().astype(int)})
+
+def record(path, cfg, data):
+    """appends the control values, statuses and ring scores of an analysis, a raw file is recorded once"""
+    file_hash = ingest.file_hash(data['raw_data_file'])
+    date = run_date(data['raw_data_file'])
+    selected = data['selected_control']
+    connection = connect(path)
+    try:
+        with connection:
+            cursor = connection.execute("INSERT OR IGNORE INTO runs (file_hash, raw_file, run_date, analysed_at, export_excel_path, best_control, best_score) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                        (file_hash, data['raw_data_file'], date, datetime.datetime.now().isoformat(timespec='seconds'),
+                                         data['export_excel_path'], str(selected['best_control_name']), float(selected['best_control_score'])))
+            if cursor.rowcount == 0:
+                _logger.info(F"{data['raw_data_file']} is already in the trend store")
+                return False
+            run_id = cursor.lastrowid
+            records = control_records(cfg, data)
+            connection.executemany("INSERT OR IGNORE INTO amino_columns VALUES (?, ?)",
+                                   ((variant, amino_name) for variant, amino_name in data['column_index']['amino_of'].items()))
+            connection.executemany("INSERT INTO control_values VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                                   ((run_id, date, int(ring), sample, amino, variant, None if np.isnan(value) else float(value), int(status))
+                                    for ring, sample, amino, variant, value, status in records.itertuples(index=False)))
+            connection.executemany("INSERT INTO ring_scores VALUES (?, ?, ?, ?, ?)",
+                                   ((run_id, date, int(ring), float(ring_data['prios_score']), int(str(ring) == str(selected['best_control_name'])))
+                                    for ring, ring_data in selected['data'].items()))
+    finally:
+        connection.close()
+    _logger.info(F"{len(records)} control values recorded in {path}")
+    return True
+
+def trend(path, ring, amino, since=None, until=None):
+    """the values of one amino (or amino column) of a control ring over time, Levey-Jennings style
+
+    Returns one row per measurement with run_date, sample, variant, value, status and the z-score
+    against mean and standard deviation of its variant, the columns of an amino are measured on
+    different scales. since/until are ISO dates.
+    """
+    connection = connect(path)
+    try:
+        query = "SELECT run_date, sample, variant, value, status FROM control_values WHERE ring = ? AND amino = ?"
+        params = [int(ring), amino]
+        if connection.execute("SELECT 1 FROM amino_columns WHERE amino = ? LIMIT 1", (amino,)).fetchone() is None:
+            # an amino column, e.g. Asp_cs: its amino picks the index range, the column filters it
+            row = connection.execute("SELECT amino FROM amino_columns WHERE variant = ?", (amino,)).fetchone()
+            params = [int(ring), row[0] if row is not None else amino]
+            query += " AND variant = ?"
+            params.append(amino)
+        if since:
+            query += " AND run_date >= ?"
+            params.append(since)
+        if until:
+            query += " AND run_date < ?"
+            params.append(until)
+        values = pd.read_sql_query(query + " ORDER BY run_date", connection, params=params)
+    finally:
+        connection.close()
+    by_variant = values.groupby('variant')['value']
+    sd = by_variant.transform('std')
+    values['z'] = (values['value'] - by_variant.transform('mean')) / sd.where(sd > 0)
+    return values
+
+def ring_scores(path, ring, since=None, until=None):
+    """score of a control ring per run and whether it has been selected"""
+    query = "SELECT run_date, score, selected FROM ring_scores WHERE ring = ?"
+    params = [int(ring)]
+    if since:
+        query += " AND run_date >= ?"
+        params.append(since)
+    if until:
+        query += " AND run_date < ?"
+        params.append(until)
+    connection = connect(path)
+    try:
+        return pd.read_sql_query(query + " ORDER BY run_date", connection, params=params)
+    finally:
+        connection.close()
+
+def summary(values):
+    """mean, standard deviation and the Levey-Jennings limit violations of a trend, one row per variant"""
+    z = values['z'].abs()
+    grouped = values.assign(over_2sd=z > 2, over_3sd=z > 3).groupby('variant')
+    return pd.DataFrame({'n': grouped['value'].count(), 'mean': grouped['value'].mean(), 'sd': grouped['value'].std(),
+                         'over_2sd': grouped['over_2sd'].sum(), 'over_3sd': grouped['over_3sd'].sum()})
@@ -0,0 +1,144 @@
+import logging
+import os
+import sqlite3
+import time
+from concurrent.futures import FIRST_COMPLETED, wait
+import aminos
+import batch
+import config
+import ingest
+import result_cache
+
+_logger = logging.getLogger("watch")
+
+INDEX_FILE = 'watch_index.sqlite'
+
+def open_index(path):
+    connection = sqlite3.connect(path)
+    connection.execute("""CREATE TABLE IF NOT EXISTS analyses (
+        file_hash TEXT NOT NULL, settings_hash TEXT NOT NULL, file TEXT NOT NULL, status TEXT NOT NULL,
+        error TEXT, export_excel_path TEXT, control TEXT, score REAL, seconds REAL, analysed_at TEXT NOT NULL,
+        PRIMARY KEY (file_hash, settings_hash))""")
+    connection.commit()
+    return connection
+
+def is_analysed(connection, file_hash, settings):
+    # failed files are tried again once the file or the settings change
+    row = connection.execute("SELECT status FROM analyses WHERE file_hash = ? AND settings_hash = ?", (file_hash, settings)).fetchone()
+    return row is not None
+
+def record_result(connection, file_hash, settings, result):
+    connection.execute("INSERT OR REPLACE INTO analyses VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                       (file_hash, settings, result['file'], result['status'], result.get('error', ''),
+                        result.get('export_excel_path', ''), result.get('control', ''), result.get('score'),
+                        result.get('seconds'), aminos.get_timestamp()))
+    connection.commit()
+
+class Fingerprints:
+    """content hashes of the watched files, a file is hashed again only when its size or mtime changes"""
+    __slots__ = ('stamps', 'hashes')
+
+    def __init__(self):
+        self.stamps = {}
+        self.hashes = {}
+
+    def settled(self, filepath):
+        """the file has not changed since the last scan, the instrument has finished writing it"""
+        stat = os.stat(filepath)
+        stamp = (stat.st_mtime_ns, stat.st_size)
+        previous = self.stamps.get(filepath)
+        self.stamps[filepath] = stamp
+        return previous == stamp
+
+    def get(self, filepath):
+        stamp = self.stamps[filepath]
+        cached = self.hashes.get(filepath)
+        if cached is None or cached[0] != stamp:
+            cached = (stamp, ingest.file_hash(filepath))
+            self.hashes[filepath] = cached
+        return cached[1]
+
+def wait_for_changes(directory, timeout):
+    """blocks until something in directory changes (inotify) or timeout seconds passed (polling)"""
+    try:
+        import inotify_simple
+    except ImportError:
+        time.sleep(timeout)
+        return
+    inotify = inotify_simple.INotify()
+    try:
+        flags = inotify_simple.flags
+        inotify.add_watch(directory, flags.CLOSE_WRITE | flags.MOVED_TO | flags.CREATE)
+        inotify.read(timeout=int(timeout * 1000))
+    finally:
+        inotify.close()
+
+def watch(cfg, directory, workers=None, interval=2.0, once=False, index_path=None):
+    """analyses every new or changed workbook dropped into directory until interrupted
+
+    Files are fingerprinted by content, a file analysed before with identical config and
+    reference files is skipped. The analyses are recorded in an SQLite index (default
+    <export_directory>/watch_index.sqlite), so a restart resumes where it stopped. A file is
+    queued once it is unchanged between two scans. once stops when nothing is left to do.
+    """
+    directory = os.path.abspath(directory)
+    os.makedirs(cfg['export_directory'], exist_ok=True)
+    if index_path is None:
+        index_path = os.path.join(cfg['export_directory'], INDEX_FILE)
+    connection = open_index(index_path)
+    fingerprints = Fingerprints()
+    settings = result_cache.settings_hash(cfg)
+    running = {}   # future -> (filepath, file hash, settings hash)
+    queued = set() # file hashes of the running jobs
+    _logger.info(F"watching {directory}, index {index_path}")
+    log_queue, log_listener = config.forward_logging()
+    executor = batch.worker_pool(cfg, workers, log_queue)
+    try:
+        while True:
+            current = result_cache.settings_hash(cfg)
+            if current != settings:
+                # the workers hold the old reference tables
+                _logger.info("reference files changed, restarting the workers")
+                wait(running)
+                executor.shutdown()
+                executor = batch.worker_pool(cfg, workers, log_queue)
+                settings = current
+            waiting = 0
+            for filepath in batch.collect_files(cfg, [directory]):
+                if not fingerprints.settled(filepath):
+                    waiting += 1
+                    continue
+                file_hash = fingerprints.get(filepath)
+                if file_hash in queued or is_analysed(connection, file_hash, settings):
+                    continue
+                export_dir = os.path.join(cfg['export_directory'], os.path.splitext(os.path.basename(filepath))[0])
+                future = executor.submit(batch.analyse_file, cfg, filepath, export_dir)
+                running[future] = (filepath, file_hash, settings)
+                queued.add(file_hash)
+                _logger.info(F"queued {filepath}")
+
+            done = [future for future in running if future.done()]
+            if once and not waiting and not len(running):
+                break
+            if len(running) and not len(done):
+                done, _ = wait(running, timeout=interval, return_when=FIRST_COMPLETED)
+            for future in done:
+                filepath, file_hash, job_settings = running.pop(future)
+                queued.discard(file_hash)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    result = {'file': filepath, 'status': 'failed', 'error': F"{type(e).__name__}: {e}"}
+                record_result(connection, file_hash, job_settings, result)
+                _logger.info(F"{result['status']}: {filepath}")
+            if not len(running) and not len(done):
+                wait_for_changes(directory, interval)
+    except KeyboardInterrupt:
+        _logger.info("watch stopped")
+    finally:
+        for future in running:
+            future.cancel()
+        executor.shutdown()
+        connection.close()
+        if log_listener is not None:
+            log_listener.stop()